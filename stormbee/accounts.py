@@ -0,0 +1,55 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from collections import namedtuple
+
+
+# A test account.  The 'bumblebee_username' is the name that Bumblebee
+# knows the user by (needed for DB remediation); it may be None.
+Account = namedtuple('Account', ['username', 'password', 'bumblebee_username'])
+
+
+def parse_accounts(text):
+    """Parse an account list.
+
+    Each non-blank line that isn't a '#' comment contains a user name,
+    a password and (optionally) a Bumblebee user name, separated by
+    whitespace.
+    """
+
+    accounts = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) not in [2, 3]:
+            raise Exception(
+                f"Account list line {lineno}: expected 'username password "
+                "[bumblebee_username]'"
+            )
+        if len(fields) == 2:
+            fields.append(None)
+        accounts.append(Account(*fields))
+    return accounts
+
+
+def read_accounts(path):
+    "Read an account list file."
+
+    with open(path) as f:
+        accounts = parse_accounts(f.read())
+    if not accounts:
+        raise Exception(f"No accounts found in '{path}'")
+    return accounts
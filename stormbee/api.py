@@ -0,0 +1,622 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# The in-process API.  This lets a program run stormbee actions and
+# scenarios without spawning a 'stormbee' process for each check and
+# parsing its output.  A 'Session' is a browser (and its display) that
+# can be reused for many actions; a 'Runner' does what the 'stormbee'
+# command does for one action.  Both return 'Result' objects rather than
+# exiting.  For example:
+#
+#   with api.Session(config['prod'], 'prod') as session:
+#       result = session.run('scenario', name='basic', desktop='ubuntu')
+#       print(result.outcome, result.steps, result.states)
+
+import argparse
+import logging
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyvirtualdisplay import Display
+
+from stormbee import accounts
+from stormbee.artifacts import ArtifactStore
+from stormbee import compare
+from stormbee import contexts
+from stormbee.driver import BumblebeeDriver
+from stormbee.driver import config_bool
+from stormbee.events import NullEvents
+from stormbee import leases
+from stormbee import onboard
+from stormbee import preflight
+from stormbee import recordings
+from stormbee import soak
+from stormbee import swarm
+
+LOG = logging.getLogger(__name__)
+
+# The arguments that the driver actions and scenarios may look at, with
+# the command line's defaults
+DEFAULT_ARGS = {
+    'show_progress': False,
+    'nagios': False,
+    'summary': None,
+    'deadline': None,
+    'record': None,
+    'desktop': None,
+    'zone': None,
+    'username': None,
+    'password': None,
+    'name': None,
+    'hard': False,
+    'force': False,
+    'url': None,
+}
+
+# The actions that don't use a test account lease
+UNLEASED_ACTIONS = [
+    'swarm',
+    'replay',
+    'compare',
+    'dbreport',
+    'onboard',
+    'parallel',
+    'coordinator',
+    'worker',
+]
+
+
+class UsageError(Exception):
+    "The action can't be run as configured (e.g. a setting is missing)."
+
+
+def make_args(action, **options):
+    "The arguments for an action, as the command line parser would give."
+
+    args = argparse.Namespace(**DEFAULT_ARGS)
+    args.action = action
+    for name, value in options.items():
+        setattr(args, name, value)
+    return args
+
+
+class Result:
+    """The result of running an action.
+
+    The 'outcome' is 'success' or 'failure'.  For a failure, 'failure'
+    is the exception info, and 'artifacts' is where the failure artifacts
+    were saved (if anywhere).  The 'steps' are the step timings, and the
+    'states' are the desktop states seen, in order.  The 'summary' has
+    the other measurements (e.g. page timings and resource usage).
+    """
+
+    def __init__(
+        self,
+        site,
+        action,
+        scenario=None,
+        account=None,
+        failure=None,
+        artifacts=None,
+        steps=None,
+        states=None,
+        summary=None,
+    ):
+        self.site = site
+        self.action = action
+        self.scenario = scenario
+        self.account = account
+        self.failure = failure
+        self.artifacts = artifacts
+        self.steps = steps or []
+        self.states = states or []
+        self.summary = summary or {}
+
+    @property
+    def ok(self):
+        return self.failure is None
+
+    @property
+    def outcome(self):
+        return 'success' if self.ok else 'failure'
+
+    @property
+    def error(self):
+        return None if self.ok else str(self.failure[1])
+
+    def to_dict(self):
+        "The result as a JSON-serializable dict (i.e. the run summary)."
+
+        summary = {'steps': self.steps, 'states': self.states}
+        summary.update(self.summary)
+        return dict(
+            summary,
+            site=self.site,
+            action=self.action,
+            account=self.account,
+            scenario=self.scenario,
+            outcome=self.outcome,
+            error=self.error,
+            artifacts=self.artifacts,
+        )
+
+
+class Session:
+    """A browser for running actions in-process.
+
+    Use this as a context manager.  The browser is started (in its own
+    virtual display, unless 'display' is False) when the session is
+    created, and logged in by the first action that needs it.  Later
+    actions reuse the browser and its login session.  If 'browser' (a
+    stormbee.contexts.ContextBrowser) is given, the session uses a
+    context of that browser rather than starting its own.
+    """
+
+    def __init__(
+        self,
+        site_config,
+        site_name,
+        username=None,
+        password=None,
+        recorder=None,
+        events=None,
+        artifact_store=None,
+        display=True,
+        browser=None,
+    ):
+        self.site_name = site_name
+        self.site_config = site_config
+        self.artifact_store = artifact_store or ArtifactStore(
+            site_config, site_name
+        )
+        self.display = None
+        if display:
+            self.display = Display(
+                backend="xvfb", visible=0, size=[800, 600]
+            ).start()
+        try:
+            self.bd = BumblebeeDriver(
+                site_config,
+                site_name,
+                username=username,
+                password=password,
+                recorder=recorder,
+                events=events,
+                browser=browser,
+            )
+        except Exception:
+            self._stop_display()
+            raise
+        if self.display:
+            self.bd.resources.add_root(self.display.pid, 'xvfb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def login(self, args):
+        if not self.bd.logged_in:
+            self.bd.login(args)
+
+    def run(self, action, args=None, extra_args=(), **options):
+        """Run an action (or with action 'scenario', a scenario).
+
+        The arguments are either 'args' (parsed command line arguments)
+        or the keyword 'options'; e.g. name='basic' for a scenario.
+        Returns a Result.
+        """
+
+        args = args or make_args(action, **options)
+        first_step = len(self.bd.step_timings)
+        first_state = len(self.bd.states)
+        failure = None
+        artifacts = None
+        summary = {}
+        try:
+            if action == 'soak':
+                self.login(args)
+                summary['soak'] = soak.run_soak(
+                    self.bd, self.site_config, args, list(extra_args)
+                )
+                if summary['soak']['flagged'] or summary['soak']['failures']:
+                    raise Exception(
+                        f"Soak: {summary['soak']['failures']} iterations "
+                        f"failed, {summary['soak']['flagged']} series drifted"
+                    )
+            else:
+                if not (action == 'usable' and args.url):
+                    self.login(args)
+                self.bd.run(action, args, list(extra_args))
+        except Exception:
+            failure = sys.exc_info()
+            artifacts = self.artifact_store.capture(self.bd, failure)
+        return Result(
+            self.site_name,
+            action,
+            scenario=args.name,
+            account=self.bd.user_name,
+            failure=failure,
+            artifacts=artifacts,
+            steps=self.bd.step_timings[first_step:],
+            states=self.bd.states[first_state:],
+            summary=summary,
+        )
+
+    def run_summary(self):
+        "The measurements for the whole session."
+
+        return self.bd.run_summary()
+
+    def close(self):
+        # Don't leak external web browser processes!
+        try:
+            self.bd.close()
+        finally:
+            self._stop_display()
+
+    def _stop_display(self):
+        if self.display:
+            self.display.stop()
+            self.display = None
+
+
+class Runner:
+    """Runs one action against a site, as the 'stormbee' command does.
+
+    That is: the preflight checks, leasing a test account, running the
+    action and releasing the lease.  'config' is the whole configuration
+    (the 'compare' action uses two sites).  'run' returns a Result; it
+    raises UsageError if the action can't be run as configured.  Nothing
+    is printed: the action's results are in the Result's summary (even
+    if it fails), for the caller to report.
+    """
+
+    def __init__(self, config, site_name, args, extra_args=(), events=None):
+        self.config = config
+        self.site_name = site_name
+        self.site_config = config[site_name]
+        self.args = args
+        self.extra_args = list(extra_args)
+        self.events = events or NullEvents()
+        self.artifact_store = ArtifactStore(self.site_config, site_name)
+        self.lease_manager = None
+        self.lease = None
+        self.session = None
+        # The action's results, which are kept even if it then fails
+        self.summary = {}
+
+    def run(self):
+        args = self.args
+        try:
+            self.preflight()
+            self.acquire_lease()
+            runner = getattr(self, f"run_{args.action}", None)
+            if runner:
+                self.summary.update(runner() or {})
+                result = Result(
+                    self.site_name, args.action, summary=self.summary
+                )
+            else:
+                result = self._run_browser()
+        except UsageError:
+            raise
+        except Exception:
+            result = Result(
+                self.site_name,
+                args.action,
+                failure=sys.exc_info(),
+                summary=self.summary,
+            )
+        finally:
+            self.release()
+        result.scenario = getattr(args, 'name', None)
+        result.account = args.username or self.site_config.get('Username')
+        return result
+
+    def preflight(self):
+        "Check for a broken environment before paying for a browser."
+
+        if not config_bool(self.site_config, 'Preflight', 'True'):
+            return
+        results = preflight.run_preflight(
+            self.site_config, preflight_checks(self.site_config, self.args)
+        )
+        self.events.emit(
+            'preflight',
+            checks={
+                name: {'error': error, 'ms': int(seconds * 1_000)}
+                for name, error, seconds in results
+            },
+        )
+        errors = preflight.preflight_errors(results)
+        if errors:
+            raise Exception(
+                "CRITICAL: preflight checks failed: " + '; '.join(errors)
+            )
+
+    def acquire_lease(self):
+        """Lease a test account, so that concurrent runs don't interfere
+        with each other.  An account given with 'username' is used as is.
+        """
+
+        if self.args.action in UNLEASED_ACTIONS or self.args.username:
+            return
+        self.lease_manager = leases.LeaseManager(
+            self.site_config, self.site_name
+        )
+        self.lease = self.lease_manager.acquire(
+            leases.account_pool(self.site_config)
+        )
+        account = self.lease.account
+        LOG.info(f"Using test account {account.username}")
+        self.site_config = leases.leased_config(self.site_config, account)
+
+    def release(self):
+        "Release the test account lease (if any)."
+
+        lease, self.lease = self.lease, None
+        if lease:
+            self.lease_manager.release(lease)
+
+    def _run_browser(self):
+        args = self.args
+        with Session(
+            self.site_config,
+            self.site_name,
+            username=args.username,
+            password=args.password,
+            recorder=(
+                recordings.Recorder(args.record) if args.record else None
+            ),
+            events=self.events,
+            artifact_store=self.artifact_store,
+        ) as session:
+            self.session = session
+            result = session.run(args.action, args, self.extra_args)
+        result.summary = dict(session.run_summary(), **result.summary)
+        return result
+
+    def _db(self):
+        if not self.site_config.get('DbHost', None):
+            raise UsageError(
+                f"DbHost is not configured: cannot run {self.args.action}"
+            )
+        # Imported here, so that the MySQL client library is only needed
+        # by the DB actions
+        from stormbee import db
+
+        return db
+
+    def run_reset(self):
+        db = self._db()
+        rep = db.DBRepairer(self.site_config)
+        errors = rep.error_counts()
+        reset = bool(errors or self.args.force)
+        if reset:
+            LOG.info(f"Clearing DB errors: {errors}")
+            rep.fix_errors()
+        return {'db_errors': errors, 'db_reset': reset}
+
+    def run_clear(self):
+        db = self._db()
+        db.DBRepairer(self.site_config).mark_all_as_deleted()
+        return {'db_cleared': True}
+
+    def run_dbreport(self):
+        db = self._db()
+        reporter = db.DBReporter(self.site_config)
+        try:
+            return {
+                'dbreport': db.make_report(
+                    reporter.rows(statuses=self.args.status or ['VM_Error'])
+                )
+            }
+        finally:
+            reporter.close()
+
+    def run_onboard(self):
+        if self.args.accounts:
+            account_list = accounts.read_accounts(self.args.accounts)
+        else:
+            account_list = leases.account_pool(self.site_config)
+        results = onboard.run_onboard(
+            self.site_config,
+            self.site_name,
+            account_list,
+            self.args,
+            parallel=self.args.parallel,
+        )
+        self.summary['onboard'] = [result._asdict() for result in results]
+        failed = sum(
+            1 for result in results if result.outcome == onboard.FAILED
+        )
+        if failed:
+            raise Exception(f"{failed} accounts could not be onboarded")
+        return self.summary
+
+    def run_swarm(self):
+        args = self.args
+        if args.accounts:
+            account_list = accounts.read_accounts(args.accounts)
+        else:
+            account_list = [
+                accounts.Account(
+                    args.username or self.site_config['Username'],
+                    args.password or self.site_config['Password'],
+                    None,
+                )
+            ]
+        summary = swarm.run_swarm(self.site_config, account_list, args)
+        self.summary['swarm'] = summary
+        errors = sum(s['errors'] for s in summary['steps'].values())
+        if errors:
+            raise Exception(f"{errors} swarm steps failed")
+        return self.summary
+
+    def run_compare(self):
+        summary = compare.run_compare(self.config, self.args, self.extra_args)
+        self.summary.update(summary)
+        failed = sum(summary['failures'].values())
+        if failed == 2 * self.args.runs:
+            raise Exception("All of the runs failed")
+        return summary
+
+    def run_parallel(self):
+        """Run a scenario for several test accounts at once.
+
+        Each account has its own context of one shared browser.  Up to
+        'args.contexts' accounts are leased (at least one).
+        """
+
+        args = self.args
+        lease_manager = leases.LeaseManager(self.site_config, self.site_name)
+        pool = leases.account_pool(self.site_config)
+        held = [lease_manager.acquire(pool)]
+        try:
+            while len(held) < args.contexts:
+                lease = lease_manager.try_acquire(pool)
+                if not lease:
+                    break
+                held.append(lease)
+            LOG.info(
+                f"Running '{args.name}' for {len(held)} accounts in one "
+                "browser"
+            )
+            with Display(backend="xvfb", visible=0, size=[800, 600]):
+                browser = contexts.ContextBrowser(self.site_config)
+                try:
+                    with ThreadPoolExecutor(max_workers=len(held)) as executor:
+                        results = list(
+                            executor.map(
+                                lambda lease: self._run_context(
+                                    browser, lease.account
+                                ),
+                                held,
+                            )
+                        )
+                finally:
+                    browser.quit()
+        finally:
+            for lease in held:
+                lease_manager.release(lease)
+
+        self.summary['contexts'] = [result.to_dict() for result in results]
+        failed = sum(1 for result in results if not result.ok)
+        if failed:
+            raise Exception(f"The scenario failed for {failed} accounts")
+        return self.summary
+
+    def _run_context(self, browser, account):
+        with Session(
+            leases.leased_config(self.site_config, account),
+            self.site_name,
+            events=self.events,
+            artifact_store=self.artifact_store,
+            display=False,
+            browser=browser,
+        ) as session:
+            return session.run('scenario', self.args, self.extra_args)
+
+    def run_coordinator(self):
+        # Imported here, because stormbee.distributed uses this module
+        from stormbee import distributed
+
+        results = distributed.run_coordinator(
+            self.site_config, self.site_name, self.args, events=self.events
+        )
+        self.summary['cells'] = results
+        if self.args.nagios:
+            distributed.report_results(self.site_config, results)
+        failed = sum(1 for r in results if r.get('outcome') != 'success')
+        if failed:
+            raise Exception(f"{failed} of {len(results)} cells failed")
+        return self.summary
+
+    def run_worker(self):
+        from stormbee import distributed
+
+        distributed.Worker(
+            self.args.coordinator,
+            self.config,
+            self.site_name,
+            self.args,
+            name=self.args.worker_name,
+            events=self.events,
+        ).run()
+
+    def run_replay(self):
+        results = replay(self.site_config, self.site_name, self.args)
+        self.summary['replay'] = results
+        failed = sum(1 for r in results if not r['ok'])
+        if failed:
+            raise Exception(f"{failed} recorded pages were misclassified")
+        return self.summary
+
+
+def preflight_checks(site_config, args):
+    "The preflight checks that are relevant to the action."
+
+    checks = []
+    # The coordinator doesn't use the site, and a worker's cells are
+    # checked as they are run
+    if args.action not in [
+        'replay',
+        'reset',
+        'clear',
+        'dbreport',
+        'coordinator',
+        'worker',
+    ] and not (args.action == 'usable' and args.url):
+        checks.append('site')
+    if args.action in ['reset', 'clear', 'dbreport'] and site_config.get(
+        'DbHost'
+    ):
+        checks.append('db')
+    if args.nagios:
+        checks.append('nrdp')
+    return checks
+
+
+def replay(site_config, site_name, args):
+    """Check the page checks against a corpus of recorded pages.
+
+    Returns the per-page results.
+    """
+
+    corpus = recordings.load_corpus(args.corpus)
+    if not corpus:
+        raise Exception(f"There are no recordings in '{args.corpus}'")
+    if args.offline:
+        results = recordings.check_corpus(
+            corpus,
+            lambda r: recordings.classify_offline(r, site_config),
+            repeat=args.repeat,
+        )
+        return results
+
+    with Display(backend="xvfb", visible=0, size=[800, 600]):
+        bd = BumblebeeDriver(site_config, site_name)
+        try:
+            with recordings.ReplayServer(corpus) as server:
+                results = recordings.check_corpus(
+                    corpus,
+                    lambda r: bd.page_labels(r.url),
+                    repeat=args.repeat,
+                    prepare=lambda r: bd.load_page(server.url(r)),
+                )
+        finally:
+            bd.close()
+    return results
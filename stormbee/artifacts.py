@@ -0,0 +1,164 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Capture of failure artifacts.  When a check fails, we grab what the
+# browser can tell us (screenshot, page source, console output and
+# performance entries) and save it as a zip file in a per-site directory.
+# The grabbing happens straight away, but the compressing, writing and
+# rotation happen in a background thread so that reporting the failure
+# isn't held up.
+
+import datetime
+import fcntl
+import json
+import logging
+import os
+from os.path import expanduser
+import threading
+import traceback
+import zipfile
+
+LOG = logging.getLogger(__name__)
+
+# Only the end of the browser's console log is kept
+MAX_LOG_BYTES = 1_000_000
+
+PERFORMANCE_SCRIPT = "return performance.getEntries().map((e) => e.toJSON());"
+
+
+class ArtifactStore:
+    """Per-site store of failure artifacts.
+
+    The 'ArtifactDir' setting is the parent directory for the per-site
+    directories.  The 'ArtifactMaxBytes' setting caps the total size
+    of a site's artifacts; the oldest are deleted to stay under it.
+    """
+
+    def __init__(self, site_config, site_name):
+        capture = site_config.get('CaptureArtifacts', 'True')
+        self.enabled = capture.lower() in ['true', 'yes', '1']
+        self.directory = os.path.join(
+            expanduser(
+                site_config.get('ArtifactDir', '~/.stormbee/artifacts')
+            ),
+            site_name,
+        )
+        self.max_bytes = int(site_config.get('ArtifactMaxBytes', '100000000'))
+        self._threads = []
+
+    def capture(self, bd, exc_info=None, extra=None):
+        """Capture the browser's state, and start writing it out.
+
+        The 'extra' dict gives more items (name to content) to save.
+        Returns the path that the artifacts will be written to, or None
+        if nothing was captured.  This never raises an exception: we
+        are already dealing with a failure.
+        """
+
+        if not self.enabled:
+            return None
+        items = dict(extra or {})
+        if exc_info:
+            items['traceback.txt'] = ''.join(
+                traceback.format_exception(*exc_info)
+            )
+        for name, grab in [
+            ('screenshot.png', lambda: bd.driver.get_screenshot_as_png()),
+            ('page.html', lambda: bd.driver.page_source),
+            ('url.txt', lambda: bd.driver.current_url),
+            (
+                'performance.json',
+                lambda: json.dumps(
+                    bd.driver.execute_script(PERFORMANCE_SCRIPT), indent=2
+                ),
+            ),
+            ('console.log', lambda: read_tail(bd.browser_log, MAX_LOG_BYTES)),
+        ]:
+            try:
+                items[name] = grab()
+            except Exception as e:
+                LOG.debug(f"Cannot capture {name}: {e}")
+        if not items:
+            return None
+
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(self.directory, f"failure-{timestamp}.zip")
+        thread = threading.Thread(
+            target=self._write, args=(path, items), daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+        return path
+
+    def wait(self, timeout=None):
+        "Wait for the background writes to finish."
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _write(self, path, items):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with zipfile.ZipFile(
+                tmp_path, 'w', compression=zipfile.ZIP_DEFLATED
+            ) as zf:
+                for name, data in items.items():
+                    if data is not None:
+                        zf.writestr(name, data)
+            os.rename(tmp_path, path)
+            self.rotate(keep=path)
+        except Exception as e:
+            print(f"Cannot write failure artifacts to {path}: {e}")
+
+    def rotate(self, keep=None):
+        """Delete the oldest artifacts until we are under the size cap.
+
+        The 'keep' artifact (i.e. the newest) is never deleted.  Runs
+        that share the directory take turns, using a lock file.
+        """
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            files = []
+            for name in os.listdir(self.directory):
+                if name.startswith('failure-') and name.endswith('.zip'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, name, path, stat.st_size))
+            files.sort()
+            total = sum(f[3] for f in files)
+            for _, _, path, size in files:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Deleted by someone else
+                    pass
+                total -= size
+
+
+def read_tail(path, max_bytes):
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        return f.read()
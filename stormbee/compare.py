@@ -0,0 +1,217 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A/B latency comparison.  The same scenario is run repeatedly against two
+# sites (e.g. a test site running a new Bumblebee release, and production),
+# with the runs interleaved so that changes in load over time affect both
+# sites alike.  The step durations for the two sites are then compared:
+# medians with confidence intervals, and a Mann-Whitney U test for whether
+# one site is systematically slower.  The step durations are far from
+# normally distributed, so these are all distribution-free.
+
+from collections import defaultdict
+import math
+import statistics
+import sys
+import traceback
+
+from pyvirtualdisplay import Display
+from stormbee.driver import BumblebeeDriver
+from stormbee import leases
+
+NORMAL = statistics.NormalDist()
+
+
+def median_ci(values, confidence=0.95):
+    """A distribution-free confidence interval for the median.
+
+    This uses the order statistics whose ranks come from the normal
+    approximation to the binomial distribution.  With few values, the
+    interval is the whole range.  Returns (low, high).
+    """
+
+    values = sorted(values)
+    n = len(values)
+    if not n:
+        return None, None
+    z = NORMAL.inv_cdf(0.5 + confidence / 2)
+    half_width = z * math.sqrt(n) / 2
+    low = max(0, math.floor(n / 2 - half_width))
+    high = min(n - 1, math.ceil(n / 2 + half_width) - 1)
+    return values[low], values[high]
+
+
+def mann_whitney(a, b):
+    """The Mann-Whitney U test for whether 'a' and 'b' differ.
+
+    Returns (U, p), where U is the statistic for 'a' and p is the
+    two-sided p-value.  This uses the normal approximation (with a
+    correction for ties and a continuity correction), which is rough
+    with fewer than about 8 values per sample.
+    """
+
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return None, None
+    combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    n = n1 + n2
+    rank_sum = 0.0
+    tie_term = 0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        # Tied values get the average of their ranks
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(
+            1 for k in range(i, j + 1) if not combined[k][1]
+        )
+        ties = j - i + 1
+        tie_term += ties**3 - ties
+        i = j + 1
+    u = rank_sum - n1 * (n1 + 1) / 2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        # All of the values are the same
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    p = 2 * (1 - NORMAL.cdf(max(z, 0)))
+    return u, min(p, 1.0)
+
+
+def compare_steps(samples_a, samples_b, confidence=0.95):
+    """Compare the step durations for two sites.
+
+    The samples are dicts mapping step names to lists of durations (in
+    ms).  Returns a list of per-step dicts.  The 'change' is the relative
+    change in the median from 'a' to 'b'.
+    """
+
+    results = []
+    for step in sorted(set(samples_a) | set(samples_b)):
+        a = samples_a.get(step, [])
+        b = samples_b.get(step, [])
+        u, p = mann_whitney(a, b)
+        median_a = statistics.median(a) if a else None
+        median_b = statistics.median(b) if b else None
+        results.append(
+            {
+                'step': step,
+                'a': {
+                    'count': len(a),
+                    'median': median_a,
+                    'ci': median_ci(a, confidence),
+                },
+                'b': {
+                    'count': len(b),
+                    'median': median_b,
+                    'ci': median_ci(b, confidence),
+                },
+                'change': (
+                    round((median_b - median_a) / median_a, 3)
+                    if median_a and median_b is not None
+                    else None
+                ),
+                'u': u,
+                'p': round(p, 4) if p is not None else None,
+            }
+        )
+    return results
+
+
+def print_comparison(site_a, site_b, results, alpha):
+    print(
+        f"{'Step':30} {site_a + ' median (CI) ms':>28} "
+        f"{site_b + ' median (CI) ms':>28} {'change':>8} {'p':>7}"
+    )
+
+    def column(side):
+        if not side['count']:
+            return '-'
+        low, high = side['ci']
+        return f"{side['median']:.0f} ({low:.0f}-{high:.0f})"
+
+    for r in results:
+        change = f"{r['change']:+.1%}" if r['change'] is not None else '-'
+        p = f"{r['p']:.4f}" if r['p'] is not None else '-'
+        flag = ' *' if r['p'] is not None and r['p'] < alpha else ''
+        print(
+            f"{r['step'][:30]:30} {column(r['a']):>28} "
+            f"{column(r['b']):>28} {change:>8} {p:>7}{flag}"
+        )
+    print(f"* the difference is significant at the {alpha} level")
+
+
+def run_once(site_config, site_name, args, extra_args):
+    """Run the scenario once against a site.
+
+    Returns the step timings, and the exception info if the run failed.
+    """
+
+    lease_manager = leases.LeaseManager(site_config, site_name)
+    lease = lease_manager.acquire(leases.account_pool(site_config))
+    try:
+        bd = BumblebeeDriver(
+            leases.leased_config(site_config, lease.account), site_name
+        )
+        failure = None
+        try:
+            bd.login(args)
+            bd.run('scenario', args, extra_args)
+        except Exception:
+            failure = sys.exc_info()
+        finally:
+            bd.close()
+        return bd.step_timings, failure
+    finally:
+        lease_manager.release(lease)
+
+
+def run_compare(config, args, extra_args):
+    """Run the A/B comparison, and print (and return) the results.
+
+    Each pair of runs alternates which site goes first.
+    """
+
+    sites = [args.site_a, args.site_b]
+    if args.site_a == args.site_b:
+        raise Exception("The two sites must be different")
+    for site in sites:
+        if site not in config:
+            raise Exception(f"There is no section for site '{site}'")
+    samples = {site: defaultdict(list) for site in sites}
+    failures = {site: 0 for site in sites}
+    with Display(backend="xvfb", visible=0, size=[800, 600]):
+        for i in range(args.runs):
+            for site in sites if i % 2 == 0 else reversed(sites):
+                print(f"Run {i + 1} of {args.runs} on {site}")
+                steps, failure = run_once(config[site], site, args, extra_args)
+                if failure:
+                    failures[site] += 1
+                    print(f"Run failed on {site}:")
+                    traceback.print_exception(*failure)
+                for step in steps:
+                    if step['ok']:
+                        samples[site][step['step']].append(step['ms'])
+    results = compare_steps(
+        samples[args.site_a], samples[args.site_b], args.confidence
+    )
+    print_comparison(args.site_a, args.site_b, results, args.alpha)
+    return {
+        'sites': sites,
+        'runs': args.runs,
+        'failures': failures,
+        'steps': results,
+    }
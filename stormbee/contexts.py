@@ -0,0 +1,153 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Several isolated browser contexts in one Firefox.  The browser is the
+# most expensive part of a probe, so rather than starting a Firefox per
+# test account, we can start one and give each account its own WebDriver
+# BiDi "user context".  User contexts don't share cookies or storage,
+# so each is logged in as its own account.  Each context has a window,
+# and a 'ContextWebDriver' that stands in for a Firefox driver.
+#
+# WebDriver commands apply to the current window, so the contexts take
+# turns: each command is sent with the browser locked, after switching
+# to the context's window (if need be).  The contexts are run by
+# separate threads, and as most of a scenario is spent waiting (i.e.
+# sleeping between polls), their waits interleave.
+
+import inspect
+import logging
+import os
+import tempfile
+import threading
+
+from selenium.webdriver import Firefox
+from selenium.webdriver.firefox.service import Service
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
+from webdriver_manager.firefox import GeckoDriverManager
+
+from stormbee.driver import browser_options
+
+LOG = logging.getLogger(__name__)
+
+# Commands that would move a context out of its own window
+WINDOW_COMMANDS = [Command.SWITCH_TO_WINDOW, Command.NEW_WINDOW]
+
+
+class ContextWebDriver(Firefox):
+    """A Firefox driver bound to one context of a shared browser.
+
+    This shares the browser's WebDriver session.  Each command makes the
+    context's window the current window first.
+    """
+
+    def __init__(self, browser, handle, user_context):
+        # Not a new session: a view of the shared one
+        self.__dict__.update(browser.driver.__dict__)
+        self._switch_to = SwitchTo(self)
+        self.context_browser = browser
+        self.handle = handle
+        self.user_context = user_context
+
+    def execute(self, driver_command, params=None):
+        if inspect.isgenerator(driver_command):
+            # BiDi commands name their browsing context explicitly
+            return super().execute(driver_command, params)
+        if driver_command in WINDOW_COMMANDS:
+            raise Exception(
+                f"Cannot use '{driver_command}' in a shared browser context"
+            )
+        with self.context_browser.lock:
+            self.context_browser.activate(self.handle)
+            return super().execute(driver_command, params)
+
+    def quit(self):
+        self.context_browser.close_context(self)
+
+
+class ContextBrowser:
+    """One Firefox, shared by several isolated contexts.
+
+    This needs a Firefox (121 or later) and Selenium (4.32.0 or later)
+    that support WebDriver BiDi user contexts.
+    """
+
+    def __init__(self, site_config):
+        options = browser_options(site_config)
+        options.enable_bidi = True
+        log_fd, self.log = tempfile.mkstemp(prefix='stormbee-', suffix='.log')
+        os.close(log_fd)
+        self.driver = Firefox(
+            options=options,
+            service=Service(
+                GeckoDriverManager().install(), log_output=self.log
+            ),
+        )
+        self.pid = self.driver.service.process.pid
+        self.lock = threading.RLock()
+        # The browser's own window stays open, so that closing the last
+        # context's window doesn't end the session
+        self.home_handle = self.driver.current_window_handle
+        self.current = self.home_handle
+        self.contexts = []
+
+    def activate(self, handle):
+        "Make a window the current window.  Call this with the lock held."
+
+        if self.current != handle:
+            self.driver.switch_to.window(handle)
+            self.current = handle
+
+    def new_context(self):
+        "Create a context (with its window), returning its driver."
+
+        with self.lock:
+            if not hasattr(self.driver, 'browser'):
+                raise Exception(
+                    "Shared browser contexts need a Selenium with "
+                    "WebDriver BiDi support"
+                )
+            user_context = self.driver.browser.create_user_context()
+            handle = self.driver.browsing_context.create(
+                type='window', user_context=user_context
+            )
+            context = ContextWebDriver(self, handle, user_context)
+            self.contexts.append(context)
+        LOG.debug(f"Created browser context {user_context} ({handle})")
+        return context
+
+    def close_context(self, context):
+        "Close a context, and its window(s)."
+
+        with self.lock:
+            if context not in self.contexts:
+                return
+            self.contexts.remove(context)
+            self.driver.browser.remove_user_context(context.user_context)
+            if self.current == context.handle:
+                self.driver.switch_to.window(self.home_handle)
+                self.current = self.home_handle
+        LOG.debug(f"Closed browser context {context.user_context}")
+
+    def quit(self):
+        with self.lock:
+            for context in list(self.contexts):
+                try:
+                    self.close_context(context)
+                except Exception as e:
+                    LOG.debug(f"Cannot close context: {e}")
+            self.driver.quit()
+        try:
+            os.remove(self.log)
+        except OSError:
+            pass
@@ -11,17 +11,34 @@
 #   under the License.
 #
 
+import json
+import sys
 
 import MySQLdb
+import MySQLdb.cursors
 
 # Hacky code for repairing / resetting the database before (or after)
-# a stormbee test run.
+# a stormbee test run, and for reporting on the errors in it.
+
+
+def connect(config, timeout=None):
+    options = {}
+    if timeout:
+        options['connect_timeout'] = max(1, int(timeout))
+    return MySQLdb.connect(
+        host=config.get('DbHost', '127.0.0.1'),
+        user=config.get('DbUsername', 'bumblebee'),
+        password=config.get('DbPassword', ''),
+        database=config.get('DbDatabase', 'bumblebee'),
+        port=int(config.get('DbPort', '3306')),
+        **options,
+    )
 
 
 class DBRepairer:
     def __init__(self, config):
         self.config = config
-        self.db = self._connect()
+        self.db = connect(config)
         self.db.autocommit = False
         self.user_id = self._get_user_id()
 
@@ -132,7 +149,12 @@ class DBRepairer:
             c.close()
 
     def _get_user_id(self):
-        username = self.config['BumblebeeUsername']
+        username = self.config.get('BumblebeeUsername', None)
+        if not username:
+            raise Exception(
+                f"No BumblebeeUsername for {self.config.get('Username')}: "
+                "cannot find its DB records"
+            )
         c = self.db.cursor()
         try:
             c.execute(
@@ -147,11 +169,182 @@ class DBRepairer:
         finally:
             c.close()
 
-    def _connect(self):
-        return MySQLdb.connect(
-            host=self.config.get('DbHost', '127.0.0.1'),
-            user=self.config.get('DbUsername', 'bumblebee'),
-            password=self.config.get('DbPassword', ''),
-            database=self.config.get('DbDatabase', 'bumblebee'),
-            port=int(self.config.get('DbPort', '3306')),
+
+class DBReporter:
+    """Reports on the records in error (or stuck) for all users.
+
+    Each report is one grouped query per table, read with a streaming
+    (server side) cursor, so there is a row per user and status rather
+    than per record.  The rows are (table, username, status, count,
+    oldest, stuck seconds), where 'oldest' is when the oldest of the
+    records got into that state.  Bumblebee's timestamps are UTC.
+
+    A VMStatus record's age is taken from when it was created, unless
+    the DbStatusChangedColumn setting names a column that records when
+    its status last changed.  Then that is used, falling back to when it
+    was created.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.status_changed = config.get('DbStatusChangedColumn', '')
+        if self.status_changed and not self.status_changed.isidentifier():
+            raise Exception(
+                f"Invalid DbStatusChangedColumn: '{self.status_changed}'"
+            )
+        self.db = connect(config)
+
+    def vmstatus_rows(self, statuses):
+        placeholders = ', '.join(['%s'] * len(statuses))
+        changed = 'vmstatus.created'
+        if self.status_changed:
+            changed = (
+                f"coalesce(vmstatus.{self.status_changed}, vmstatus.created)"
+            )
+        return self._stream(
+            "SELECT 'vmstatus', user.username, vmstatus.status, "
+            f"count(vmstatus.id), min({changed}), "
+            f"timestampdiff(SECOND, min({changed}), utc_timestamp()) "
+            "from vm_manager_vmstatus as vmstatus "
+            "join researcher_workspace_user as user "
+            "on vmstatus.user_id = user.id "
+            f"where vmstatus.status in ({placeholders}) "
+            "group by user.username, vmstatus.status "
+            "order by vmstatus.status, user.username",
+            tuple(statuses),
+        )
+
+    def resource_rows(self):
+        return self._stream(
+            "SELECT 'cloudresource', user.username, 'error_flag', "
+            "count(resource.id), min(resource.error_flag), "
+            "timestampdiff(SECOND, min(resource.error_flag), "
+            "utc_timestamp()) "
+            "from vm_manager_cloudresource as resource "
+            "join researcher_workspace_user as user "
+            "on resource.user_id = user.id "
+            "where resource.error_flag is not NULL "
+            "and resource.deleted is NULL "
+            "group by user.username "
+            "order by user.username",
+            (),
+        )
+
+    def rows(self, statuses=('VM_Error',)):
+        yield from self.vmstatus_rows(statuses)
+        yield from self.resource_rows()
+
+    def _stream(self, query, params):
+        c = self.db.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            c.execute(query, params)
+            # The rows are fetched from the server as we go
+            yield from c
+        finally:
+            c.close()
+
+    def close(self):
+        self.db.close()
+
+
+def format_age(seconds):
+    "A rough, human-readable duration: e.g. '3d 4h'."
+
+    if seconds is None:
+        return '-'
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+class ReportTotals:
+    "Per-table and status totals, accumulated as the records go by."
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, record):
+        total = self.totals.setdefault(
+            (record['table'], record['status']),
+            {
+                'table': record['table'],
+                'status': record['status'],
+                'count': 0,
+                'users': 0,
+                'oldest': None,
+                'stuck_seconds': None,
+            },
+        )
+        total['count'] += record['count']
+        total['users'] += 1
+        stuck = record['stuck_seconds']
+        if stuck is not None and (
+            total['stuck_seconds'] is None or stuck > total['stuck_seconds']
+        ):
+            total['oldest'] = record['oldest']
+            total['stuck_seconds'] = stuck
+
+    def values(self):
+        return list(self.totals.values())
+
+
+def make_report(rows):
+    """Turn a report's rows into records, and total them.
+
+    There is a row per table, user and status, so the report is small
+    even if the tables are large.  The timestamps become strings, so
+    that the report can be saved as JSON.  Returns a dict with the
+    'rows' and the 'totals'.
+    """
+
+    records = []
+    totals = ReportTotals()
+    for table, username, status, count, oldest, stuck in rows:
+        record = {
+            'table': table,
+            'username': username,
+            'status': status,
+            'count': count,
+            'oldest': None if oldest is None else str(oldest),
+            'stuck_seconds': stuck,
+        }
+        records.append(record)
+        totals.add(record)
+    return {'rows': records, 'totals': totals.values()}
+
+
+def print_report(report, format='table', out=None):
+    """Print a report (from 'make_report').
+
+    The formats are 'table' and 'json'.
+    """
+
+    out = out or sys.stdout
+    if format == 'json':
+        out.write(json.dumps(report, indent=1) + '\n')
+        out.flush()
+        return
+    out.write(
+        f"{'Table':<14} {'User':<30} {'Status':<12} {'Count':>6}  "
+        f"{'Oldest (UTC)':<19}  Stuck\n"
+    )
+    for r in report['rows']:
+        out.write(
+            f"{r['table']:<14} {r['username']:<30} {r['status']:<12} "
+            f"{r['count']:>6}  {str(r['oldest']):<19}  "
+            f"{format_age(r['stuck_seconds'])}\n"
+        )
+    for total in report['totals']:
+        out.write(
+            f"Total {total['table']} {total['status']}: "
+            f"{total['count']} records for {total['users']} users, "
+            f"oldest stuck for {format_age(total['stuck_seconds'])}\n"
         )
+    if not report['totals']:
+        out.write("No records in error\n")
+    out.flush()
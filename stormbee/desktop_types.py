@@ -0,0 +1,94 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A per-site on-disk cache of the facts about desktop types; i.e. whether
+# a type exists, whether it is boostable and which zones it can be
+# launched in.  These rarely change (typically only when Bumblebee is
+# upgraded or reconfigured), but finding them out means loading the
+# desktop type's page.  The cache is filled from whichever desktop type
+# page we had to load anyway, and entries expire after a TTL.
+
+import json
+import logging
+import os
+from os.path import expanduser
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class DesktopTypeCache:
+    """Per-site cache of desktop type facts.
+
+    The 'DesktopTypeCacheSeconds' setting is the TTL for the entries.
+    Zero disables the cache.  The cache files live in per-site
+    directories under 'CacheDir'.
+    """
+
+    def __init__(self, site_config, site_name):
+        self.ttl = float(site_config.get('DesktopTypeCacheSeconds', '86400'))
+        self.path = os.path.join(
+            expanduser(site_config.get('CacheDir', '~/.stormbee/cache')),
+            site_name,
+            'desktop_types.json',
+        )
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOG.debug(f"Ignoring corrupt desktop type cache {self.path}")
+            return {}
+
+    def _save(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.rename(tmp_path, self.path)
+        except OSError as e:
+            print(f"Cannot write the desktop type cache {self.path}: {e}")
+
+    def get(self, desktop_type):
+        "The cached facts for a desktop type, or None if not (validly) cached."
+
+        if not self.ttl:
+            return None
+        entry = self._load().get(desktop_type)
+        if not entry or entry['cached'] + self.ttl < time.time():
+            return None
+        return entry['info']
+
+    def put(self, desktop_type, info):
+        "Cache the facts about a desktop type, as just read from its page."
+
+        if not self.ttl:
+            return
+        entries = self._load()
+        old = entries.get(desktop_type)
+        if old and old['info'] != info:
+            LOG.debug(
+                f"Desktop type '{desktop_type}' has changed: "
+                f"{old['info']} -> {info}"
+            )
+        entries[desktop_type] = {'info': info, 'cached': time.time()}
+        self._save(entries)
+
+    def invalidate(self, desktop_type):
+        entries = self._load()
+        if entries.pop(desktop_type, None):
+            self._save(entries)
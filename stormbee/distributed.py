@@ -0,0 +1,710 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Distributed probing.  One prober host can only run so many scenarios in
+# a check interval, so the work can be split between hosts.  A
+# coordinator holds a queue of "cells" (a scenario, zone and desktop type
+# each), and serves it over HTTP.  Workers (on any number of hosts) claim
+# cells, run them and post back the results, including the step timings.
+#
+# A claimed cell is leased to its worker, which renews the lease while
+# the cell runs.  If a worker dies (or loses touch with the coordinator),
+# its lease expires and the cell is given to another worker, up to
+# 'WorkMaxAttempts' attempts in all.  The coordinator also leases the
+# test accounts, from its own account pool, so that workers on different
+# hosts don't use the same account.  Only the user name is sent: each
+# worker looks up the password in its own config.  When all of the cells
+# are done, the coordinator reports the results (to Nagios, if required).
+
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+from stormbee import api
+from stormbee import leases
+from stormbee.events import NullEvents
+from stormbee.nagios import report, service_name
+from stormbee import watchdog
+
+LOG = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+# The outcome of a cell that no worker finished
+LOST = 'lost'
+
+# The header that carries the 'CoordinatorToken' (if set)
+TOKEN_HEADER = 'X-Stormbee-Token'
+
+# A unit of work.  The 'extra_args' are passed to the scenario.
+Cell = namedtuple('Cell', ['scenario', 'zone', 'desktop', 'extra_args'])
+
+
+def parse_cells(text):
+    """Parse a cell list.
+
+    Each non-blank line that isn't a '#' comment contains a scenario
+    name, a zone and a desktop type (and optionally, scenario arguments),
+    separated by whitespace.
+    """
+
+    cells = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) < 3:
+            raise Exception(
+                f"Cell list line {lineno}: expected 'scenario zone desktop "
+                "[scenario arguments]'"
+            )
+        cells.append(Cell(fields[0], fields[1], fields[2], fields[3:]))
+    return cells
+
+
+def read_cells(path):
+    "Read a cell list file."
+
+    with open(path) as f:
+        cells = parse_cells(f.read())
+    if not cells:
+        raise Exception(f"No cells found in '{path}'")
+    return cells
+
+
+class WorkItem:
+    "A cell in the coordinator's queue."
+
+    def __init__(self, id, cell):
+        self.id = id
+        self.cell = cell
+        self.attempts = 0
+        self.worker = None
+        self.expires = None
+        self.lease = None
+        self.result = None
+
+    @property
+    def state(self):
+        if self.result is not None:
+            return DONE
+        return RUNNING if self.worker else PENDING
+
+
+class Coordinator:
+    """The queue of cells, and who is working on them.
+
+    A claimed cell is leased to the worker for 'WorkLeaseSeconds', and
+    the worker renews the lease with heartbeats.  The methods are
+    called by the server's threads.
+    """
+
+    def __init__(self, site_config, site_name, cells, events=None):
+        self.lease_seconds = float(site_config.get('WorkLeaseSeconds', '120'))
+        self.max_attempts = int(site_config.get('WorkMaxAttempts', '2'))
+        self.lease_manager = leases.LeaseManager(site_config, site_name)
+        self.pool = leases.account_pool(site_config)
+        self.events = events or NullEvents()
+        self.items = [WorkItem(id, cell) for id, cell in enumerate(cells)]
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def claim(self, worker):
+        """Lease the next pending cell (and a test account) to a worker.
+
+        Returns the work (as a dict), or None if there is no pending cell
+        or no free test account.
+        """
+
+        with self.lock:
+            self._expire()
+            self.workers[worker] = time.time()
+            item = next((i for i in self.items if i.state == PENDING), None)
+            if not item:
+                return None
+            lease = self.lease_manager.try_acquire(self.pool)
+            if not lease:
+                LOG.debug("All test accounts are leased: no work for now")
+                return None
+            item.attempts += 1
+            item.worker = worker
+            item.lease = lease
+            item.expires = time.time() + self.lease_seconds
+            print(
+                f"Cell {item.id} ({describe(item.cell)}) claimed by {worker} "
+                f"(attempt {item.attempts})"
+            )
+            return {
+                'id': item.id,
+                'scenario': item.cell.scenario,
+                'zone': item.cell.zone,
+                'desktop': item.cell.desktop,
+                'extra_args': item.cell.extra_args,
+                'attempt': item.attempts,
+                'username': lease.account.username,
+                'lease_seconds': self.lease_seconds,
+            }
+
+    def heartbeat(self, worker, id):
+        """Renew a worker's lease on a cell.
+
+        Returns False if the worker no longer holds the cell.
+        """
+
+        with self.lock:
+            self.workers[worker] = time.time()
+            item = self._held(worker, id)
+            if not item:
+                return False
+            item.expires = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, worker, id, result):
+        """Record a cell's result.
+
+        Returns False (and ignores the result) if the worker no longer
+        holds the cell; e.g. because its lease expired.
+        """
+
+        with self.lock:
+            self.workers[worker] = time.time()
+            item = self._held(worker, id)
+            if not item:
+                LOG.debug(f"Ignoring a stale result for cell {id} ({worker})")
+                return False
+            self._finish(item, dict(result, worker=worker))
+            return True
+
+    def expire(self):
+        "Take back the cells of workers whose leases have expired."
+
+        with self.lock:
+            self._expire()
+
+    def give_up(self, reason):
+        "Record the unfinished cells as lost."
+
+        with self.lock:
+            for item in self.items:
+                if item.state != DONE:
+                    self._release(item)
+                    self._finish(item, {'outcome': LOST, 'error': reason})
+
+    @property
+    def done(self):
+        return all(item.state == DONE for item in self.items)
+
+    def wait(self, timeout=None, poll_seconds=1):
+        """Wait until all of the cells are done.
+
+        After 'timeout' seconds (if given), the unfinished cells are
+        recorded as lost.
+        """
+
+        deadline = time.time() + timeout if timeout else None
+        while not self.done:
+            if deadline and time.time() >= deadline:
+                self.give_up(f"Not finished within {timeout} seconds")
+                break
+            time.sleep(poll_seconds)
+            self.expire()
+
+    def status(self):
+        "The state of the queue, and the workers that have been seen."
+
+        with self.lock:
+            counts = {state: 0 for state in [PENDING, RUNNING, DONE]}
+            for item in self.items:
+                counts[item.state] += 1
+            return dict(
+                counts,
+                cells=len(self.items),
+                workers={
+                    name: round(time.time() - seen, 1)
+                    for name, seen in self.workers.items()
+                },
+            )
+
+    def results(self):
+        "The per-cell results, in the order of the cells."
+
+        return [
+            dict(
+                item.result or {},
+                cell=item.id,
+                scenario=item.cell.scenario,
+                zone=item.cell.zone,
+                desktop=item.cell.desktop,
+                attempts=item.attempts,
+            )
+            for item in self.items
+        ]
+
+    def _held(self, worker, id):
+        if not isinstance(id, int) or not 0 <= id < len(self.items):
+            return None
+        item = self.items[id]
+        if item.state != RUNNING or item.worker != worker:
+            return None
+        return item
+
+    def _expire(self):
+        now = time.time()
+        for item in self.items:
+            if item.state != RUNNING or item.expires > now:
+                continue
+            print(
+                f"Worker {item.worker} lost cell {item.id} "
+                f"({describe(item.cell)})"
+            )
+            self.events.emit('worker_lost', worker=item.worker, cell=item.id)
+            worker = item.worker
+            self._release(item)
+            if item.attempts >= self.max_attempts:
+                self._finish(
+                    item,
+                    {
+                        'outcome': LOST,
+                        'worker': worker,
+                        'error': f"No result after {item.attempts} "
+                        "attempts: the workers were lost",
+                    },
+                )
+
+    def _release(self, item):
+        lease, item.lease = item.lease, None
+        item.worker = None
+        if lease:
+            self.lease_manager.release(lease)
+
+    def _finish(self, item, result):
+        self._release(item)
+        item.result = result
+        print(
+            f"Cell {item.id} ({describe(item.cell)}): {result.get('outcome')}"
+        )
+        self.events.emit(
+            'cell_result',
+            cell=item.id,
+            scenario=item.cell.scenario,
+            zone=item.cell.zone,
+            desktop=item.cell.desktop,
+            attempts=item.attempts,
+            worker=result.get('worker'),
+            outcome=result.get('outcome'),
+            error=result.get('error'),
+            steps=result.get('steps', []),
+        )
+
+
+def describe(cell):
+    return f"{cell.scenario} {cell.zone} {cell.desktop}"
+
+
+class CoordinatorServer:
+    """Serves a Coordinator's queue over HTTP, as JSON.
+
+    The workers POST to '/claim', '/heartbeat' and '/result'; '/status'
+    (GET) shows the state of the queue.  If 'token' is given, requests
+    must carry it.  Use this as a context manager.
+    """
+
+    def __init__(self, coordinator, host='127.0.0.1', port=0, token=None):
+        routes = {
+            '/claim': lambda body: {
+                'work': coordinator.claim(body['worker']),
+                'done': coordinator.done,
+            },
+            '/heartbeat': lambda body: {
+                'held': coordinator.heartbeat(body['worker'], body['id'])
+            },
+            '/result': lambda body: {
+                'accepted': coordinator.complete(
+                    body['worker'], body['id'], body['result']
+                )
+            },
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                if self.path != '/status':
+                    self.send_error(404)
+                    return
+                self.reply(coordinator.status())
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                route = routes.get(self.path)
+                if not route:
+                    self.send_error(404)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = json.loads(self.rfile.read(length))
+                    response = route(body)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_error(400, str(e))
+                    return
+                self.reply(response)
+
+            def authorized(self):
+                if token and self.headers.get(TOKEN_HEADER) != token:
+                    self.send_error(403)
+                    return False
+                return True
+
+            def reply(self, response):
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+class Worker:
+    """Claims cells from a coordinator, runs them and posts the results.
+
+    The worker runs one cell at a time (run more workers for more
+    concurrency), until the coordinator says that all of the cells are
+    done.  Each cell is run as the 'stormbee' command would run the
+    scenario, with a fresh browser.
+    """
+
+    def __init__(self, url, config, site_name, args, name=None, events=None):
+        self.url = url.rstrip('/')
+        self.config = config
+        self.site_name = site_name
+        self.site_config = config[site_name]
+        self.args = args
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_seconds = float(
+            self.site_config.get('WorkerPollSeconds', '5')
+        )
+        self.wait_seconds = float(
+            self.site_config.get('CoordinatorWaitSeconds', '300')
+        )
+        self.deadline = args.deadline or float(
+            self.site_config.get('DeadlineSeconds', '0')
+        )
+        self.events = events or NullEvents()
+        self.http = requests.Session()
+        token = self.site_config.get('CoordinatorToken', '')
+        if token:
+            self.http.headers[TOKEN_HEADER] = token
+
+    def post(self, path, body):
+        response = self.http.post(
+            f"{self.url}{path}", json=dict(body, worker=self.name), timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def run(self):
+        "Run cells until there are none left.  Returns the number run."
+
+        count = 0
+        unreachable_since = None
+        while True:
+            try:
+                response = self.post('/claim', {})
+                unreachable_since = None
+            except requests.RequestException as e:
+                unreachable_since = unreachable_since or time.time()
+                if time.time() - unreachable_since > self.wait_seconds:
+                    raise Exception(
+                        f"Cannot reach the coordinator at {self.url}: {e}"
+                    )
+                LOG.debug(f"Cannot reach the coordinator: {e}")
+                time.sleep(self.poll_seconds)
+                continue
+            work = response['work']
+            if work:
+                self.run_cell(work)
+                count += 1
+            elif response['done']:
+                print(f"Worker {self.name}: all cells done ({count} run here)")
+                return count
+            else:
+                time.sleep(self.poll_seconds)
+
+    def run_cell(self, work):
+        """Run a cell, renewing its lease until it is done.
+
+        If the lease is lost (i.e. the coordinator thinks that this worker
+        is dead), the cell is abandoned: its browser is killed, since the
+        test account may already be in use by the cell's next attempt.
+        """
+
+        print(
+            f"Worker {self.name}: running cell {work['id']} "
+            f"({work['scenario']} {work['zone']} {work['desktop']}) as "
+            f"{work['username']}"
+        )
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeats = threading.Thread(
+            target=self._heartbeat,
+            args=(work, stop, lost),
+            daemon=True,
+        )
+        heartbeats.start()
+        try:
+            result = self.execute(work, lost=lost)
+        finally:
+            stop.set()
+        if lost.is_set():
+            # The coordinator won't accept the result
+            print(f"Worker {self.name}: abandoned cell {work['id']}")
+            return
+        for attempt in range(3):
+            try:
+                if not self.post(
+                    '/result', {'id': work['id'], 'result': result}
+                )['accepted']:
+                    print(
+                        f"Worker {self.name}: the result for cell "
+                        f"{work['id']} was too late (the cell was reassigned)"
+                    )
+                return
+            except requests.RequestException as e:
+                LOG.debug(f"Cannot post the result: {e}")
+                time.sleep(self.poll_seconds)
+        print(f"Worker {self.name}: cannot post the result for {work['id']}")
+
+    def execute(self, work, lost=None):
+        """Run a cell's scenario.  Returns the result (as a dict).
+
+        A cell that runs past the deadline (if any), or whose lease is
+        'lost' (an Event), has its browser killed, and fails.
+        """
+
+        start = time.time()
+        account = next(
+            (
+                a
+                for a in leases.account_pool(self.site_config)
+                if a.username == work['username']
+            ),
+            None,
+        )
+        if not account:
+            return {
+                'outcome': 'failure',
+                'error': f"Test account {work['username']} is not in "
+                "this worker's account pool",
+                'seconds': 0,
+            }
+        config = {
+            self.site_name: leases.leased_config(self.site_config, account)
+        }
+        args = api.make_args(
+            'scenario',
+            name=work['scenario'],
+            zone=work['zone'],
+            desktop=work['desktop'],
+            username=account.username,
+            password=account.password,
+            show_progress=self.args.show_progress,
+        )
+        runner = api.Runner(
+            config,
+            self.site_name,
+            args,
+            extra_args=work['extra_args'],
+            events=self.events,
+        )
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(runner.run()), daemon=True
+        )
+        thread.start()
+        lost = lost or threading.Event()
+        deadline_at = start + self.deadline if self.deadline else None
+        while thread.is_alive() and not lost.is_set():
+            timeout = self.poll_seconds
+            if deadline_at:
+                timeout = min(timeout, deadline_at - time.time())
+                if timeout <= 0:
+                    break
+            thread.join(timeout)
+        if thread.is_alive():
+            killed = watchdog.kill_descendants()
+            LOG.debug(f"Killed {killed} browser and display processes")
+            thread.join(10)
+            if lost.is_set():
+                return {
+                    'outcome': LOST,
+                    'account': account.username,
+                    'error': "The lease on the cell was lost",
+                    'seconds': round(time.time() - start, 3),
+                }
+            return {
+                'outcome': 'deadline',
+                'account': account.username,
+                'error': f"Deadline of {self.deadline} seconds exceeded",
+                'seconds': round(time.time() - start, 3),
+            }
+        if not results:
+            return {
+                'outcome': 'failure',
+                'account': account.username,
+                'error': "The run ended without a result",
+                'seconds': round(time.time() - start, 3),
+            }
+        result = results[0]
+        if result.failure:
+            LOG.debug("Cell failed", exc_info=result.failure)
+        return dict(result.to_dict(), seconds=round(time.time() - start, 3))
+
+    def _heartbeat(self, work, stop, lost):
+        interval = work['lease_seconds'] / 3
+        while not stop.wait(interval):
+            try:
+                if not self.post('/heartbeat', {'id': work['id']})['held']:
+                    print(
+                        f"Worker {self.name}: lost the lease on cell "
+                        f"{work['id']}"
+                    )
+                    lost.set()
+                    return
+            except requests.RequestException as e:
+                LOG.debug(f"Heartbeat failed: {e}")
+
+
+def print_results(results):
+    """Print the per-cell results.
+
+    Returns the number of cells that did not succeed.
+    """
+
+    print(
+        f"{'Cell':<40} {'Outcome':<9} {'Tries':>5} {'Seconds':>8}  "
+        "Worker / error"
+    )
+    for r in results:
+        cell = f"{r['scenario']} {r['zone']} {r['desktop']}"
+        seconds = r.get('seconds')
+        seconds = '-' if seconds is None else f"{seconds:.1f}"
+        detail = r.get('error') or r.get('worker') or ''
+        print(
+            f"{cell:<40} {r.get('outcome', '-'):<9} {r['attempts']:>5} "
+            f"{seconds:>8}  {detail}"
+        )
+    failed = sum(1 for r in results if r.get('outcome') != 'success')
+    workers = {r['worker'] for r in results if r.get('worker')}
+    print(
+        f"{len(results)} cells, {failed} not successful, "
+        f"run by {len(workers)} workers"
+    )
+    return failed
+
+
+def report_results(site_config, results):
+    "Report each cell's result to Nagios."
+
+    for r in results:
+        svcname = service_name(r['zone'], r['scenario'], r['desktop'])
+        if r.get('outcome') == 'success':
+            state = 0
+            output = f"OK: scenario succeeded (on {r.get('worker')})"
+        elif r.get('outcome') == LOST:
+            state = 3
+            output = f"UNKNOWN: no result: {r.get('error')}"
+        else:
+            state = 2
+            output = f"ERROR: scenario failed: {r.get('error')}"
+            if r.get('artifacts'):
+                output += f" (artifacts: {r.get('worker')}:{r['artifacts']})"
+        report(site_config, svcname, state=state, output=output, verbose=True)
+
+
+def is_loopback(host):
+    "Test if a host name or address is the loopback interface."
+
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def run_coordinator(site_config, site_name, args, events=None):
+    """Serve the cells to the workers, and wait for their results.
+
+    Returns the per-cell results.  Without a CoordinatorToken, anyone
+    who can reach the coordinator could claim cells and post (bogus)
+    results, so it must then only listen on the loopback interface.
+    """
+
+    host, _, port = args.listen.rpartition(':')
+    host = host or '0.0.0.0'
+    token = site_config.get('CoordinatorToken', '') or None
+    if not token and not is_loopback(host):
+        raise api.UsageError(
+            f"Listening on {host} needs a CoordinatorToken: set one, or "
+            "listen on 127.0.0.1"
+        )
+    cells = read_cells(args.cells)
+    coordinator = Coordinator(site_config, site_name, cells, events=events)
+    with CoordinatorServer(
+        coordinator, host=host, port=int(port), token=token
+    ) as server:
+        print(f"Coordinating {len(cells)} cells at {server.url}")
+        try:
+            coordinator.wait(timeout=args.timeout)
+        except KeyboardInterrupt:
+            coordinator.give_up("The coordinator was interrupted")
+            LOG.debug("Interrupted", exc_info=sys.exc_info())
+        # Give the workers a chance to hear that we are done
+        time.sleep(float(site_config.get('WorkerPollSeconds', '5')))
+    return coordinator.results()
@@ -12,9 +12,15 @@
 #
 
 
+from collections import namedtuple
 from contextlib import contextmanager
+import functools
 import logging
+import os
+import re
+import tempfile
 import time
+from urllib.parse import quote
 
 from selenium.common.exceptions import (
     NoSuchElementException,
@@ -22,6 +28,7 @@ from selenium.common.exceptions import (
 )
 from selenium.webdriver.common.by import By
 from selenium.webdriver import Firefox
+from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.support.ui import Select
 from webdriver_manager.firefox import GeckoDriverManager
@@ -38,10 +45,249 @@ from stormbee.constants import (
     STATE_NOT_LOGGED_IN,
     STATE_UNKNOWN,
 )
+from stormbee.desktop_types import DesktopTypeCache
+from stormbee.events import NullEvents
+from stormbee.ratelimit import RateLimiter
+from stormbee.recordings import desktop_type_from_url
+from stormbee.resources import ResourceMonitor
+from stormbee.resources import tree_rss
 from stormbee import scenarios
+from stormbee.sidecar import SideSession
+from stormbee import timings
+from stormbee.waits import (
+    AnyOf,
+    CanvasDrawn,
+    CanvasPresent,
+    ElementClickable,
+    ElementPresent,
+    StateEquals,
+    UrlMatches,
+    Waiter,
+    WaitTimeout,
+)
 
 LOG = logging.getLogger(__name__)
 
+# The page elements that identify the observable desktop states.  These
+# are tried in order.
+STATE_XPATHS = [
+    ('//small[contains(text(), "Your boosted desktop")]', DESKTOP_SUPERSIZED),
+    ('//h3[contains(text(), "Your Virtual Desktop is")]', DESKTOP_EXISTS),
+    (
+        '//h3[contains(text(), "Your Desktop is currently shelved")]',
+        DESKTOP_SHELVED,
+    ),
+    ('//p[contains(text(), "Virtual Desktop Error")]', DESKTOP_FAILED),
+    ('//p[contains(text(), "worker is busy")]', WORKFLOW_RUNNING),
+    ('//h4[contains(text(), "You haven\'t created a Desktop")]', NO_DESKTOP),
+    ('//h1[contains(text(), "Terms of Service")]', STATE_TOS),
+    ('//a[contains(@title, "Create Project")]', STATE_CREATE_WORKSPACE),
+]
+
+# The states that show that a login worked.
+LOGGED_IN_STATES = [state for _, state in STATE_XPATHS if state != STATE_TOS]
+
+# What to wait for (with an "eager" page load strategy) after loading
+# the various kinds of page.
+HOME_PAGE_READY = ' | '.join(
+    [xpath for xpath, _ in STATE_XPATHS]
+    + ['//form[@id="kc-form-login" or @id="login-form"]']
+)
+CREATE_DESKTOP_BUTTON = '//button[contains(text(), "Create Desktop")]'
+PAGE_NOT_FOUND = (
+    '//h1[contains(text(), "Page Not Found") '
+    'or contains(text(), "Page not found")]'
+)
+# The link on the home page that opens the current desktop
+OPEN_DESKTOP_LINK = '//a[contains(normalize-space(.), "Open Desktop")]'
+
+DESKTOP_PAGE_READY = (
+    '//h6[text()="DEFAULT SIZE"] | '
+    f'{CREATE_DESKTOP_BUTTON} | {PAGE_NOT_FOUND}'
+)
+
+# Evaluates all of the page checks in one round trip to the browser.
+# The arguments are the STATE_XPATHS expressions.
+SNAPSHOT_SCRIPT = """
+const xpaths = arguments[0];
+const matches = xpaths.map((xpath) => document.evaluate(
+  xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue !== null);
+const div = document.querySelector('div[id^="researcher_desktop"]');
+const desktop = div ? div.id.split('-')[1] : null;
+const bar = desktop ?
+  document.getElementById('researcher_desktop-' + desktop + '-bar') : null;
+const message = document.getElementById('progress-bar-message');
+return {
+  origin: performance.timeOrigin,
+  url: document.location.href,
+  title: document.title,
+  matches: matches,
+  desktop: desktop,
+  percent: bar ? bar.getAttribute('aria-valuenow') : null,
+  message: message ? message.innerText : null,
+};
+"""
+
+# The facts about a desktop type, from its '/desktop/<type>' page.  This
+# mirrors stormbee.pages.desktop_type_info.
+DESKTOP_INFO_SCRIPT = """
+const type = arguments[0];
+const headings = Array.from(document.getElementsByTagName('h6')).map(
+  (e) => e.textContent.trim()
+);
+let zones = null;
+const select = document.getElementById(
+  'researcher_workspace-' + type + '-zone'
+);
+if (select) {
+  zones = Array.from(select.getElementsByTagName('option')).map(
+    (e) => e.getAttribute('value')
+  );
+} else {
+  const prefix = 'researcher_workspace-' + type + '-';
+  for (const e of document.getElementsByTagName('p')) {
+    if (e.id.startsWith(prefix)) {
+      zones = [e.id.slice(prefix.length)];
+      break;
+    }
+  }
+}
+return {
+  exists: headings.includes('DEFAULT SIZE'),
+  boostable: headings.includes('BOOST SIZE'),
+  zones: zones,
+};
+"""
+
+# What the page checks found on a page.  The 'states' are all of the
+# states whose page elements are present, in STATE_XPATHS order.  The
+# 'state' is the first of them (i.e. not considering the title), or
+# STATE_UNKNOWN.
+PageSnapshot = namedtuple(
+    'PageSnapshot',
+    ['url', 'title', 'state', 'states', 'desktop', 'percent', 'message'],
+)
+
+# Firefox preferences that stop it from fetching the various kinds
+# of (non-essential) resource.
+RESOURCE_TYPE_PREFS = {
+    'image': [('permissions.default.image', 2)],
+    'font': [('gfx.downloadable_fonts.enabled', False)],
+    'stylesheet': [('permissions.default.stylesheet', 2)],
+    'media': [
+        ('media.autoplay.default', 5),
+        ('media.preload.default', 0),
+    ],
+}
+
+# Requests for blocked URLs are sent to this (non-existent) proxy.
+BLACKHOLE_PROXY = 'PROXY 127.0.0.1:9'
+
+
+def config_list(site_config, key):
+    "Get a comma or newline separated list from the config."
+
+    value = site_config.get(key, '')
+    return [
+        v.strip() for v in value.replace(',', '\n').split('\n') if v.strip()
+    ]
+
+
+def config_bool(site_config, key, default):
+    "Get a true / false setting from the config."
+
+    return site_config.get(key, default).lower() in ['true', 'yes', '1']
+
+
+def blocking_pac(url_patterns):
+    """Make a proxy auto-config script that blocks the given URLs.
+
+    The patterns are shell-style wildcards that are matched against the
+    full URL.  Non-matching URLs are fetched directly.
+    """
+
+    lines = ['function FindProxyForURL(url, host) {']
+    for pattern in url_patterns:
+        quoted = pattern.replace('\\', '\\\\').replace('"', '\\"')
+        lines.append(
+            f'  if (shExpMatch(url, "{quoted}")) return "{BLACKHOLE_PROXY}";'
+        )
+    lines.append('  return "DIRECT";')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def browser_options(site_config):
+    """Build the Firefox options for the browser profile.
+
+    The 'PageLoadStrategy' setting can be 'normal' (wait for the load
+    event), 'eager' (wait for the DOM to be ready) or 'none'.  The
+    'BlockResourceTypes' setting lists the kinds of resource that are
+    not fetched, and 'BlockUrlPatterns' lists wildcard patterns for URLs
+    that are not fetched; e.g. analytics and third-party CSS.
+    """
+
+    options = Options()
+    # Send the pages' console output to the browser log, so that it can
+    # be captured as a failure artifact.
+    options.set_preference('devtools.console.stdout.content', True)
+    strategy = site_config.get('PageLoadStrategy', 'normal').lower()
+    if strategy not in ['normal', 'eager', 'none']:
+        raise Exception(f"Unknown PageLoadStrategy '{strategy}'")
+    options.page_load_strategy = strategy
+
+    for resource_type in config_list(site_config, 'BlockResourceTypes'):
+        try:
+            prefs = RESOURCE_TYPE_PREFS[resource_type.lower()]
+        except KeyError:
+            raise Exception(
+                f"Unknown resource type '{resource_type}' in "
+                f"BlockResourceTypes: use one of {list(RESOURCE_TYPE_PREFS)}"
+            )
+        for name, value in prefs:
+            options.set_preference(name, value)
+
+    url_patterns = config_list(site_config, 'BlockUrlPatterns')
+    if url_patterns:
+        pac = blocking_pac(url_patterns)
+        options.set_preference('network.proxy.type', 2)
+        options.set_preference(
+            'network.proxy.autoconfig_url',
+            'data:application/x-ns-proxy-autoconfig,' + quote(pac),
+        )
+    return options
+
+
+def action(func):
+    """Decorator for driver actions.
+
+    The start of an action is a safe point for recycling the browser.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self.recycle_if_needed()
+        return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def desktop_type_problem(desktop_type, zone, info):
+    "Why the facts rule out the desktop type (or zone), or None."
+
+    if not info['exists']:
+        return (
+            f"Can't find details for desktop type '{desktop_type}' - "
+            "does it exist?"
+        )
+    if zone and info['zones'] is not None and zone not in info['zones']:
+        return (
+            f"Zone {zone} is not available for desktop type "
+            f"'{desktop_type}': the zones are {info['zones']}"
+        )
+    return None
+
 
 def set_viewport_size(driver, width, height):
     window_size = driver.execute_script(
@@ -56,25 +302,169 @@ def set_viewport_size(driver, width, height):
 
 
 class BumblebeeDriver:
-    def __init__(self, site_config, site_name, username=None, password=None):
+    def __init__(
+        self,
+        site_config,
+        site_name,
+        username=None,
+        password=None,
+        recorder=None,
+        events=None,
+        browser=None,
+        geckodriver=None,
+    ):
         self.site_name = site_name
         self.site_config = site_config
         self.user_name = username or self.site_config['Username']
         self.password = password or self.site_config['Password']
         self.base_url = self.site_config['BaseUrl']
         self.home_url = f"{self.base_url}/home/"
-        self.driver = Firefox(service=Service(GeckoDriverManager().install()))
+        # The geckodriver and Firefox output (including console output)
+        log_fd, self.browser_log = tempfile.mkstemp(
+            prefix='stormbee-', suffix='.log'
+        )
+        os.close(log_fd)
+        self.resources = ResourceMonitor(
+            interval=float(self.site_config.get('ResourceSampleSeconds', '1'))
+        )
+        # A shared browser (see stormbee.contexts) to use a context of,
+        # rather than starting our own.  Its processes aren't ours to
+        # monitor or recycle.
+        self.browser = browser
+        # The geckodriver executable.  If it isn't given, it is installed
+        # (if need be) by GeckoDriverManager when the browser first starts.
+        self.geckodriver = geckodriver
+        self.monitor_resources = browser is None and config_bool(
+            self.site_config, 'MonitorResources', 'True'
+        )
+        self.leaked_processes = {}
+
+        # The browser recycling policy.  Zero means "no limit".
+        self.recycle_navigations = int(
+            self.site_config.get('RecycleNavigations', '0')
+        )
+        self.recycle_age = float(
+            self.site_config.get('RecycleAgeSeconds', '0')
+        )
+        self.recycle_rss = (
+            float(self.site_config.get('RecycleMaxRssMb', '0')) * 1_048_576
+        )
+        self.recycles = 0
+        self.logged_in = False
+        self.driver = None
+        self.start_browser()
         self.poll_seconds = int(self.site_config.get('PollSeconds', '5'))
         self.poll_retries = int(self.site_config.get('PollRetries', '50'))
+        self.page_wait_seconds = float(
+            self.site_config.get('PageWaitSeconds', '10')
+        )
+        self._snapshot = None
+        # Whether to measure the time to a usable desktop after a launch
+        # or unshelve, and how long to wait for it
+        # (This opens a tab, which a shared browser context can't do)
+        self.measure_usable = browser is None and config_bool(
+            self.site_config, 'MeasureTimeToUsable', 'False'
+        )
+        self.usable_wait_seconds = float(
+            self.site_config.get('UsableWaitSeconds', '120')
+        )
+        # Where to record the pages that we see (if anywhere)
+        self.recorder = recorder
+        self.desktop_types = DesktopTypeCache(self.site_config, site_name)
+        self.limiter = RateLimiter(self.site_config, site_name)
+        # Whether to do read-only checks in a side session, while the
+        # browser is busy (see stormbee.sidecar)
+        self.pipeline_checks = config_bool(
+            self.site_config, 'PipelineChecks', 'True'
+        )
+        self.side = None
+        self._prefetches = {}
+        # Where to send structured events (see stormbee.events)
+        self.events = events or NullEvents()
+        self.collect_timings = config_bool(
+            self.site_config, 'CollectPageTimings', 'True'
+        )
+        self._timed_origin = None
+        self._step = None
+        self.step_timings = []
+        # The desktop states that were seen, in order
+        self.states = []
+        self.page_timings = []
+        # Element waits use PageWaitSeconds as the default timeout
+        self.waiter = Waiter(
+            self,
+            timeout=self.page_wait_seconds,
+            poll=float(self.site_config.get('WaitPollSeconds', '0.1')),
+        )
+
+    def start_browser(self):
+        if self.browser:
+            self.driver = self.browser.new_context()
+            self.browser_pid = self.browser.pid
+        else:
+            if not self.geckodriver:
+                self.geckodriver = GeckoDriverManager().install()
+            self.driver = Firefox(
+                options=browser_options(self.site_config),
+                service=Service(self.geckodriver, log_output=self.browser_log),
+            )
+            self.browser_pid = self.driver.service.process.pid
+        self.browser_started = time.time()
+        self.navigations = 0
+        self._snapshot = None
+        if self.monitor_resources:
+            self.resources.add_root(self.browser_pid, 'browser')
+            self.resources.start()
 
         # An alternative to the following would be to set the screen
         # size via an options argument to the driver constructor:
         # see https://stackoverflow.com/a/55878622/139985
         set_viewport_size(self.driver, 1024, 768)
 
+    def stop_browser(self):
+        """Quit the browser, and check that its processes have gone.
+
+        Closing the window isn't enough: that leaves geckodriver (and
+        possibly Firefox) running.
+        """
+
+        if not self.driver:
+            return
+        if not self.browser:
+            # Note the browser's processes while they are in its tree
+            self.resources.sample()
+        try:
+            self.driver.quit()
+        finally:
+            self.driver = None
+            if not self.browser:
+                self.check_for_leaks()
+
+    def check_for_leaks(self):
+        "Check that the browser's processes have gone."
+
+        self.resources.sample()
+        leaked = self.resources.survivors(roots=[self.browser_pid])
+        self.resources.remove_root(self.browser_pid)
+        if leaked:
+            print(
+                "WARNING: browser processes still running after close: "
+                + ', '.join(
+                    f"{name} ({pid})" for pid, name in sorted(leaked.items())
+                )
+            )
+            self.leaked_processes.update(leaked)
+
     def close(self):
-        if self.driver:
-            self.driver.close()
+        self.close_side_session()
+        self.stop_browser()
+        self.resources.stop()
+        if self.browser_log:
+            try:
+                os.remove(self.browser_log)
+            except OSError:
+                pass
+            self.browser_log = None
 
     def run(self, action, args, extra_args):
         if action == 'scenario':
@@ -87,100 +477,433 @@ class BumblebeeDriver:
             func = getattr(self, args.action)
             func(args)
 
+    def recycle_reason(self):
+        "Check the recycling policy.  Returns why to recycle, or None."
+
+        if self.browser:
+            return None
+        if self.recycle_navigations and (
+            self.navigations >= self.recycle_navigations
+        ):
+            return f"{self.navigations} page loads"
+        age = time.time() - self.browser_started
+        if self.recycle_age and age >= self.recycle_age:
+            return f"browser age {int(age)} s"
+        if self.recycle_rss:
+            rss = tree_rss([self.browser_pid])
+            if rss >= self.recycle_rss:
+                return f"browser RSS {rss // 1_048_576} MB"
+        return None
+
+    def recycle_if_needed(self):
+        """Replace the browser if the recycling policy says so.
+
+        This must only be called at a safe point; i.e. between actions.
+        The login session is carried over to the new browser.
+        """
+
+        reason = self.recycle_reason()
+        if not reason:
+            return
+        print(f"Recycling the browser: {reason}")
+        self.events.emit('recycle', reason=reason)
+        cookies = self.driver.get_cookies() if self.logged_in else []
+        self.stop_browser()
+        self.start_browser()
+        self.recycles += 1
+        if not self.logged_in:
+            return
+        # Cookies can only be set for the domain of the current page
+        self.load_page(self.base_url)
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception as e:
+                LOG.debug(f"Cannot restore cookie {cookie.get('name')}: {e}")
+        if self.get_desktop_state() in [STATE_NOT_LOGGED_IN, STATE_UNKNOWN]:
+            LOG.debug("Session cookies didn't work: logging in again")
+            self.login(None)
+
+    def load_page(self, url, ready=None):
+        """Navigate to a URL.
+
+        If 'ready' is given, wait until an element matching that XPath is
+        present.  This is what makes an "eager" page load strategy safe:
+        we only wait for the elements that the caller needs.
+        """
+
+        self.invalidate()
+        self.navigations += 1
+        self.limiter.acquire('navigation')
+        self.driver.get(url)
+        if ready:
+            try:
+                self.waiter.until(ElementPresent(By.XPATH, ready))
+            except WaitTimeout:
+                # Let the caller's checks report what is wrong
+                LOG.debug(f"Timed out waiting for '{ready}' on {url}")
+        self.record_page_timing()
+        if self.recorder:
+            # Record every page that we navigate to
+            self.snapshot()
+
+    def record_page_timing(self):
+        """Record the browser's timings for the current page.
+
+        This is done once per page; i.e. per navigation, including
+        navigations caused by clicks and redirects.
+        """
+
+        if not self.collect_timings:
+            return
+        raw = self.driver.execute_script(timings.TIMING_SCRIPT)
+        if raw['origin'] == self._timed_origin:
+            return
+        self._timed_origin = raw['origin']
+        summary = timings.summarise_page(raw, label=self._step)
+        LOG.debug(f"Page timing: {summary}")
+        self.page_timings.append(summary)
+
+    def invalidate(self):
+        "Forget the page snapshot because the page has (or may have) changed."
+
+        self._snapshot = None
+
+    def click(self, element, limit=None):
+        """Click an element, allowing for the page changing as a result.
+
+        If the click submits something, 'limit' is the rate limiter
+        bucket for it.
+        """
+
+        if limit:
+            self.limiter.acquire(limit)
+        self.invalidate()
+        element.click()
+
+    def snapshot(self, refresh=False):
+        """Get the page snapshot for the current page.
+
+        The snapshot is taken at most once per page, unless 'refresh' is
+        set.  That is needed for pages that update themselves, like the
+        home page while a workflow is running.
+        """
+
+        if self._snapshot is None or refresh:
+            raw = self.driver.execute_script(
+                SNAPSHOT_SCRIPT, [xpath for xpath, _ in STATE_XPATHS]
+            )
+            if raw['origin'] != self._timed_origin:
+                # A page we haven't seen before
+                self.record_page_timing()
+            states = tuple(
+                state
+                for (_, state), match in zip(STATE_XPATHS, raw['matches'])
+                if match
+            )
+            self._snapshot = PageSnapshot(
+                url=raw['url'],
+                title=raw['title'],
+                state=states[0] if states else STATE_UNKNOWN,
+                states=states,
+                desktop=raw['desktop'],
+                percent=raw['percent'],
+                message=raw['message'],
+            )
+            if self.recorder:
+                self.record_page(self._snapshot)
+        return self._snapshot
+
+    def desktop_type_info(self, desktop_type):
+        """Get the facts about a desktop type from its page.
+
+        Returns a dict with 'exists', 'boostable' and 'zones' entries.
+        The current page must be the desktop type's page.
+        """
+
+        return self.driver.execute_script(DESKTOP_INFO_SCRIPT, desktop_type)
+
+    def page_labels(self, url=None, snapshot=None):
+        """What the page checks make of the current page.
+
+        This is what record mode records.  The 'url' (by default, the
+        page's URL) says whether this is a desktop type page.
+        """
+
+        snapshot = snapshot or self.snapshot(refresh=True)
+        labels = {
+            'state': self.page_state(snapshot),
+            'desktop': snapshot.desktop,
+        }
+        desktop_type = desktop_type_from_url(url or snapshot.url)
+        if desktop_type:
+            labels['desktop_type'] = self.desktop_type_info(desktop_type)
+        return labels
+
+    def record_page(self, snapshot):
+        try:
+            self.recorder.record(
+                snapshot.url,
+                snapshot.title,
+                self.driver.page_source,
+                self.page_labels(snapshot=snapshot),
+            )
+        except Exception as e:
+            # Recording must not break the run
+            LOG.warning(f"Cannot record {snapshot.url}: {e}")
+
+    def home_snapshot(self):
+        "Get the snapshot for the home page, loading it if necessary."
+
+        if self.snapshot().url != self.home_url:
+            self.load_page(self.home_url, ready=HOME_PAGE_READY)
+        return self.snapshot()
+
+    def page_state(self, snapshot):
+        "Figure out the desktop state from a snapshot of the home page."
+
+        if snapshot.title in [
+            self.site_config['KeycloakLoginTitle'],
+            self.site_config['ClassicLoginTitle'],
+        ]:
+            return STATE_NOT_LOGGED_IN
+        return snapshot.state
+
     @contextmanager
     def timeit_context(self, description):
+        """Time a step.
+
+        Time spent waiting for the rate limiter isn't part of the step's
+        latency: it is reported separately.
+        """
+
         print(f'Starting {description}')
+        self.events.emit('step_start', step=description)
+        outer_step = self._step
+        self._step = description
         start_time = time.time()
-        yield
+        start_wait = self.limiter.total_wait
+        try:
+            yield
+        except Exception as e:
+            self.record_step(
+                description,
+                time.time() - start_time,
+                False,
+                self.limiter.total_wait - start_wait,
+                error=str(e),
+            )
+            raise
+        finally:
+            self._step = outer_step
         elapsed_time = time.time() - start_time
-        print(
+        limiter_wait = self.limiter.total_wait - start_wait
+        self.record_step(description, elapsed_time, True, limiter_wait)
+        message = (
             f'Finished {description} finished in '
-            f'{int(elapsed_time * 1_000)} ms'
+            f'{int((elapsed_time - limiter_wait) * 1_000)} ms'
         )
+        if limiter_wait:
+            message += (
+                f' (plus {int(limiter_wait * 1_000)} ms '
+                'waiting for the rate limiter)'
+            )
+        print(message)
+
+    def record_step(
+        self, description, seconds, ok, limiter_wait=0, error=None
+    ):
+        step = {
+            'step': description,
+            'ms': int((seconds - limiter_wait) * 1_000),
+            'limiter_ms': int(limiter_wait * 1_000),
+            'ok': ok,
+        }
+        self.step_timings.append(step)
+        self.events.emit('step_end', error=error, **step)
+
+    def run_summary(self):
+        "The machine-readable measurements for this run."
+
+        return {
+            'steps': self.step_timings,
+            'waits': [
+                {
+                    'wait': w.description,
+                    'ms': int(w.seconds * 1_000),
+                    'ok': w.ok,
+                }
+                for w in self.waiter.timings
+            ],
+            'pages': self.page_timings,
+            'rate_limiter': self.limiter.summary(),
+            'resources': dict(
+                self.resources.summary(),
+                browser_recycles=self.recycles,
+                leaked_processes=[
+                    {'pid': pid, 'name': name}
+                    for pid, name in sorted(self.leaked_processes.items())
+                ],
+            ),
+        }
 
     def get_desktop_state(self):
         "Figure out the current state of the user's desktop."
 
-        if self.driver.current_url != self.home_url:
-            self.driver.get(self.home_url)
-        if self.driver.title in [
-            self.site_config['KeycloakLoginTitle'],
-            self.site_config['ClassicLoginTitle'],
-        ]:
-            return STATE_NOT_LOGGED_IN
-        states = [
-            (
-                '//small[contains(text(), "Your boosted desktop")]',
-                DESKTOP_SUPERSIZED,
-            ),
-            (
-                '//h3[contains(text(), "Your Virtual Desktop is")]',
-                DESKTOP_EXISTS,
-            ),
-            (
-                '//h3[contains(text(), "Your Desktop is currently shelved")]',
-                DESKTOP_SHELVED,
-            ),
-            ('//p[contains(text(), "Virtual Desktop Error")]', DESKTOP_FAILED),
-            ('//p[contains(text(), "worker is busy")]', WORKFLOW_RUNNING),
-            (
-                '//h4[contains(text(), "You haven\'t created a Desktop")]',
-                NO_DESKTOP,
-            ),
-            ('//h1[contains(text(), "Terms of Service")]', STATE_TOS),
-            (
-                '//a[contains(@title, "Create Project")]',
-                STATE_CREATE_WORKSPACE,
-            ),
-        ]
-        for xpath, state in states:
-            try:
-                self.driver.find_element(By.XPATH, xpath)
-                return state
-            except NoSuchElementException:
-                pass
-        LOG.debug(f"Page body for unknown state:\n{self.driver.page_source}")
-        return STATE_UNKNOWN
+        snapshot = self.home_snapshot()
+        state = self.page_state(snapshot)
+        self.states.append(state)
+        self.events.emit('state', state=state, desktop=snapshot.desktop)
+        if state == STATE_UNKNOWN and LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug(
+                f"Page body for unknown state:\n{self.driver.page_source}"
+            )
+        return state
 
     def get_current_desktop(self):
         "Figure out the desktop type for the current desktop."
 
-        if self.driver.current_url != self.home_url:
-            self.driver.get(self.home_url)
-
-        try:
-            div = self.driver.find_element(
-                By.XPATH, '//div[starts-with(@id, "researcher_desktop")]'
-            )
-        except NoSuchElementException:
+        desktop = self.home_snapshot().desktop
+        if not desktop:
             raise Exception("There is no current desktop")
+        return desktop
 
-        id = div.get_attribute('id')
-        return id.split('-')[1]
+    def side_session(self):
+        "The side session, which is created when it is first needed."
 
-    def is_boostable(self, args):
-        "Test if the target desktop type is valid and supports Boost"
+        if self.side is None:
+            self.side = SideSession(self)
+        return self.side
+
+    def close_side_session(self):
+        if self.side is not None:
+            self.side.close()
+            self.side = None
+        self._prefetches = {}
+
+    def prefetch_desktop_type(self, args, refresh=False):
+        """Start fetching the facts about the target desktop type.
+
+        They are fetched by the side session, so the browser is free to
+        do something else in the meantime.  A later 'get_desktop_type'
+        picks up the result.  This does nothing if PipelineChecks is off,
+        or if the facts are cached and 'refresh' isn't set.  Returns the
+        prefetch's future, if one was started.
+        """
 
         desktop_type = args.desktop or self.site_config['DesktopType']
+        pending = self._prefetches.get(desktop_type)
+        if (
+            not self.pipeline_checks
+            or (pending and not (refresh and pending.done()))
+            or (
+                not refresh
+                and self.desktop_types.get(desktop_type) is not None
+            )
+        ):
+            return
+        try:
+            side = self.side_session()
+        except Exception as e:
+            LOG.debug(f"Cannot start the side session: {e}")
+            return
+        future = side.submit(side.desktop_type_info, desktop_type)
+        self._prefetches[desktop_type] = future
+        return future
+
+    def collect_prefetch(self, future):
+        """Stop holding a prefetch for 'get_desktop_type' once it is done
+        and its facts are in the desktop type cache.
+
+        One that isn't done yet is left for 'get_desktop_type' to wait
+        for, as is one whose facts couldn't be cached (e.g. because the
+        cache is turned off).
+        """
+
+        if not future.done():
+            return
+        for desktop_type, prefetch in list(self._prefetches.items()):
+            if (
+                prefetch is future
+                and self.desktop_types.get(desktop_type) is not None
+            ):
+                del self._prefetches[desktop_type]
+
+    def prefetched_desktop_type(self, desktop_type):
+        "The prefetched facts about a desktop type, or None."
 
-        self.driver.get(f"{self.base_url}/desktop/{desktop_type}")
+        future = self._prefetches.pop(desktop_type, None)
+        if future is None:
+            return None
         try:
-            self.driver.find_element(By.XPATH, '//h6[text()="DEFAULT SIZE"]')
-        except NoSuchElementException:
-            raise Exception(
-                "Can't find details for desktop type "
-                f"'{desktop_type}' - does it exist?"
+            return future.result(timeout=self.page_wait_seconds)
+        except Exception as e:
+            # The browser can still get them
+            LOG.debug(f"Prefetch of desktop type '{desktop_type}' failed: {e}")
+            return None
+
+    def get_desktop_type(self, desktop_type, refresh=False, load=True):
+        """Get the facts about a desktop type.
+
+        They come from a prefetch or the desktop type cache if possible.
+        Otherwise (or if 'refresh' is set) the desktop type's page is
+        loaded, unless 'load' is False, in which case this returns None.
+        """
+
+        info = None
+        if not refresh:
+            info = self.prefetched_desktop_type(
+                desktop_type
+            ) or self.desktop_types.get(desktop_type)
+        if info is None and not (load or refresh):
+            return None
+        if info is None:
+            self.load_page(
+                f"{self.base_url}/desktop/{desktop_type}",
+                ready=DESKTOP_PAGE_READY,
             )
-        try:
-            self.driver.find_element(By.XPATH, '//h6[text()="BOOST SIZE"]')
-            return True
-        except NoSuchElementException:
-            return False
+            info = self.desktop_type_info(desktop_type)
+            self.desktop_types.put(desktop_type, info)
+        return info
+
+    def check_desktop_type(self, args, load=True):
+        """Check that the target desktop type (and zone) are valid.
+
+        This is cheap if the desktop type is cached, so it can be done
+        before anything expensive.  If the cached facts say that the
+        type or zone is invalid, they are re-read from the page before
+        we give up.  Returns the facts about the desktop type.  If 'load'
+        is False and the facts aren't known, the check is skipped (and
+        this returns None).
+        """
+
+        desktop_type = args.desktop or self.site_config['DesktopType']
+        zone = getattr(args, 'zone', None)
+        refresh = False
+        while True:
+            info = self.get_desktop_type(
+                desktop_type, refresh=refresh, load=load
+            )
+            if info is None:
+                return None
+            problem = desktop_type_problem(desktop_type, zone, info)
+            if not problem:
+                return info
+            if refresh:
+                raise Exception(problem)
+            LOG.debug(f"{problem}: checking the page")
+            refresh = True
+
+    def is_boostable(self, args):
+        "Test if the target desktop type is valid and supports Boost"
+
+        return self.check_desktop_type(args)['boostable']
 
     def diagnose_desktop(self):
         state = self.get_desktop_state()
         raise Exception(f"Desktop in unexpected state: '{state}'")
 
+    @action
     def status(self, args):
         with self.timeit_context('Desktop status'):
             state = self.get_desktop_state()
@@ -200,8 +923,12 @@ class BumblebeeDriver:
         scenario = scenario_cls(self, args, extra_args)
         scenario.run()
 
+    @action
     def launch(self, args):
         with self.timeit_context('Launch Desktop'):
+            # If the facts aren't known, they are read from the launch page
+            # (below) rather than loading it twice
+            self.check_desktop_type(args, load=False)
             if self.get_desktop_state() != NO_DESKTOP:
                 self.diagnose_desktop()
 
@@ -213,118 +940,127 @@ class BumblebeeDriver:
             # element for easy identification.  There is only the 'href' ...
             # which is what we should be extracting!
             launch_url = f"{self.base_url}/desktop/{desktop_type}"
-            self.driver.get(launch_url)
+            self.load_page(launch_url, ready=DESKTOP_PAGE_READY)
+            # We have the page, so refresh the cached facts
+            info = self.desktop_type_info(desktop_type)
+            self.desktop_types.put(desktop_type, info)
 
             print(
                 f"Launching '{desktop_type}' desktop in "
                 f"zone '{zone or 'default'}'"
             )
-            try:
-                modal_launch_button = self.driver.find_element(
-                    By.XPATH, '//button[contains(text(), "Create Desktop")]'
+            # Deal with the case of an unknown desktop type.
+            if self.waiter.present(By.XPATH, PAGE_NOT_FOUND):
+                raise Exception(
+                    f"Desktop type '{desktop_type}' is not "
+                    "recognized by the server."
                 )
-            except NoSuchElementException as e:
-                # Deal with the case of an unknown desktop type.
-                try:
-                    self.driver.find_element(
-                        By.XPATH,
-                        (
-                            '//h1[contains(text(), "Page Not Found") '
-                            'or contains(text(), "Page not found")]'
-                        ),
-                    )
-                    raise Exception(
-                        f"Desktop type '{desktop_type}' is not "
-                        "recognized by the server."
-                    )
-                except NoSuchElementException:
-                    raise e
-
+            problem = desktop_type_problem(desktop_type, args.zone, info)
+            if problem:
+                raise Exception(problem)
+            # A disabled launch button is wrapped in a popover that says
+            # why, so there is no need to wait for it to become clickable
+            disabled = ElementPresent(By.XPATH, '//span[@data-bs-content]')
+            condition, modal_launch_button = self.waiter.until(
+                AnyOf(
+                    ElementClickable(By.XPATH, CREATE_DESKTOP_BUTTON), disabled
+                )
+            )
+            if condition is disabled:
+                raise Exception("User already has a desktop!")
             try:
-                modal_launch_button.click()
+                self.click(modal_launch_button)
             except ElementClickInterceptedException as e:
-                # Deal with the case of a disabled launch button
-                try:
-                    self.driver.find_element(
-                        By.XPATH, '//span[@data-bs-content]'
-                    )
+                if self.waiter.present(By.XPATH, '//span[@data-bs-content]'):
                     raise Exception("User already has a desktop!")
-                except NoSuchElementException:
-                    raise e
+                raise e
 
+            # Wait for the modal to finish appearing
+            create_button = self.waiter.until(
+                ElementClickable(By.XPATH, '//button[text()="Create"]')
+            )
             if zone:
                 # If multiple zones are applicable, the UI has a 'select'
                 # element.  If only one, there is a 'p' element whose 'id'
                 # contains the zone.  If none it is different again.
-                try:
-                    select = Select(
-                        self.driver.find_element(
-                            By.ID, f"researcher_workspace-{desktop_type}-zone"
-                        )
-                    )
+                select = self.waiter.present(
+                    By.ID, f"researcher_workspace-{desktop_type}-zone"
+                )
+                if select:
                     try:
-                        select.select_by_value(zone)
+                        Select(select).select_by_value(zone)
                     except NoSuchElementException:
                         raise Exception(f"Zone {zone} not understood (1)")
-                except NoSuchElementException:
-                    try:
-                        self.driver.find_element(
-                            By.ID,
-                            f"researcher_workspace-{desktop_type}-{zone}",
-                        )
-                    except NoSuchElementException:
-                        raise Exception(f"Zone {zone} not understood (2)")
+                elif not self.waiter.present(
+                    By.ID, f"researcher_workspace-{desktop_type}-{zone}"
+                ):
+                    raise Exception(f"Zone {zone} not understood (2)")
 
-            create_button = self.driver.find_element(
-                By.XPATH, '//button[text()="Create"]'
+            self.click(create_button, limit='action')
+            self.waiter.until(
+                UrlMatches(re.escape(self.home_url)),
+                message=f"Didn't redirect to {self.home_url}",
             )
-            create_button.click()
-
-            if self.driver.current_url != self.home_url:
-                raise Exception(f"Didn't redirect to {self.home_url}")
 
             self.wait_for_worker(args)
             if self.get_desktop_state() != DESKTOP_EXISTS:
                 raise Exception("Launch sequence did not complete")
+        if self.measure_usable:
+            self.time_to_usable()
 
     def wait_for_worker(self, args):
         # Poll, waiting for "the worker is busy ..." to end
-        desktop_type = self.get_current_desktop()
-        bar_id = f'researcher_desktop-{desktop_type}-bar'
+        self.get_current_desktop()
+        refresh = None
         retries = 0
-        while retries < self.poll_retries:
-            try:
-                self.driver.find_element(
-                    By.XPATH, '//p[contains(text(), "worker is busy")]'
+        try:
+            while retries < self.poll_retries:
+                # The page updates itself, so re-read it on each poll
+                snapshot = self.snapshot(refresh=retries > 0)
+                if WORKFLOW_RUNNING not in snapshot.states:
+                    return
+                if retries == 0:
+                    # The browser is only polling, so the side session
+                    # may as well re-read the desktop type's facts
+                    # meanwhile.  The next check then uses fresh facts
+                    # for free.
+                    refresh = self.prefetch_desktop_type(args, refresh=True)
+                self.events.emit(
+                    'progress',
+                    desktop=snapshot.desktop,
+                    percent=snapshot.percent,
+                    message=snapshot.message,
+                    poll=retries,
                 )
-            except NoSuchElementException:
-                return
-            if args.show_progress:
-                # Extract and display the progress information
-                try:
-                    bar = self.driver.find_element(By.ID, bar_id)
-                    percent = bar.get_attribute('aria-valuenow')
-                    message = self.driver.find_element(
-                        By.ID, "progress-bar-message"
-                    ).text
-                    print(f"Progress: {percent}%, message: '{message}'")
-                except NoSuchElementException:
-                    pass
-            time.sleep(self.poll_seconds)
-            retries += 1
+                if args.show_progress and snapshot.percent is not None:
+                    print(
+                        f"Progress: {snapshot.percent}%, "
+                        f"message: '{snapshot.message}'"
+                    )
+                time.sleep(self.poll_seconds)
+                retries += 1
+        finally:
+            # So that the next wait can refresh the facts again
+            if refresh:
+                self.collect_prefetch(refresh)
 
     def find_and_click_modal_command(self, verb, text):
         desktop = self.get_current_desktop()
         modal_id = f'researcher_desktop-{desktop}-{verb}-modal'
-        modal_button = self.driver.find_element(
-            By.XPATH, f'//button[@data-bs-target="#{modal_id}"]'
+        modal_button = self.waiter.until(
+            ElementClickable(
+                By.XPATH, f'//button[@data-bs-target="#{modal_id}"]'
+            )
         )
-        modal_button.click()
-        button = self.driver.find_element(
-            By.XPATH, f'//div[@id="{modal_id}"]//button[text()="{text}"]'
+        self.click(modal_button)
+        button = self.waiter.until(
+            ElementClickable(
+                By.XPATH, f'//div[@id="{modal_id}"]//button[text()="{text}"]'
+            )
         )
-        button.click()
+        self.click(button, limit='action')
 
+    @action
     def delete(self, args):
         with self.timeit_context('Delete Desktop'):
             state = self.get_desktop_state()
@@ -339,6 +1075,7 @@ class BumblebeeDriver:
             if self.get_desktop_state() != NO_DESKTOP:
                 self.diagnose_desktop()
 
+    @action
     def boost(self, args):
         with self.timeit_context('Boost Desktop'):
             if self.get_desktop_state() != DESKTOP_EXISTS:
@@ -348,6 +1085,7 @@ class BumblebeeDriver:
             if self.get_desktop_state() != DESKTOP_SUPERSIZED:
                 raise Exception("Boosting did not complete")
 
+    @action
     def downsize(self, args):
         with self.timeit_context('Downsize Desktop'):
             if self.get_desktop_state() != DESKTOP_SUPERSIZED:
@@ -357,6 +1095,7 @@ class BumblebeeDriver:
             if self.get_desktop_state() != DESKTOP_EXISTS:
                 raise Exception("Downsizing did not complete")
 
+    @action
     def shelve(self, args):
         with self.timeit_context('Shelve Desktop'):
             state = self.get_desktop_state()
@@ -367,6 +1106,7 @@ class BumblebeeDriver:
             if self.get_desktop_state() != DESKTOP_SHELVED:
                 raise Exception("Shelving did not complete")
 
+    @action
     def unshelve(self, args):
         with self.timeit_context('Unshelve Desktop'):
             if self.get_desktop_state() != DESKTOP_SHELVED:
@@ -375,7 +1115,48 @@ class BumblebeeDriver:
             self.wait_for_worker(args)
             if self.get_desktop_state() != DESKTOP_EXISTS:
                 raise Exception("Unshelving did not complete")
+        if self.measure_usable:
+            self.time_to_usable()
+
+    @action
+    def usable(self, args):
+        self.time_to_usable(url=getattr(args, 'url', None))
+
+    def time_to_usable(self, url=None):
+        """Measure how long the desktop takes to become usable.
+
+        This follows the home page's "Open Desktop" link (or goes to
+        'url') in a new browser tab, and waits for the remote display to
+        connect (i.e. create its canvas) and then draw its first frame.
+        """
+
+        if not url:
+            self.home_snapshot()
+            url = self.waiter.until(
+                ElementPresent(By.XPATH, OPEN_DESKTOP_LINK),
+                message="Can't find the 'Open Desktop' link",
+            ).get_attribute('href')
+        home_window = self.driver.current_window_handle
+        with self.timeit_context('Time to usable desktop'):
+            self.driver.switch_to.new_window('tab')
+            try:
+                self.load_page(url)
+                self.waiter.until(
+                    CanvasPresent(),
+                    timeout=self.usable_wait_seconds,
+                    message="The remote display didn't connect",
+                )
+                self.waiter.until(
+                    CanvasDrawn(),
+                    timeout=self.usable_wait_seconds,
+                    message="The remote display didn't draw anything",
+                )
+            finally:
+                self.driver.close()
+                self.driver.switch_to.window(home_window)
+                self.invalidate()
 
+    @action
     def reboot(self, args):
         with self.timeit_context('Reboot Desktop'):
             state = self.get_desktop_state()
@@ -388,29 +1169,59 @@ class BumblebeeDriver:
             if state not in [DESKTOP_EXISTS, DESKTOP_SUPERSIZED]:
                 raise Exception("Reboot did not complete")
 
-    def login(self, args):
+    def login(self, args, allow_tos=False):
+        """Log in to the site.
+
+        A new account lands on the Terms of Service page rather than the
+        home page, which only counts as logged in if 'allow_tos' is set.
+        """
+
+        # The side session has the old session's cookies
+        self.close_side_session()
         use_oidc = self.site_config.get('UseOIDC', 'True')
-        if use_oidc.lower() in ['true', 'yes', '1']:
-            self.oidc_login()
-        else:
-            self.classic_login()
+        oidc = use_oidc.lower() in ['true', 'yes', '1']
+        self.events.emit(
+            'login', phase='start', mode='oidc' if oidc else 'classic'
+        )
+        try:
+            if oidc:
+                self.oidc_login(allow_tos=allow_tos)
+            else:
+                self.classic_login()
+        except Exception as e:
+            self.events.emit('login', phase='error', error=str(e))
+            raise
+        self.events.emit('login', phase='done')
+        self.logged_in = True
 
     def classic_login(self):
         print('Logging in (classic)')
-        self.driver.get(self.home_url)
+        self.load_page(self.home_url, ready=HOME_PAGE_READY)
         if self.driver.title == self.site_config['KeycloakLoginTitle']:
             raise Exception(
                 "Got the Keycloak login page: "
                 "is the server's USE_OIDC setting wrong?"
             )
         elif self.driver.title == self.site_config['ClassicLoginTitle']:
-            form = self.driver.find_element(By.ID, 'login-form')
-            form.find_element(By.ID, 'id_username').send_keys(self.user_name)
-            form.find_element(By.ID, 'id_password').send_keys(self.password)
-            form.find_element(By.XPATH, '//input[@type="submit"]').click()
+            form = self.waiter.until(ElementPresent(By.ID, 'login-form'))
+            self.waiter.until(
+                ElementPresent(By.ID, 'id_username', within=form)
+            ).send_keys(self.user_name)
+            self.waiter.until(
+                ElementPresent(By.ID, 'id_password', within=form)
+            ).send_keys(self.password)
+            self.click(
+                self.waiter.until(
+                    ElementClickable(
+                        By.XPATH, '//input[@type="submit"]', within=form
+                    )
+                ),
+                limit='login',
+            )
+            self.events.emit('login', phase='submitted')
             if self.driver.title == self.site_config['AdminTitle']:
                 # Manually redirect to home if necessary
-                self.driver.get(self.home_url)
+                self.load_page(self.home_url, ready=HOME_PAGE_READY)
             if self.driver.title == self.site_config['HomeTitle']:
                 print("Logged in!")
             else:
@@ -421,65 +1232,89 @@ class BumblebeeDriver:
                 )
         elif self.driver.title == self.site_config['HomeTitle']:
             print('Already logged in')
+            self.events.emit('login', phase='already_logged_in')
         else:
             raise Exception(
                 "Unexpected title for home page: " f"'{self.driver.title}'"
             )
 
+    @action
     def agree(self, args):
-        self.driver.get(self.home_url)
-        if self.driver.current_url != f"{self.base_url}/terms/":
-            raise Exception("Didn't redirect to Terms of Service page")
-        agree_button = self.driver.find_element(
-            By.XPATH,
-            '//button[text()="I agree to the above Terms of Service."]',
+        self.load_page(self.home_url, ready=HOME_PAGE_READY)
+        self.waiter.until(
+            UrlMatches(re.escape(f"{self.base_url}/terms/")),
+            message="Didn't redirect to Terms of Service page",
+        )
+        agree_button = self.waiter.until(
+            ElementClickable(
+                By.XPATH,
+                '//button[text()="I agree to the above Terms of Service."]',
+            )
+        )
+        self.click(agree_button, limit='action')
+        self.load_page(self.home_url, ready=HOME_PAGE_READY)
+        self.waiter.until(
+            UrlMatches(re.escape(self.home_url)),
+            message="Didn't redirect to home page",
         )
-        agree_button.click()
-        self.driver.get(self.home_url)
-        if self.driver.current_url != self.home_url:
-            raise Exception("Didn't redirect to home page")
 
+    @action
     def new_workspace(self, args):
-        self.driver.get(self.home_url)
-        if self.driver.current_url != self.home_url:
-            raise Exception("Redirected unexpectedly")
-        create_button = self.driver.find_element(
-            By.XPATH, '//a[contains(@title, "Create Project")]'
+        self.load_page(self.home_url, ready=HOME_PAGE_READY)
+        self.waiter.until(
+            UrlMatches(re.escape(self.home_url)),
+            message="Redirected unexpectedly",
+        )
+        create_button = self.waiter.until(
+            ElementClickable(
+                By.XPATH, '//a[contains(@title, "Create Project")]'
+            )
         )
-        create_button.click()
-        if self.driver.current_url != f"{self.base_url}/new_project":
-            raise Exception("Didn't redirect to New Project page")
-        submit_button = self.driver.find_element(
-            By.XPATH, "//input[@value='Submit']"
+        self.click(create_button)
+        self.waiter.until(
+            UrlMatches(re.escape(f"{self.base_url}/new_project")),
+            message="Didn't redirect to New Project page",
+        )
+        submit_button = self.waiter.until(
+            ElementClickable(By.XPATH, "//input[@value='Submit']")
+        )
+        title_field = self.waiter.until(ElementPresent(By.ID, "id_title"))
+        title_description = self.waiter.until(
+            ElementPresent(By.ID, "id_description")
+        )
+        title_ci = self.waiter.until(
+            ElementPresent(By.ID, "id_chief_investigator")
         )
-        title_field = self.driver.find_element(By.ID, "id_title")
-        title_description = self.driver.find_element(By.ID, "id_description")
-        title_ci = self.driver.find_element(By.ID, "id_chief_investigator")
 
         # pre-commit hook thought there was a typo in the next 2 lines ...
         # until I split the id string.
-        title_forcode_1 = self.driver.find_element(By.ID, "id_F" + "oR_code")
-        title_forcode_2 = self.driver.find_element(By.ID, "id_F" + "oR_code2")
+        title_forcode_1 = self.waiter.until(
+            ElementPresent(By.ID, "id_F" + "oR_code")
+        )
+        title_forcode_2 = self.waiter.until(
+            ElementPresent(By.ID, "id_F" + "oR_code2")
+        )
 
         title_forcode_2.send_keys("31")
         title_forcode_1.send_keys("30")
         title_field.send_keys("Test project")
         title_description.send_keys("Sample project description")
         title_ci.send_keys("nobody@ardc.edu.au")
-        submit_button.click()
+        self.click(submit_button, limit='action')
         if self.get_desktop_state() != NO_DESKTOP:
             raise Exception("Didn't go into 'No Desktop' state")
 
-    def oidc_login(self):
+    def oidc_login(self, allow_tos=False):
         print('Logging in (oidc)')
-        self.driver.get(self.home_url)
+        logged_in = LOGGED_IN_STATES + ([STATE_TOS] if allow_tos else [])
+        self.load_page(self.home_url, ready=HOME_PAGE_READY)
         if self.driver.title == self.site_config['ClassicLoginTitle']:
             raise Exception(
                 "Didn't get the Keycloak login page: "
                 "is the server's USE_OIDC setting wrong?"
             )
         elif self.driver.title == self.site_config['KeycloakLoginTitle']:
-            form = self.driver.find_element(By.ID, "kc-form-login")
+            form = self.waiter.until(ElementPresent(By.ID, "kc-form-login"))
 
             # The Keycloak username/password login form is may be hidden.
             # Unhide it.
@@ -488,21 +1323,35 @@ class BumblebeeDriver:
                 self.driver.execute_script(
                     "arguments[0].style.display = 'block';", form
                 )
+                self.invalidate()
 
             # Then fill it in and click the submit.
-            username = form.find_element(By.ID, 'username')
+            username = self.waiter.until(
+                ElementPresent(By.ID, 'username', within=form)
+            )
             username.send_keys(self.user_name)
-            password = form.find_element(By.ID, 'password')
+            password = self.waiter.until(
+                ElementPresent(By.ID, 'password', within=form)
+            )
             password.send_keys(self.password)
-            button = form.find_element(By.ID, 'kc-login')
-            button.click()
-            state = self.get_desktop_state()
-            if state in [STATE_TOS, STATE_NOT_LOGGED_IN, STATE_UNKNOWN]:
-                raise Exception(
-                    "Login sequence didn't work: " f"state is '{state}'"
-                )
+            button = self.waiter.until(
+                ElementClickable(By.ID, 'kc-login', within=form)
+            )
+            self.click(button, limit='login')
+            self.events.emit('login', phase='submitted')
+            try:
+                # Wait for the redirects back to the home page
+                self.waiter.until(StateEquals(*logged_in))
+            except WaitTimeout:
+                # We may have ended up somewhere else: check the home page
+                state = self.get_desktop_state()
+                if state not in logged_in:
+                    raise Exception(
+                        "Login sequence didn't work: " f"state is '{state}'"
+                    )
         elif self.driver.title == self.site_config['HomeTitle']:
             print('Already logged in')
+            self.events.emit('login', phase='already_logged_in')
         else:
             raise Exception(
                 "Unexpected title for home page: " f"'{self.driver.title}'"
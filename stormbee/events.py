@@ -0,0 +1,113 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A structured event stream.  With '--output jsonl', the driver and the
+# scenarios emit events (state observations, step starts and ends,
+# progress samples, login phases and errors) as JSON Lines, so that they
+# can be ingested without parsing the human-readable output.  The events
+# are written by a background thread, so emitting one never blocks on
+# I/O.
+
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+# Events are queued up to this limit; beyond it they are dropped (and
+# counted) rather than blocking the caller.
+MAX_QUEUED = 10_000
+
+# The most events written with one flush
+BATCH_SIZE = 500
+
+_STOP = object()
+
+
+class NullEvents:
+    "An event sink that discards the events."
+
+    def emit(self, event, **fields):
+        pass
+
+    def close(self, timeout=10):
+        pass
+
+
+class EventWriter(NullEvents):
+    """Writes events to a stream, as JSON Lines.
+
+    Each event has a timestamp ('ts', in seconds since the epoch), an
+    event type ('event'), the run's id ('run') and any 'context' fields
+    (e.g. the site), as well as its own fields.
+    """
+
+    def __init__(self, stream, **context):
+        self.stream = stream
+        self.context = dict(context, run=uuid.uuid4().hex)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=MAX_QUEUED)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def emit(self, event, **fields):
+        record = {'ts': round(time.time(), 3), 'event': event}
+        record.update(self.context)
+        record.update(fields)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=10):
+        """Write out the queued events, and stop the writer thread.
+
+        This waits for at most 'timeout' seconds.  If the writer is stuck
+        (e.g. on a blocked stdout), it is abandoned.
+        """
+
+        if self.dropped:
+            LOG.warning(f"{self.dropped} events were dropped")
+        deadline = time.time() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            LOG.warning("The event writer is stuck: abandoning it")
+            return
+        self._thread.join(max(0, deadline - time.time()))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            lines = [
+                json.dumps(record, default=str)
+                for record in batch
+                if record is not _STOP
+            ]
+            try:
+                if lines:
+                    self.stream.write('\n'.join(lines) + '\n')
+                    self.stream.flush()
+            except Exception as e:
+                LOG.debug(f"Cannot write events: {e}")
+            if stop:
+                return
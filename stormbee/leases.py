@@ -0,0 +1,218 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Test account leases.  Two stormbee runs that use the same test account
+# fight over its desktop, and fail each other's checks.  So each run
+# leases an account from the site's account pool, and releases it when it
+# is done.  A lease is a file in a per-site lease directory.  It records
+# who holds it, and when it expires, so that the leases of runs that
+# crashed (or were killed) can be reclaimed.
+
+import configparser
+import fcntl
+import json
+import logging
+import os
+from os.path import expanduser
+import socket
+import time
+import uuid
+
+from stormbee import accounts
+
+LOG = logging.getLogger(__name__)
+
+
+def account_pool(site_config):
+    """The site's test accounts.
+
+    These are given by the (multi-line) 'Accounts' setting, in the same
+    format as an account list file.  The default is the 'Username',
+    'Password' and 'BumblebeeUsername' settings.
+    """
+
+    text = site_config.get('Accounts', '')
+    if text.strip():
+        return accounts.parse_accounts(text)
+    return [
+        accounts.Account(
+            site_config['Username'],
+            site_config['Password'],
+            site_config.get('BumblebeeUsername', None),
+        )
+    ]
+
+
+def leased_config(site_config, account):
+    """A copy of the site config, with the account's credentials.
+
+    If the account has no Bumblebee username, the site's BumblebeeUsername
+    is dropped rather than kept: it is some other account's, and the DB
+    actions would change that account's records.
+    """
+
+    if isinstance(site_config, configparser.SectionProxy):
+        # Copied into a parser of its own, so that the setting names stay
+        # case-insensitive (a dict would have the lower-cased names)
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read_dict({'leased': dict(site_config)})
+        config = parser['leased']
+        config['Username'] = account.username
+        config['Password'] = account.password
+    else:
+        config = dict(
+            site_config, Username=account.username, Password=account.password
+        )
+    if account.bumblebee_username:
+        config['BumblebeeUsername'] = account.bumblebee_username
+    else:
+        config.pop('BumblebeeUsername', None)
+    return config
+
+
+class Lease:
+    def __init__(self, account, path, token):
+        self.account = account
+        self.path = path
+        self.token = token
+
+
+class LeaseManager:
+    """Per-site test account leases.
+
+    The 'LeaseDir' setting is the parent directory for the per-site
+    lease directories.  A lease expires 'LeaseSeconds' after it was
+    taken; this should be longer than any run.  A run that can't get an
+    account waits for up to 'LeaseWaitSeconds' for one to be released.
+    """
+
+    def __init__(self, site_config, site_name):
+        self.directory = os.path.join(
+            expanduser(site_config.get('LeaseDir', '~/.stormbee/leases')),
+            site_name,
+        )
+        self.lease_seconds = float(site_config.get('LeaseSeconds', '3600'))
+        self.wait_seconds = float(site_config.get('LeaseWaitSeconds', '60'))
+        self.poll_seconds = float(site_config.get('LeasePollSeconds', '5'))
+        self.host = socket.gethostname()
+
+    def acquire(self, pool):
+        "Lease one of the accounts in the pool, waiting if need be."
+
+        deadline = time.time() + self.wait_seconds
+        while True:
+            lease = self.try_acquire(pool)
+            if lease:
+                return lease
+            if time.time() >= deadline:
+                raise Exception(
+                    f"No free test account after {int(self.wait_seconds)} "
+                    f"seconds: all {len(pool)} are leased"
+                )
+            LOG.debug("All test accounts are leased: waiting")
+            time.sleep(self.poll_seconds)
+
+    def try_acquire(self, pool):
+        "Lease a free account in the pool, or return None if there isn't one."
+
+        os.makedirs(self.directory, exist_ok=True)
+        # The lease files are only read and changed while holding this
+        # lock, so checking and reclaiming a lease is atomic.  The lock
+        # is released by the OS if we die.
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for account in pool:
+                path = self._path(account)
+                holder = self.read(path)
+                if holder and not self.is_stale(holder):
+                    continue
+                if holder:
+                    print(
+                        f"Reclaiming stale lease on {account.username} "
+                        f"(held by pid {holder.get('pid')} on "
+                        f"{holder.get('host')})"
+                    )
+                token = uuid.uuid4().hex
+                now = time.time()
+                self._write(
+                    path,
+                    {
+                        'username': account.username,
+                        'token': token,
+                        'pid': os.getpid(),
+                        'host': self.host,
+                        'acquired': now,
+                        'expires': now + self.lease_seconds,
+                    },
+                )
+                LOG.debug(f"Leased test account {account.username}")
+                return Lease(account, path, token)
+        return None
+
+    def release(self, lease):
+        """Release a lease.
+
+        If the lease has been reclaimed by another run (because it
+        expired), that run's lease is left alone.
+        """
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            holder = self.read(lease.path)
+            if holder and holder.get('token') == lease.token:
+                os.remove(lease.path)
+                LOG.debug(f"Released test account {lease.account.username}")
+            else:
+                print(
+                    f"WARNING: the lease on {lease.account.username} "
+                    "was lost before it was released"
+                )
+
+    def is_stale(self, holder):
+        """Is a lease stale?  It is if it has expired, or if the process
+        that holds it (on this host) has gone.
+        """
+
+        if holder.get('expires', 0) < time.time():
+            return True
+        if holder.get('host') == self.host:
+            try:
+                os.kill(holder['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except (PermissionError, KeyError, TypeError):
+                pass
+        return False
+
+    @staticmethod
+    def read(path):
+        "Read a lease file.  Returns None if there is no (valid) lease."
+
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # A partly written lease file
+            LOG.debug(f"Ignoring corrupt lease file {path}")
+            return None
+
+    def _path(self, account):
+        return os.path.join(self.directory, f"{account.username}.lease")
+
+    def _write(self, path, holder):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(holder, f)
+        os.rename(tmp_path, path)
@@ -14,15 +14,38 @@
 
 import argparse
 import configparser
+import json
 import logging
 from os.path import expanduser
 import sys
+import time
 import traceback
 
-from pyvirtualdisplay import Display
-from stormbee import db
-from stormbee.driver import BumblebeeDriver
-from stormbee.nagios import report
+from stormbee import api
+from stormbee import distributed
+from stormbee.events import EventWriter, NullEvents
+from stormbee.nagios import report, service_name
+from stormbee import onboard
+from stormbee import recordings
+from stormbee import swarm
+from stormbee import watchdog
+
+# The long-running actions that share out scenarios.  The deadline (if
+# any) applies to each scenario rather than the whole run, and the
+# results are reported per scenario.
+DISTRIBUTED_ACTIONS = ['coordinator', 'worker']
+
+
+def positive_int(value):
+    "An argparse type for counts that must be at least one."
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a number")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
 
 
 def main():
@@ -56,6 +79,31 @@ def main():
         action='store_true',
         help='report results as a nagios event',
     )
+    parser.add_argument(
+        '--output',
+        choices=['text', 'jsonl'],
+        default='text',
+        help="'jsonl' writes a JSON Lines stream of events to stdout; "
+        "the usual output then goes to stderr",
+    )
+    parser.add_argument(
+        '--summary',
+        action='store',
+        help='write a JSON summary of the run (outcome, step durations '
+        'and page timings) to this file',
+    )
+    parser.add_argument(
+        '--deadline',
+        type=float,
+        help='a hard limit (in seconds) on the run time, overriding the '
+        "site's DeadlineSeconds setting",
+    )
+    parser.add_argument(
+        '--record',
+        action='store',
+        help='record the pages that the browser sees (and what the page '
+        'checks made of them) in this directory',
+    )
     parser.add_argument(
         '--desktop', action='store', help='the type of desktop to launch'
     )
@@ -86,8 +134,65 @@ def main():
     sub_parsers.add_parser('downsize', help='Downsize the desktop')
     reboot = sub_parsers.add_parser('reboot', help='Reboot the desktop')
     reboot.add_argument('--hard', action='store_true', help='do a hard reboot')
+    usable = sub_parsers.add_parser(
+        'usable', help='Measure the time until the desktop is usable'
+    )
+    usable.add_argument(
+        '--url',
+        action='store',
+        help="measure this remote display page (e.g. a local stand-in) "
+        "rather than the desktop's; this doesn't log in",
+    )
     scenario = sub_parsers.add_parser('scenario', help='Run a scenario.')
     scenario.add_argument('name', help='the name of the scenario')
+    parallel_parser = sub_parsers.add_parser(
+        'parallel',
+        help='run a scenario for several test accounts at once, each in '
+        'its own context of one browser',
+    )
+    parallel_parser.add_argument('name', help='the name of the scenario')
+    parallel_parser.add_argument(
+        '--contexts',
+        type=int,
+        default=4,
+        help='the most accounts (i.e. browser contexts) to use',
+    )
+    soak_parser = sub_parsers.add_parser(
+        'soak',
+        help='repeat a scenario, looking for latency drift and leaks',
+    )
+    soak_parser.add_argument('name', help='the name of the scenario')
+    soak_parser.add_argument(
+        '--iterations',
+        type=int,
+        default=10,
+        help='the number of times to run the scenario',
+    )
+    soak_parser.add_argument(
+        '--duration',
+        type=float,
+        help='keep running the scenario for this many seconds '
+        '(overrides --iterations)',
+    )
+    soak_parser.add_argument(
+        '--pause',
+        type=float,
+        default=0,
+        help='the pause (in seconds) between iterations',
+    )
+    soak_parser.add_argument(
+        '--drift-threshold',
+        type=float,
+        default=0.2,
+        help="flag steps whose latency trend rises by more than this "
+        "fraction over the soak",
+    )
+    soak_parser.add_argument(
+        '--rss-threshold',
+        type=float,
+        help="flag the browser's RSS if its trend rises by more than this "
+        "fraction over the soak (defaults to the drift threshold)",
+    )
     reset = sub_parsers.add_parser(
         'reset', help='remediate database errors for the test user'
     )
@@ -100,6 +205,175 @@ def main():
         'clear',
         help='clear (mark as deleted) all database records for the test user',
     )
+    onboard_parser = sub_parsers.add_parser(
+        'onboard',
+        help="onboard test accounts (i.e. run the 'newuser' scenario for "
+        "each of them), skipping those already onboarded",
+    )
+    onboard_parser.add_argument(
+        '--accounts',
+        action='store',
+        help="a file listing the accounts to onboard (default: the "
+        "site's test accounts)",
+    )
+    onboard_parser.add_argument(
+        '--parallel',
+        type=int,
+        default=4,
+        help='the number of accounts to onboard at once',
+    )
+    dbreport = sub_parsers.add_parser(
+        'dbreport',
+        help='report the database records in error, for all users',
+    )
+    dbreport.add_argument(
+        '--format',
+        choices=['table', 'json'],
+        default='table',
+        help='the report format',
+    )
+    dbreport.add_argument(
+        '--status',
+        action='append',
+        help="a VMStatus status to report (default: 'VM_Error'); "
+        "this can be repeated",
+    )
+    swarm_parser = sub_parsers.add_parser(
+        'swarm',
+        help='run a scenario as many concurrent simulated users',
+    )
+    swarm_parser.add_argument(
+        'name',
+        choices=['basic', 'lifecycle'],
+        help='the scenario that each simulated user runs',
+    )
+    swarm_parser.add_argument(
+        '--accounts',
+        action='store',
+        help="a file listing 'username password' pairs for the simulated "
+        "users (default: the configured test user)",
+    )
+    swarm_parser.add_argument(
+        '--users',
+        type=positive_int,
+        default=10,
+        help='the number of simulated users',
+    )
+    swarm_parser.add_argument(
+        '--profile',
+        choices=swarm.PROFILES,
+        default='ramp',
+        help='how the simulated users are started',
+    )
+    swarm_parser.add_argument(
+        '--ramp-seconds',
+        type=float,
+        default=60,
+        help="the period over which users are started ('ramp' profile)",
+    )
+    swarm_parser.add_argument(
+        '--spike-at',
+        type=float,
+        default=60,
+        help="when the spike users are started ('spike' profile)",
+    )
+    swarm_parser.add_argument(
+        '--baseline-users',
+        type=int,
+        default=1,
+        help="the number of users started before the spike "
+        "('spike' profile)",
+    )
+    swarm_parser.add_argument(
+        '--iterations',
+        type=int,
+        default=1,
+        help='the number of times each user runs the scenario',
+    )
+    swarm_parser.add_argument(
+        '--duration',
+        type=float,
+        help='keep each user running the scenario for this many seconds '
+        '(overrides --iterations)',
+    )
+
+    replay_parser = sub_parsers.add_parser(
+        'replay',
+        help='check (and time) the page checks against recorded pages',
+    )
+    replay_parser.add_argument(
+        'corpus', help='the directory containing the recordings'
+    )
+    replay_parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='check the browser-less page checks rather than the ' "browser's",
+    )
+    replay_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='classify each page this many times, for timing',
+    )
+
+    coordinator_parser = sub_parsers.add_parser(
+        'coordinator',
+        help='share out scenarios to workers (on other hosts), and report '
+        'their results',
+    )
+    coordinator_parser.add_argument(
+        'cells',
+        help="the file listing the cells to run: a 'scenario zone "
+        "desktop' per line",
+    )
+    coordinator_parser.add_argument(
+        '--listen',
+        default='127.0.0.1:8470',
+        help='the address (host:port) to serve the workers on; other '
+        'than loopback, this needs a CoordinatorToken',
+    )
+    coordinator_parser.add_argument(
+        '--timeout',
+        type=float,
+        help='give up on the unfinished cells after this many seconds',
+    )
+
+    worker_parser = sub_parsers.add_parser(
+        'worker', help="run scenarios from a coordinator's queue"
+    )
+    worker_parser.add_argument(
+        'coordinator', help="the coordinator's URL (http://host:port)"
+    )
+    worker_parser.add_argument(
+        '--worker-name',
+        help="the worker's name (default: the host name and process id)",
+    )
+
+    compare_parser = sub_parsers.add_parser(
+        'compare',
+        help='compare the step durations of a scenario on two sites',
+    )
+    compare_parser.add_argument('site_a', help='the first (baseline) site')
+    compare_parser.add_argument('site_b', help='the second site')
+    compare_parser.add_argument('name', help='the name of the scenario')
+    compare_parser.add_argument(
+        '--runs',
+        type=int,
+        default=5,
+        help='the number of times to run the scenario on each site',
+    )
+    compare_parser.add_argument(
+        '--confidence',
+        type=float,
+        default=0.95,
+        help='the confidence level for the confidence intervals',
+    )
+    compare_parser.add_argument(
+        '--alpha',
+        type=float,
+        default=0.05,
+        help='the significance level for flagging differences',
+    )
 
     (args, extra_args) = parser.parse_known_args()
     config = configparser.ConfigParser()
@@ -108,13 +382,16 @@ def main():
         print(f"Cannot read the config file: '{config_file}'")
         exit(code=2)
     site_name = args.site or config['DEFAULT'].get('DefaultSite')
+    if args.action == 'compare':
+        # The baseline site is the one that results are reported for
+        site_name = args.site_a
     if not site_name:
         print("We need --site option or a DefaultSite in the config file")
         exit(code=2)
     if site_name not in config:
         print(f"There is no section for site '{site_name}' in the config file")
         exit(code=2)
-    if args.nagios:
+    if args.nagios and args.action not in DISTRIBUTED_ACTIONS:
         if not (
             getattr(args, 'name', None)
             and getattr(args, 'zone', None)
@@ -126,76 +403,195 @@ def main():
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    failure = None
+    events = NullEvents()
+    if args.output == 'jsonl':
+        events = EventWriter(sys.stdout, site=site_name, action=args.action)
+        # Keep everything else out of the event stream
+        sys.stdout = sys.stderr
+    start_time = time.time()
+    events.emit(
+        'run_start',
+        scenario=getattr(args, 'name', None),
+        desktop=args.desktop,
+        zone=args.zone,
+    )
 
-    site_config = config[site_name]
-    if args.action in ['reset', 'clear']:
-        if not site_config.get('DbHost', None):
-            print("DbHost is not configured: cannot reset DB")
-            exit(code=2)
-        try:
-            rep = db.DBRepairer(site_config)
-            if args.action == 'reset':
-                errors = rep.error_counts()
-                if errors or args.force:
-                    print(f"Clearing DB errors: {errors}")
-                    rep.fix_errors()
-                    print("DB reset done")
-                else:
-                    print(
-                        "DB reset skipped: no Volume, Instance or VMStatus "
-                        "records in error state"
-                    )
-            else:
-                rep.mark_all_as_deleted()
-        except Exception:
-            failure = sys.exc_info()
-    else:
-        with Display(backend="xvfb", visible=0, size=[800, 600]):
-            bd = BumblebeeDriver(
-                site_config,
-                site_name,
-                username=args.username,
-                password=args.password,
-            )
-            try:
-                if args.action not in ['reset']:
-                    bd.login(args)
-                    bd.run(args.action, args, extra_args)
-            except Exception:
-                failure = sys.exc_info()
-            finally:
-                # Don't leak external web browser processes!
-                bd.close()
-
-    if args.nagios:
-        # Service name will need to match what Nagios expects.
-        # See `profile::core::tempest_nagios::tests:` in Hiera
-        svcname = f"tempest_{args.zone}_desktop_{args.name}_{args.desktop}"
-        if failure:
-            report(
-                site_config,
-                svcname,
-                state=2,
-                output=f"ERROR: {args.action} failed: {str(failure)}",
-                verbose=True,
+    runner = api.Runner(config, site_name, args, extra_args, events=events)
+
+    # Enforce the deadline (if any), even if the browser hangs
+    site_config = runner.site_config
+    deadline = args.deadline or float(site_config.get('DeadlineSeconds', '0'))
+    capture_seconds = float(site_config.get('DeadlineCaptureSeconds', '10'))
+
+    def on_deadline():
+        expired = watchdog.DeadlineExceeded(
+            f"Deadline of {deadline} seconds exceeded"
+        )
+        expired_failure = (watchdog.DeadlineExceeded, expired, None)
+        print(f"{expired}: stopping the run")
+        stack = deadline_watchdog.main_stack()
+        events.emit('error', error=str(expired), stack=stack)
+        path = None
+        if runner.session:
+            path = watchdog.run_with_timeout(
+                lambda: runner.artifact_store.capture(
+                    runner.session.bd,
+                    expired_failure,
+                    extra={'stack.txt': stack},
+                ),
+                capture_seconds,
             )
-        else:
-            report(
-                site_config,
-                svcname,
-                state=0,
-                output=f"OK: {args.action} succeeded",
-                verbose=True,
+        killed = watchdog.kill_descendants()
+        print(f"Killed {killed} browser and display processes")
+        runner.release()
+        report_result(runner.site_config, args, expired_failure, path)
+        if args.summary:
+            write_summary(
+                args.summary,
+                {
+                    'site': site_name,
+                    'action': args.action,
+                    'outcome': 'deadline',
+                    'error': str(expired),
+                    'artifacts': path,
+                },
             )
+        events.emit(
+            'run_end',
+            outcome='deadline',
+            ms=int((time.time() - start_time) * 1_000),
+            error=str(expired),
+            artifacts=path,
+        )
+        events.close(capture_seconds)
+        if path:
+            runner.artifact_store.wait(capture_seconds)
+            print(f"Failure artifacts saved to {path}")
 
-    if failure:
+    deadline_watchdog = None
+    if deadline and args.action not in DISTRIBUTED_ACTIONS:
+        deadline_watchdog = watchdog.Watchdog(deadline, on_deadline).start()
+
+    try:
+        result = runner.run()
+    except api.UsageError as e:
+        print(e)
+        exit(code=2)
+
+    if deadline_watchdog:
+        deadline_watchdog.cancel()
+
+    report_result(runner.site_config, args, result.failure, result.artifacts)
+
+    if result.failure:
+        events.emit(
+            'error',
+            error=result.error,
+            traceback=''.join(traceback.format_exception(*result.failure)),
+        )
+    events.emit(
+        'run_end',
+        outcome=result.outcome,
+        ms=int((time.time() - start_time) * 1_000),
+        error=result.error,
+        artifacts=result.artifacts,
+    )
+    events.close()
+
+    if args.summary:
+        write_summary(args.summary, result.to_dict())
+
+    print_result(args, result)
+    if result.failure:
         print(f"Stormbee failure for action {args.action} on site {site_name}")
-        traceback.print_exception(*failure)
+        traceback.print_exception(*result.failure)
+        if result.artifacts:
+            runner.artifact_store.wait()
+            print(f"Failure artifacts saved to {result.artifacts}")
         exit(code=1)
     else:
         exit(code=0)
 
 
+def print_result(args, result):
+    "Print the details of a run's result (other than the failure)."
+
+    if args.action not in api.UNLEASED_ACTIONS and result.account:
+        print(f"Test account: {result.account}")
+    summary = result.summary
+    if 'db_reset' in summary:
+        if summary['db_reset']:
+            print(f"DB reset done: cleared {summary['db_errors']}")
+        else:
+            print(
+                "DB reset skipped: no Volume, Instance or VMStatus "
+                "records in error state"
+            )
+    if summary.get('db_cleared'):
+        print("DB records marked as deleted")
+    if 'dbreport' in summary:
+        # Imported here, because the MySQL client library is only needed
+        # by the DB actions
+        from stormbee import db
+
+        db.print_report(summary['dbreport'], format=args.format)
+    if 'onboard' in summary:
+        onboard.print_results(
+            [onboard.OnboardResult(**r) for r in summary['onboard']]
+        )
+    if 'replay' in summary:
+        recordings.print_results(summary['replay'])
+    if 'cells' in summary:
+        distributed.print_results(summary['cells'])
+    for context in summary.get('contexts', []):
+        print(
+            f"{context['account']}: {context['outcome']}"
+            + (f" ({context['error']})" if context['error'] else "")
+        )
+    resources = summary.get('resources')
+    if resources and resources['samples']:
+        print(
+            f"Probe resource usage: peak RSS {resources['peak_rss_mb']} MB, "
+            f"CPU {resources['cpu_seconds']} s, "
+            f"peak processes {resources['peak_processes']}"
+        )
+
+
+def report_result(site_config, args, failure, artifact_path):
+    "Report the result of the run to Nagios (if required)."
+
+    if not args.nagios or args.action in DISTRIBUTED_ACTIONS:
+        # The coordinator reports each cell itself
+        return
+    svcname = service_name(args.zone, args.name, args.desktop)
+    if failure:
+        output = f"ERROR: {args.action} failed: {str(failure[1])}"
+        if artifact_path:
+            output += f" (artifacts: {artifact_path})"
+        report(
+            site_config,
+            svcname,
+            state=2,
+            output=output,
+            verbose=True,
+        )
+    else:
+        report(
+            site_config,
+            svcname,
+            state=0,
+            output=f"OK: {args.action} succeeded",
+            verbose=True,
+        )
+
+
+def write_summary(path, summary):
+    try:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    except OSError as e:
+        print(f"Cannot write the run summary to {path}: {e}")
+
+
 if __name__ == "__main__":
     main()
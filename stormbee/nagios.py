@@ -18,6 +18,14 @@ import traceback
 from xml.etree import ElementTree as ET
 
 
+def service_name(zone, scenario, desktop):
+    "The Nagios service name for a scenario's checks."
+
+    # Service name will need to match what Nagios expects.
+    # See `profile::core::tempest_nagios::tests:` in Hiera
+    return f"tempest_{zone}_desktop_{scenario}_{desktop}"
+
+
 def report(config_section, service_name, state=0, output="OK", verbose=False):
     "Report results as to Nagios as a passive check using NRDP"
 
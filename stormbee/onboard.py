@@ -0,0 +1,142 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Bulk onboarding of test accounts.  Each account is taken through the
+# 'newuser' scenario (agreeing to the Terms of Service and creating the
+# user's workspace) in its own browser.  Several accounts are onboarded
+# at once, but the number of concurrent browsers is bounded.  Accounts
+# that have already been onboarded are skipped.  The browsers share one
+# geckodriver, which is installed before any of them start.
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from pyvirtualdisplay import Display
+from webdriver_manager.firefox import GeckoDriverManager
+
+from stormbee.constants import (
+    STATE_TOS,
+    STATE_CREATE_WORKSPACE,
+    STATE_NOT_LOGGED_IN,
+    STATE_UNKNOWN,
+)
+from stormbee.driver import BumblebeeDriver
+from stormbee import leases
+from stormbee.scenarios import NewUserScenario
+
+LOG = logging.getLogger(__name__)
+
+ONBOARDED = 'onboarded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+# The onboarding steps still to be done, for each starting state
+PENDING_STEPS = {
+    STATE_TOS: ['agree', 'new_workspace'],
+    STATE_CREATE_WORKSPACE: ['new_workspace'],
+}
+
+OnboardResult = namedtuple(
+    'OnboardResult', ['username', 'outcome', 'steps', 'seconds', 'error']
+)
+
+
+def onboard_account(site_config, site_name, account, args, geckodriver=None):
+    "Onboard one account (if need be).  Returns an OnboardResult."
+
+    start = time.time()
+    steps = []
+    error = None
+    bd = None
+    try:
+        bd = BumblebeeDriver(
+            leases.leased_config(site_config, account),
+            site_name,
+            geckodriver=geckodriver,
+        )
+        # A new account lands on the Terms of Service page
+        bd.login(args, allow_tos=True)
+        state = bd.get_desktop_state()
+        if state in [STATE_NOT_LOGGED_IN, STATE_UNKNOWN]:
+            raise Exception(f"Cannot tell if onboarded: state is '{state}'")
+        steps = PENDING_STEPS.get(state, [])
+        if steps:
+            NewUserScenario(bd, args, ['--as-required']).run()
+    except Exception as e:
+        LOG.debug(f"Onboarding {account.username} failed", exc_info=True)
+        error = str(e)
+    finally:
+        if bd:
+            bd.close()
+    if error:
+        outcome = FAILED
+    elif steps:
+        outcome = ONBOARDED
+    else:
+        outcome = SKIPPED
+    return OnboardResult(
+        account.username, outcome, steps, time.time() - start, error
+    )
+
+
+def run_onboard(site_config, site_name, accounts, args, parallel=4):
+    """Onboard the accounts, 'parallel' at a time.
+
+    Returns the results, in the order of the accounts.
+    """
+
+    # Rather than each browser checking for (and perhaps downloading)
+    # geckodriver at the same time
+    geckodriver = GeckoDriverManager().install()
+    with Display(backend="xvfb", visible=0, size=[800, 600]):
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            futures = [
+                executor.submit(
+                    onboard_account,
+                    site_config,
+                    site_name,
+                    account,
+                    args,
+                    geckodriver,
+                )
+                for account in accounts
+            ]
+            results = []
+            for future in futures:
+                result = future.result()
+                LOG.info(f"{result.username}: {result.outcome}")
+                results.append(result)
+    return results
+
+
+def print_results(results):
+    """Print the per-account results.
+
+    Returns the number of accounts that failed.
+    """
+
+    print(f"{'Account':<30} {'Outcome':<10} {'Seconds':>8}  Steps / error")
+    for r in results:
+        detail = r.error if r.outcome == FAILED else ', '.join(r.steps)
+        print(f"{r.username:<30} {r.outcome:<10} {r.seconds:>8.1f}  {detail}")
+    counts = {
+        outcome: sum(1 for r in results if r.outcome == outcome)
+        for outcome in [ONBOARDED, SKIPPED, FAILED]
+    }
+    print(
+        f"{counts[ONBOARDED]} onboarded, {counts[SKIPPED]} skipped "
+        f"(already onboarded), {counts[FAILED]} failed"
+    )
+    return counts[FAILED]
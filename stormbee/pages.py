@@ -0,0 +1,241 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Browser-less handling of Bumblebee pages.  This is a minimal HTML
+# element tree plus versions of the driver's page checks that work
+# on it.  It is used where running a Firefox instance is too expensive.
+
+from html.parser import HTMLParser
+
+from stormbee.constants import (
+    DESKTOP_SUPERSIZED,
+    DESKTOP_EXISTS,
+    DESKTOP_SHELVED,
+    DESKTOP_FAILED,
+    WORKFLOW_RUNNING,
+    NO_DESKTOP,
+    STATE_TOS,
+    STATE_CREATE_WORKSPACE,
+    STATE_NOT_LOGGED_IN,
+    STATE_UNKNOWN,
+)
+
+VOID_ELEMENTS = {
+    'area',
+    'base',
+    'br',
+    'col',
+    'embed',
+    'hr',
+    'img',
+    'input',
+    'link',
+    'meta',
+    'source',
+    'track',
+    'wbr',
+}
+
+# These mirror the XPath expressions in BumblebeeDriver.get_desktop_state.
+# Each entry is (tag, text fragment, state).
+STATE_MARKERS = [
+    ('small', 'Your boosted desktop', DESKTOP_SUPERSIZED),
+    ('h3', 'Your Virtual Desktop is', DESKTOP_EXISTS),
+    ('h3', 'Your Desktop is currently shelved', DESKTOP_SHELVED),
+    ('p', 'Virtual Desktop Error', DESKTOP_FAILED),
+    ('p', 'worker is busy', WORKFLOW_RUNNING),
+    ('h4', "You haven't created a Desktop", NO_DESKTOP),
+    ('h1', 'Terms of Service', STATE_TOS),
+]
+
+
+class Element:
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.parent = parent
+        self.children = []
+        # Only the text directly inside this element, like XPath's text()
+        self.own_text = ''
+
+    def get(self, name, default=None):
+        value = self.attrs.get(name, default)
+        return default if value is None else value
+
+    @property
+    def text(self):
+        return self.own_text + ''.join(c.text for c in self.children)
+
+    def iter(self):
+        yield self
+        for child in self.children:
+            yield from child.iter()
+
+    def find_all(self, tag=None, **attrs):
+        for e in self.iter():
+            if tag and e.tag != tag:
+                continue
+            if all(e.get(k) == v for k, v in attrs.items()):
+                yield e
+
+    def find(self, tag=None, **attrs):
+        return next(self.find_all(tag, **attrs), None)
+
+    def ancestor(self, tag):
+        e = self.parent
+        while e is not None and e.tag != tag:
+            e = e.parent
+        return e
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Element('#document', {})
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        e = Element(tag, attrs, self.current)
+        self.current.children.append(e)
+        if tag not in VOID_ELEMENTS:
+            self.current = e
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(Element(tag, attrs, self.current))
+
+    def handle_endtag(self, tag):
+        # Tolerate sloppy markup by unwinding to the matching element
+        e = self.current
+        while e is not self.root and e.tag != tag:
+            e = e.parent
+        if e is not self.root:
+            self.current = e.parent
+
+    def handle_data(self, data):
+        self.current.own_text += data
+
+
+def parse(html):
+    "Parse an HTML page, returning the root of its element tree."
+
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def title(doc):
+    e = doc.find('title')
+    return e.text.strip() if e is not None else ''
+
+
+def page_state(doc, site_config):
+    "The equivalent of BumblebeeDriver.get_desktop_state for a parsed page"
+
+    if title(doc) in [
+        site_config['KeycloakLoginTitle'],
+        site_config['ClassicLoginTitle'],
+    ]:
+        return STATE_NOT_LOGGED_IN
+    for tag, fragment, state in STATE_MARKERS:
+        for e in doc.find_all(tag):
+            if fragment in e.own_text:
+                return state
+    for e in doc.find_all('a'):
+        if 'Create Project' in e.get('title', ''):
+            return STATE_CREATE_WORKSPACE
+    return STATE_UNKNOWN
+
+
+def current_desktop(doc):
+    "The equivalent of BumblebeeDriver.get_current_desktop for a parsed page"
+
+    for e in doc.find_all('div'):
+        if e.get('id', '').startswith('researcher_desktop'):
+            return e.get('id').split('-')[1]
+    raise Exception("There is no current desktop")
+
+
+def desktop_type_info(doc, desktop_type):
+    """Extract the facts about a desktop type from its '/desktop/<type>' page.
+
+    Returns a dict with 'exists', 'boostable' and 'zones' entries.  The
+    'zones' entry is None when the page doesn't say which zones apply.
+    """
+
+    headings = {e.own_text.strip() for e in doc.find_all('h6')}
+    zones = None
+    select = doc.find('select', id=f"researcher_workspace-{desktop_type}-zone")
+    if select is not None:
+        zones = [o.get('value') for o in select.find_all('option')]
+    else:
+        prefix = f"researcher_workspace-{desktop_type}-"
+        for e in doc.find_all('p'):
+            id = e.get('id', '')
+            if id.startswith(prefix):
+                zones = [id[len(prefix) :]]
+                break
+    return {
+        'exists': 'DEFAULT SIZE' in headings,
+        'boostable': 'BOOST SIZE' in headings,
+        'zones': zones,
+    }
+
+
+def find_button(root, text):
+    "Find a button (or button-like link) whose text is exactly 'text'."
+
+    for e in root.find_all():
+        if e.tag in ['button', 'a'] and e.text.strip() == text:
+            return e
+        if (
+            e.tag == 'input'
+            and e.get('type') == 'submit'
+            and e.get('value') == text
+        ):
+            return e
+    return None
+
+
+def form_data(form, button=None, overrides=None):
+    """Collect the name / value pairs that a browser would submit.
+
+    The 'button' is the submit button being "clicked", if any.  The
+    'overrides' dict supplies values for named fields.
+    """
+
+    data = {}
+    for e in form.iter():
+        name = e.get('name')
+        if not name:
+            continue
+        if e.tag == 'input':
+            kind = e.get('type', 'text').lower()
+            if kind in ['submit', 'button', 'image', 'reset']:
+                continue
+            if kind in ['checkbox', 'radio'] and 'checked' not in e.attrs:
+                continue
+            data[name] = e.get('value', 'on' if kind == 'checkbox' else '')
+        elif e.tag == 'textarea':
+            data[name] = e.text
+        elif e.tag == 'select':
+            options = list(e.find_all('option'))
+            chosen = [o for o in options if 'selected' in o.attrs]
+            chosen = chosen or options[:1]
+            if chosen:
+                data[name] = chosen[0].get('value', chosen[0].text.strip())
+    if button is not None and button.get('name'):
+        data[button.get('name')] = button.get('value', '')
+    if overrides:
+        data.update(overrides)
+    return data
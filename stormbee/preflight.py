@@ -0,0 +1,131 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Preflight checks.  Starting Xvfb and Firefox and logging in takes many
+# seconds, so a broken environment (an unreachable site, Keycloak being
+# down, a wrong DB host or missing NRDP settings) is checked for first,
+# using plain HTTP requests and connections with short timeouts.  The
+# checks run concurrently.
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+import requests
+
+from stormbee.driver import config_bool
+from stormbee import pages
+
+LOG = logging.getLogger(__name__)
+
+
+def check_site(site_config, timeout):
+    "Check that the site's home page leads to the expected login page."
+
+    url = f"{site_config['BaseUrl']}/home/"
+    try:
+        response = requests.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        raise Exception(f"Site {url} is unreachable: {e}")
+    if response.status_code >= 400:
+        raise Exception(
+            f"Site {url} returned HTTP {response.status_code} "
+            f"(from {response.url})"
+        )
+    if config_bool(site_config, 'UseOIDC', 'True'):
+        expected = site_config['KeycloakLoginTitle']
+    else:
+        expected = site_config['ClassicLoginTitle']
+    title = pages.title(pages.parse(response.text))
+    if title != expected:
+        raise Exception(
+            f"Expected the login page '{expected}' from {url}, "
+            f"but got '{title}' (from {response.url})"
+        )
+
+
+def check_db(site_config, timeout):
+    "Check that we can connect to the DB."
+
+    # Imported here, because the DB client library is only needed when
+    # there is a DB to check
+    from stormbee import db
+
+    try:
+        db.connect(site_config, timeout=timeout).close()
+    except Exception as e:
+        raise Exception(
+            f"Cannot connect to the DB at {site_config['DbHost']}: {e}"
+        )
+
+
+def check_nrdp(site_config, timeout):
+    "Check that the Nagios NRDP settings are present and the URL works."
+
+    missing = [
+        setting
+        for setting in ['NagiosTargetHost', 'NagiosURL', 'NagiosToken']
+        if not site_config.get(setting)
+    ]
+    if missing:
+        raise Exception(f"Missing Nagios settings: {', '.join(missing)}")
+    url = site_config['NagiosURL']
+    try:
+        response = requests.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        raise Exception(f"Nagios NRDP URL {url} is unreachable: {e}")
+    if response.status_code >= 500:
+        raise Exception(
+            f"Nagios NRDP URL {url} returned HTTP {response.status_code}"
+        )
+
+
+CHECKS = {
+    'site': check_site,
+    'db': check_db,
+    'nrdp': check_nrdp,
+}
+
+
+def run_preflight(site_config, checks):
+    """Run the named checks concurrently.
+
+    Returns a list of (check, error, seconds), where 'error' is None if
+    the check passed.  Each check's network operations time out after
+    'PreflightTimeoutSeconds'.
+    """
+
+    timeout = float(site_config.get('PreflightTimeoutSeconds', '3'))
+
+    def run(name):
+        start = time.time()
+        try:
+            CHECKS[name](site_config, timeout)
+            error = None
+        except Exception as e:
+            error = str(e)
+        return name, error, time.time() - start
+
+    if not checks:
+        return []
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        results = list(executor.map(run, checks))
+    for name, error, seconds in results:
+        LOG.debug(f"Preflight {name}: {error or 'OK'} ({seconds:.2f} s)")
+    return results
+
+
+def preflight_errors(results):
+    "The failure messages for the failed checks."
+
+    return [f"{name}: {error}" for name, error, _ in results if error]
@@ -0,0 +1,122 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A rate limiter shared by all of the stormbee processes on a host.  When
+# cron starts many checks at once, they would otherwise all log in (via
+# Keycloak) and load the home page at the same moment.  That skews the
+# latencies that we measure, and can trip Keycloak's brute force
+# protection.  Each site has token buckets for logins, page navigations and
+# action submissions.  The bucket state is kept in a per-site file, which
+# is locked while it is updated.
+
+import fcntl
+import json
+import logging
+import os
+from os.path import expanduser
+import time
+
+LOG = logging.getLogger(__name__)
+
+# The buckets, and the settings that give their rates (per minute)
+BUCKET_SETTINGS = {
+    'login': 'LoginsPerMinute',
+    'navigation': 'NavigationsPerMinute',
+    'action': 'ActionsPerMinute',
+}
+
+
+class RateLimiter:
+    """Per-site token bucket rate limits, shared between processes.
+
+    A bucket with a rate of zero (the default) is unlimited.  Up to
+    'RateLimitBurst' operations can happen at once after a quiet period.
+    Tokens are reserved rather than polled for: a caller that finds the
+    bucket empty takes a token "on credit", and sleeps until the token
+    would have been added.  So callers are served in order.
+    """
+
+    def __init__(self, site_config, site_name):
+        self.rates = {
+            bucket: float(site_config.get(setting, '0'))
+            for bucket, setting in BUCKET_SETTINGS.items()
+        }
+        self.burst = float(site_config.get('RateLimitBurst', '3'))
+        self.path = os.path.join(
+            expanduser(site_config.get('CacheDir', '~/.stormbee/cache')),
+            site_name,
+            'ratelimit.json',
+        )
+        self.waits = {bucket: [] for bucket in BUCKET_SETTINGS}
+
+    @property
+    def total_wait(self):
+        "The total time (in seconds) spent waiting for the limiter."
+
+        return sum(sum(waits) for waits in self.waits.values())
+
+    def acquire(self, bucket, record=True):
+        """Take a token from a bucket, waiting for it if need be.
+
+        Returns the time spent waiting, in seconds.  Unless 'record' is
+        False, the wait is added to the waits that step timings exclude;
+        it should be False for waits in background threads.
+        """
+
+        rate = self.rates[bucket]
+        if not rate:
+            return 0
+        wait = self._reserve(bucket, rate / 60)
+        if wait > 0:
+            LOG.debug(f"Rate limiter: waiting {wait:.2f} s for a {bucket}")
+            time.sleep(wait)
+        if record:
+            self.waits[bucket].append(wait)
+        return wait
+
+    def _reserve(self, bucket, per_second):
+        "Reserve a token.  Returns how long until it is ours."
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                LOG.debug(f"Resetting corrupt rate limiter state {self.path}")
+                state = {}
+            now = time.time()
+            entry = state.get(bucket, {'tokens': self.burst, 'updated': now})
+            tokens = min(
+                self.burst,
+                entry['tokens'] + (now - entry['updated']) * per_second,
+            )
+            tokens -= 1
+            state[bucket] = {'tokens': tokens, 'updated': now}
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+        return max(0, -tokens) / per_second
+
+    def summary(self):
+        return {
+            bucket: {
+                'count': len(waits),
+                'waited': sum(1 for w in waits if w > 0),
+                'wait_ms': int(sum(waits) * 1_000),
+            }
+            for bucket, waits in self.waits.items()
+            if waits
+        }
@@ -0,0 +1,249 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Recording and replay of the pages that the driver sees.  The page
+# classifiers (the XPath checks in the driver, and their browser-less
+# equivalents in stormbee.pages) break when Bumblebee's templates change.
+# In record mode, each page that the driver classifies is saved along
+# with what the driver made of it.  The recordings are a corpus for
+# checking (and timing) the classifiers without a live site.
+
+from collections import namedtuple
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+
+from stormbee import pages
+
+LOG = logging.getLogger(__name__)
+
+INDEX = 'recordings.jsonl'
+
+# Replayed pages may not fetch anything (or run any scripts of their own).
+# The driver's scripts still run.
+REPLAY_CSP = "default-src 'none'; style-src 'unsafe-inline'; img-src data:"
+
+# A recorded page.  The 'labels' are what the driver made of it: the
+# 'state' and 'desktop' of a home page, and the 'desktop_type' facts
+# for a desktop type page.
+Recording = namedtuple('Recording', ['name', 'url', 'title', 'html', 'labels'])
+
+
+def desktop_type_from_url(url):
+    "The desktop type for a '/desktop/<type>' page URL, or None."
+
+    match = re.search(r'/desktop/([^/?#]+)/?(?:[?#].*)?$', url)
+    return match.group(1) if match else None
+
+
+class Recorder:
+    """Saves pages (and their labels) to a corpus directory.
+
+    Identical pages (e.g. the same home page polled repeatedly) are
+    only saved once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.count = 0
+        self._seen = set()
+        os.makedirs(directory, exist_ok=True)
+        for recording in load_corpus(directory):
+            self._seen.add(self._digest(recording.url, recording.html))
+            self.count += 1
+
+    @staticmethod
+    def _digest(url, html):
+        return hashlib.sha1(f"{url}\n{html}".encode()).hexdigest()
+
+    def record(self, url, title, html, labels):
+        "Save a page.  Returns the recording's name, or None if a duplicate."
+
+        digest = self._digest(url, html)
+        if digest in self._seen:
+            return None
+        self._seen.add(digest)
+        self.count += 1
+        name = f"page-{self.count:04d}"
+        with open(os.path.join(self.directory, f"{name}.html"), 'w') as f:
+            f.write(html)
+        with open(os.path.join(self.directory, INDEX), 'a') as f:
+            f.write(
+                json.dumps(
+                    {
+                        'name': name,
+                        'url': url,
+                        'title': title,
+                        'labels': labels,
+                        'recorded': time.time(),
+                    }
+                )
+                + '\n'
+            )
+        LOG.debug(f"Recorded {url} as {name}: {labels}")
+        return name
+
+
+def load_corpus(directory):
+    "Load the recordings in a corpus directory."
+
+    recordings = []
+    try:
+        with open(os.path.join(directory, INDEX)) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return recordings
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        with open(os.path.join(directory, f"{entry['name']}.html")) as f:
+            html = f.read()
+        recordings.append(
+            Recording(
+                entry['name'],
+                entry['url'],
+                entry['title'],
+                html,
+                entry['labels'],
+            )
+        )
+    return recordings
+
+
+class ReplayServer:
+    """Serves recorded pages on a local port.
+
+    The page for a recording is at '/<name>'.  Anything else is a 404.
+    Use this as a context manager.
+    """
+
+    def __init__(self, recordings):
+        pages_by_path = {f"/{r.name}": r.html.encode() for r in recordings}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages_by_path.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Security-Policy', REPLAY_CSP)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug(format % args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = None
+
+    def url(self, recording):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{recording.name}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def classify_offline(recording, site_config):
+    "Classify a recorded page with the browser-less page checks."
+
+    doc = pages.parse(recording.html)
+    labels = {}
+    if 'state' in recording.labels:
+        labels['state'] = pages.page_state(doc, site_config)
+        try:
+            labels['desktop'] = pages.current_desktop(doc)
+        except Exception:
+            labels['desktop'] = None
+    desktop_type = desktop_type_from_url(recording.url)
+    if 'desktop_type' in recording.labels and desktop_type:
+        labels['desktop_type'] = pages.desktop_type_info(doc, desktop_type)
+    return labels
+
+
+def check_corpus(recordings, classify, repeat=1, prepare=None):
+    """Check a classifier against a corpus, and time it.
+
+    The 'classify' function takes a recording and returns its labels.
+    The optional 'prepare' function is called (untimed) with each
+    recording first.  Returns a list of dicts, one per recording, giving
+    any labels that don't match the recorded ones and the median
+    classification time.
+    """
+
+    results = []
+    for recording in recordings:
+        if prepare:
+            prepare(recording)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            labels = classify(recording)
+            times.append(time.perf_counter() - start)
+        mismatches = {
+            key: {'recorded': value, 'classified': labels.get(key)}
+            for key, value in recording.labels.items()
+            if labels.get(key) != value
+        }
+        results.append(
+            {
+                'name': recording.name,
+                'url': recording.url,
+                'ok': not mismatches,
+                'mismatches': mismatches,
+                'ms': round(statistics.median(times) * 1_000, 2),
+            }
+        )
+    return results
+
+
+def print_results(results):
+    for result in results:
+        status = 'ok' if result['ok'] else 'MISMATCH'
+        print(
+            f"{result['name']}  {status:8}  {result['ms']:8.2f} ms  "
+            f"{result['url']}"
+        )
+        for key, mismatch in result['mismatches'].items():
+            print(
+                f"    {key}: recorded {mismatch['recorded']!r}, "
+                f"classified {mismatch['classified']!r}"
+            )
+    failed = sum(1 for r in results if not r['ok'])
+    times = [r['ms'] for r in results]
+    if times:
+        print(
+            f"{len(results)} pages, {failed} mismatched; classification "
+            f"time median {statistics.median(times):.2f} ms, "
+            f"max {max(times):.2f} ms"
+        )
+    return failed
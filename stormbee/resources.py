@@ -0,0 +1,227 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Host resource accounting for the processes that a probe starts; i.e.
+# geckodriver, Firefox (and its content processes) and Xvfb.  This reads
+# /proc, so it only works on Linux.  Elsewhere, it does nothing.
+
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+PROC = '/proc'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_stat(pid):
+    """Read a process's name, parent, CPU time and start time from
+    /proc/<pid>/stat.
+
+    Returns (name, ppid, cpu_seconds, start), or None if the process is
+    gone.  The start time (in clock ticks since boot) tells a process
+    apart from a later one that reuses its pid.
+    """
+
+    try:
+        with open(f"{PROC}/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The name is in parentheses, and may itself contain spaces or ')'
+    name = data[data.index('(') + 1 : data.rindex(')')]
+    fields = data[data.rindex(')') + 2 :].split()
+    if fields[0] == 'Z':
+        # A zombie has exited; it just hasn't been reaped
+        return None
+    ppid = int(fields[1])
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return name, ppid, cpu, int(fields[19])
+
+
+def read_rss(pid):
+    "Read a process's resident set size (in bytes), or 0 if it is gone."
+
+    try:
+        with open(f"{PROC}/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree(roots):
+    """Find the live processes in the trees rooted at the given pids.
+
+    Returns a dict mapping pid to (name, ppid, cpu_seconds, start).
+    """
+
+    stats = {}
+    for entry in os.listdir(PROC):
+        if entry.isdigit():
+            stat = read_stat(int(entry))
+            if stat:
+                stats[int(entry)] = stat
+    tree = {}
+    frontier = [pid for pid in roots if pid in stats]
+    while frontier:
+        pid = frontier.pop()
+        if pid in tree:
+            continue
+        tree[pid] = stats[pid]
+        frontier.extend(p for p, s in stats.items() if s[1] == pid)
+    return tree
+
+
+def tree_rss(roots):
+    "The total RSS (in bytes) of the process trees rooted at 'roots'."
+
+    return sum(read_rss(pid) for pid in process_tree(roots))
+
+
+class ResourceMonitor:
+    """Samples the resource usage of some process trees.
+
+    A background thread samples every 'interval' seconds.  It tracks the
+    peak total RSS (overall and per process name), the CPU time used and
+    the peak number of processes.  CPU time used by processes that exit
+    between samples may be missed.  The processes seen are remembered
+    (with their roots), so that 'survivors' can find them even after
+    their parents have gone.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.enabled = os.path.isdir(PROC)
+        self.roots = {}
+        self.seen = {}
+        self.cpu = {}
+        self.peak_rss = 0
+        self.peak_rss_by_name = {}
+        self.peak_processes = 0
+        self.last_rss = 0
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_root(self, pid, label):
+        if pid:
+            self.roots[pid] = label
+
+    def remove_root(self, pid):
+        self.roots.pop(pid, None)
+
+    def start(self):
+        if not self.enabled or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                LOG.debug(f"Resource sampling failed: {e}")
+
+    def sample(self):
+        if not self.enabled:
+            return
+        tree = process_tree(self.roots)
+
+        def root_of(pid):
+            while pid not in self.roots and tree[pid][1] in tree:
+                pid = tree[pid][1]
+            return pid
+
+        with self._lock:
+            rss_by_name = {}
+            for pid, (name, _, cpu, start) in tree.items():
+                self.seen[pid] = (name, start, root_of(pid))
+                self.cpu[pid] = cpu
+                rss_by_name[name] = rss_by_name.get(name, 0) + read_rss(pid)
+            total = sum(rss_by_name.values())
+            self.last_rss = total
+            self.peak_rss = max(self.peak_rss, total)
+            for name, rss in rss_by_name.items():
+                self.peak_rss_by_name[name] = max(
+                    self.peak_rss_by_name.get(name, 0), rss
+                )
+            self.peak_processes = max(self.peak_processes, len(tree))
+            self.samples += 1
+
+    def current_rss(self):
+        "Sample now, and return the total RSS in bytes."
+
+        self.sample()
+        return self.last_rss
+
+    def survivors(self, roots=None, grace=2.0):
+        """Find processes that we have seen that are still running.
+
+        Only processes in the trees rooted at 'roots' (default: all of
+        the roots) are considered, including ones that have been
+        orphaned (e.g. a Firefox whose geckodriver has exited).  A pid
+        only counts if it still has the name and start time that we saw,
+        since pids are reused.  We allow up to 'grace' seconds for
+        processes to exit.  Returns a dict mapping pid to name.
+        """
+
+        if not self.enabled:
+            return {}
+        roots = set(self.roots if roots is None else roots)
+        with self._lock:
+            seen = {
+                pid: (name, start)
+                for pid, (name, start, root) in self.seen.items()
+                if root in roots
+            }
+        deadline = time.time() + grace
+        while True:
+            alive = {
+                pid: name
+                for pid, (name, _, _, _) in process_tree(roots).items()
+            }
+            for pid, (name, start) in seen.items():
+                stat = read_stat(pid)
+                if stat and (stat[0], stat[3]) == (name, start):
+                    alive[pid] = name
+            if not alive or time.time() >= deadline:
+                return alive
+            time.sleep(0.1)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'samples': self.samples,
+                'peak_rss_mb': round(self.peak_rss / 1_048_576, 1),
+                'peak_rss_mb_by_process': {
+                    name: round(rss / 1_048_576, 1)
+                    for name, rss in sorted(self.peak_rss_by_name.items())
+                },
+                'cpu_seconds': round(sum(self.cpu.values()), 2),
+                'peak_processes': self.peak_processes,
+                'processes_seen': len(self.seen),
+            }
@@ -97,7 +97,12 @@ class DesktopLifecycleScenario(ScenarioBase):
         pass
 
     def do_run_scenario(self):
+        # Don't delete a desktop if we can't launch another one.  The
+        # desktop type is checked by the side session while the browser
+        # gets the state.
+        self.bd.prefetch_desktop_type(self.args)
         state = self.bd.get_desktop_state()
+        self.bd.check_desktop_type(self.args)
         if state in [
             DESKTOP_EXISTS,
             DESKTOP_SHELVED,
@@ -132,7 +137,12 @@ class DesktopBasicScenario(ScenarioBase):
         pass
 
     def do_run_scenario(self):
+        # Don't delete a desktop if we can't launch another one.  The
+        # desktop type is checked by the side session while the browser
+        # gets the state.
+        self.bd.prefetch_desktop_type(self.args)
         state = self.bd.get_desktop_state()
+        self.bd.check_desktop_type(self.args)
         if state in [
             DESKTOP_EXISTS,
             DESKTOP_SHELVED,
@@ -0,0 +1,80 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A side session for read-only work.  The browser does one thing at a
+# time, and most of a lifecycle scenario is spent waiting for it.  Checks
+# that only read pages (like fetching the facts about a desktop type)
+# can be done at the same time by an HTTP session that shares the
+# browser's login cookies, using the browser-less page checks.
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import requests
+
+from stormbee import pages
+
+LOG = logging.getLogger(__name__)
+
+
+class SideSession:
+    """An HTTP session, logged in as the browser is, plus worker threads.
+
+    The work is done in background threads; 'submit' returns a Future.
+    """
+
+    def __init__(self, bd, workers=2):
+        self.bd = bd
+        self.timeout = bd.page_wait_seconds
+        self.session = requests.Session()
+        for cookie in bd.driver.get_cookies():
+            self.session.cookies.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie.get('domain'),
+                path=cookie.get('path', '/'),
+            )
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='stormbee-side'
+        )
+
+    def submit(self, func, *args):
+        return self.executor.submit(func, *args)
+
+    def get_page(self, path):
+        "Fetch and parse a page of the site."
+
+        # These are navigations, but they don't hold up the browser
+        self.bd.limiter.acquire('navigation', record=False)
+        url = f"{self.bd.base_url}{path}"
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        doc = pages.parse(response.text)
+        if pages.page_state(doc, self.bd.site_config) == (
+            pages.STATE_NOT_LOGGED_IN
+        ):
+            raise Exception(f"The side session isn't logged in ({url})")
+        return doc
+
+    def desktop_type_info(self, desktop_type):
+        "Get the facts about a desktop type, and cache them."
+
+        doc = self.get_page(f"/desktop/{desktop_type}")
+        info = pages.desktop_type_info(doc, desktop_type)
+        self.bd.desktop_types.put(desktop_type, info)
+        LOG.debug(f"Side session: desktop type '{desktop_type}' is {info}")
+        return info
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
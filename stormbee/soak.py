@@ -0,0 +1,266 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Soak testing.  Some problems only show up after hours of churn: e.g.
+# orphaned volumes, growing worker queues and slowing unshelves on the
+# Bumblebee side, and browser memory growth on ours.  A soak repeats a
+# scenario with the same browser, recording each iteration's step
+# latencies, the browser's RSS and the DB error counts, and then fits a
+# trend line to each of them.  The browser isn't recycled during a soak,
+# since that would hide the memory growth that we are looking for.
+
+from collections import defaultdict
+import logging
+import statistics
+import sys
+import time
+
+from stormbee.constants import (
+    DESKTOP_SUPERSIZED,
+    DESKTOP_EXISTS,
+    DESKTOP_SHELVED,
+    DESKTOP_FAILED,
+)
+from stormbee.resources import tree_rss
+
+LOG = logging.getLogger(__name__)
+
+# The fewest iterations that a trend is computed from
+MIN_SAMPLES = 3
+
+
+def trend(values):
+    """The least squares trend of a series of per-iteration values.
+
+    Returns (slope per iteration, drift), where the drift is the change
+    along the trend line over the whole series, as a fraction of its
+    starting value.  Returns None if there are too few values.
+    """
+
+    if len(values) < MIN_SAMPLES:
+        return None
+    if len(set(values)) == 1:
+        return 0.0, 0.0
+    slope, intercept = statistics.linear_regression(range(len(values)), values)
+    change = slope * (len(values) - 1)
+    drift = change / intercept if intercept > 0 else None
+    return slope, drift
+
+
+class SoakRecorder:
+    "The per-iteration measurements of a soak, and their trends."
+
+    def __init__(self, drift_threshold=0.2, rss_threshold=None):
+        self.drift_threshold = drift_threshold
+        self.rss_threshold = (
+            drift_threshold if rss_threshold is None else rss_threshold
+        )
+        self.iterations = []
+
+    def record(self, steps, rss, db_errors, error=None):
+        """Record an iteration.
+
+        'steps' are the driver's step timings for the iteration, 'rss' is
+        the browser's RSS (in bytes) and 'db_errors' is the DB error counts
+        (or None if there is no DB to check).
+        """
+
+        self.iterations.append(
+            {
+                'iteration': len(self.iterations) + 1,
+                'steps': {s['step']: s['ms'] for s in steps if s['ok']},
+                'rss_mb': round(rss / 1_048_576, 1),
+                'db_errors': db_errors,
+                'error': error,
+            }
+        )
+
+    def series(self):
+        "The measurement series, by name.  Failed steps are left out."
+
+        series = defaultdict(list)
+        for it in self.iterations:
+            for step, ms in it['steps'].items():
+                series[f"step: {step}"].append(ms)
+            series['browser RSS (MB)'].append(it['rss_mb'])
+            if it['db_errors'] is not None:
+                for name in ['vmstatus_errors', 'resource_errors']:
+                    series[f"DB {name}"].append(it['db_errors'].get(name, 0))
+        return series
+
+    def trends(self):
+        """The trend of each series.
+
+        Returns a list of dicts with the series name, the number of
+        samples, the first and last values, the slope, the drift and
+        whether the series is flagged.  Step latencies are flagged if they
+        drift upwards by more than the drift threshold, and the browser's
+        RSS if it drifts upwards by more than the RSS threshold; the DB
+        error counts are flagged if they grow at all.
+        """
+
+        results = []
+        for name, values in self.series().items():
+            fit = trend(values)
+            slope, drift = fit if fit else (None, None)
+            if name.startswith('step: '):
+                flagged = drift is not None and drift > self.drift_threshold
+            elif name == 'browser RSS (MB)':
+                flagged = drift is not None and drift > self.rss_threshold
+            elif name.startswith('DB '):
+                flagged = slope is not None and slope > 0
+            else:
+                flagged = False
+            results.append(
+                {
+                    'series': name,
+                    'samples': len(values),
+                    'first': values[0],
+                    'last': values[-1],
+                    'slope': None if slope is None else round(slope, 3),
+                    'drift': None if drift is None else round(drift, 3),
+                    'flagged': flagged,
+                }
+            )
+        return results
+
+    def summary(self):
+        return {
+            'iterations': self.iterations,
+            'trends': self.trends(),
+            'failures': sum(1 for it in self.iterations if it['error']),
+        }
+
+
+def print_trends(trends):
+    "Print the trends.  Returns the number of flagged series."
+
+    print(
+        f"{'Series':<40} {'N':>4} {'First':>10} {'Last':>10} "
+        f"{'Slope/it':>10} {'Drift':>8}"
+    )
+    for t in trends:
+        slope = '-' if t['slope'] is None else f"{t['slope']:.1f}"
+        drift = '-' if t['drift'] is None else f"{t['drift']:+.0%}"
+        print(
+            f"{t['series']:<40} {t['samples']:>4} {t['first']:>10} "
+            f"{t['last']:>10} {slope:>10} {drift:>8}"
+            + ("  DRIFT" if t['flagged'] else "")
+        )
+    return sum(1 for t in trends if t['flagged'])
+
+
+def db_error_counts(site_config):
+    "The DB error counts for the test user, or None if there is no DB."
+
+    if not site_config.get('DbHost', None):
+        return None
+    # Imported here, because the DB client library is only needed when
+    # there is a DB to check
+    from stormbee import db
+
+    return db.DBRepairer(site_config).error_counts()
+
+
+def cleanup(bd, site_config, args):
+    """Get back to a clean slate after a failed iteration.
+
+    Any DB errors for the test user are fixed, and any desktop is
+    deleted (the scenarios expect to start with no desktop).
+    """
+
+    if site_config.get('DbHost', None):
+        from stormbee import db
+
+        rep = db.DBRepairer(site_config)
+        if rep.error_counts():
+            print("Soak: clearing DB errors")
+            rep.fix_errors()
+    if bd.get_desktop_state() in [
+        DESKTOP_EXISTS,
+        DESKTOP_SHELVED,
+        DESKTOP_SUPERSIZED,
+        DESKTOP_FAILED,
+    ]:
+        print("Soak: deleting the desktop")
+        bd.delete(args)
+
+
+def run_soak(bd, site_config, args, extra_args):
+    """Run the soak, and print (and return) the results.
+
+    The scenario is repeated for 'args.duration' seconds (if given) or
+    'args.iterations' times, pausing 'args.pause' seconds in between.
+    Browser recycling is turned off for the duration.
+    """
+
+    recorder = SoakRecorder(
+        drift_threshold=args.drift_threshold,
+        rss_threshold=getattr(args, 'rss_threshold', None),
+    )
+    recycling = (bd.recycle_navigations, bd.recycle_age, bd.recycle_rss)
+    bd.recycle_navigations, bd.recycle_age, bd.recycle_rss = 0, 0, 0
+    try:
+        run_iterations(bd, site_config, args, extra_args, recorder)
+    finally:
+        bd.recycle_navigations, bd.recycle_age, bd.recycle_rss = recycling
+
+    summary = recorder.summary()
+    print(
+        f"Soak: {len(summary['iterations'])} iterations, "
+        f"{summary['failures']} failed"
+    )
+    summary['flagged'] = print_trends(summary['trends'])
+    return summary
+
+
+def run_iterations(bd, site_config, args, extra_args, recorder):
+    "Run the soak's iterations, recording them."
+
+    deadline = time.time() + args.duration if args.duration else None
+    iteration = 0
+    while True:
+        iteration += 1
+        if deadline:
+            if time.time() >= deadline:
+                break
+        elif iteration > args.iterations:
+            break
+        if iteration > 1 and args.pause:
+            time.sleep(args.pause)
+        print(f"Soak iteration {iteration}")
+        first_step = len(bd.step_timings)
+        error = None
+        try:
+            bd.run('scenario', args, extra_args)
+        except Exception as e:
+            LOG.debug("Soak iteration failed", exc_info=sys.exc_info())
+            print(f"Soak iteration {iteration} failed: {e}")
+            error = str(e)
+        try:
+            db_errors = db_error_counts(site_config)
+        except Exception as e:
+            print(f"Soak: cannot get the DB error counts: {e}")
+            db_errors = None
+        recorder.record(
+            bd.step_timings[first_step:],
+            tree_rss([bd.browser_pid]),
+            db_errors,
+            error=error,
+        )
+        bd.events.emit('soak_iteration', **recorder.iterations[-1])
+        if error:
+            try:
+                cleanup(bd, site_config, args)
+            except Exception as e:
+                print(f"Soak: cleanup failed: {e}")
@@ -0,0 +1,138 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A local stand-in for a desktop's remote display page, for testing the
+# time-to-usable measurement without launching a desktop.  The page
+# "connects" (i.e. creates its display canvas) and then draws its first
+# frame after configurable delays.  With 'blank=1', the frame is a blank
+# (uniform, opaque) placeholder, which doesn't count as usable.  Run it
+# with:
+#
+#   python -m stormbee.standin [--port PORT]
+#
+# and then measure it with:
+#
+#   stormbee usable --url 'http://localhost:PORT/?connect=2&frame=3'
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+LOG = logging.getLogger(__name__)
+
+# The delays (in seconds) are substituted into the page
+STANDIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Stand-in desktop</title></head>
+<body style="margin: 0">
+<div id="display"></div>
+<script>
+setTimeout(() => {
+  const canvas = document.createElement('canvas');
+  canvas.width = 1024;
+  canvas.height = 768;
+  document.getElementById('display').appendChild(canvas);
+  setTimeout(() => {
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = %(blank)s ? '#000000' : '#3465a4';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    if (!%(blank)s) {
+      // A "panel", so that the frame isn't uniform
+      ctx.fillStyle = '#2e3436';
+      ctx.fillRect(0, canvas.height - 96, canvas.width, 96);
+    }
+  }, %(frame)d);
+}, %(connect)d);
+</script>
+</body></html>
+"""
+
+
+def standin_page(connect=1.0, frame=1.0, blank=False):
+    "The stand-in page, with the given delays in seconds."
+
+    return STANDIN_PAGE % {
+        'connect': int(connect * 1_000),
+        'frame': int(frame * 1_000),
+        'blank': 'true' if blank else 'false',
+    }
+
+
+class StandinServer:
+    """Serves the stand-in page on a local port.
+
+    The 'connect' and 'frame' query parameters give the delays in
+    seconds, and 'blank=1' makes the frame a blank placeholder.
+    Use this as a context manager, or call 'serve_forever'.
+    """
+
+    def __init__(self, port=0):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                try:
+                    body = standin_page(
+                        connect=float(query.get('connect', ['1'])[0]),
+                        frame=float(query.get('frame', ['1'])[0]),
+                        blank=query.get('blank', ['0'])[0] == '1',
+                    ).encode()
+                except ValueError:
+                    self.send_error(400)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug(format % args)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a stand-in remote desktop page"
+    )
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    server = StandinServer(args.port)
+    print(f"Serving the stand-in desktop at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Load generation.  A "swarm" is a number of concurrent simulated users
+# that run the same action sequences as the built-in scenarios.  Each
+# simulated user is a lightweight HTTP client rather than a browser, so
+# that a single prober host can drive many of them.
+
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import time
+from urllib.parse import urljoin
+
+import requests
+
+from stormbee.constants import (
+    DESKTOP_SUPERSIZED,
+    DESKTOP_EXISTS,
+    DESKTOP_SHELVED,
+    DESKTOP_FAILED,
+    WORKFLOW_RUNNING,
+    NO_DESKTOP,
+)
+from stormbee import pages
+
+LOG = logging.getLogger(__name__)
+
+PROFILES = ['ramp', 'steady', 'spike']
+
+# Upper bounds (in ms) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [
+    100,
+    250,
+    500,
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    30_000,
+    60_000,
+    120_000,
+    300_000,
+    600_000,
+]
+
+
+def start_offsets(profile, users, ramp_seconds=0, spike_at=0, baseline=1):
+    """Compute when (in seconds from the start) each simulated user starts.
+
+    - 'steady' starts all users at once.
+    - 'ramp' starts users evenly spread over 'ramp_seconds'.
+    - 'spike' starts 'baseline' users at once, and the rest together
+      at 'spike_at' seconds.
+    """
+
+    if profile == 'steady':
+        return [0.0] * users
+    elif profile == 'ramp':
+        step = ramp_seconds / users if users else 0
+        return [i * step for i in range(users)]
+    elif profile == 'spike':
+        baseline = min(baseline, users)
+        return [0.0] * baseline + [float(spike_at)] * (users - baseline)
+    else:
+        raise Exception(f"Unknown swarm profile '{profile}'")
+
+
+class SwarmStats:
+    "Collects the measurements for a swarm run."
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queue_waits = []
+        self.start_time = None
+        self.end_time = None
+
+    def record(self, step, seconds, ok=True):
+        if ok:
+            self.latencies[step].append(seconds)
+        else:
+            self.errors[step] += 1
+
+    def record_queue_wait(self, seconds):
+        self.queue_waits.append(seconds)
+
+    @staticmethod
+    def histogram(samples):
+        "Count samples (in seconds) into HISTOGRAM_BUCKETS (in ms)."
+
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for s in samples:
+            ms = s * 1_000
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if ms <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    @staticmethod
+    def percentile(samples, pct):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[index]
+
+    def summary(self):
+        elapsed = (self.end_time or time.time()) - (self.start_time or 0)
+        steps = {}
+        for step in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies[step]
+            total = len(samples) + self.errors[step]
+            steps[step] = {
+                'count': len(samples),
+                'errors': self.errors[step],
+                'error_rate': self.errors[step] / total if total else 0.0,
+                'p50': self.percentile(samples, 50),
+                'p90': self.percentile(samples, 90),
+                'p99': self.percentile(samples, 99),
+                'max': max(samples) if samples else None,
+                'histogram': self.histogram(samples),
+            }
+        completed = sum(len(s) for s in self.latencies.values())
+        return {
+            'elapsed': elapsed,
+            'throughput': completed / elapsed if elapsed > 0 else 0.0,
+            'steps': steps,
+            'queue_wait': {
+                'count': len(self.queue_waits),
+                'p50': self.percentile(self.queue_waits, 50),
+                'p90': self.percentile(self.queue_waits, 90),
+                'max': max(self.queue_waits) if self.queue_waits else None,
+                'histogram': self.histogram(self.queue_waits),
+            },
+        }
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{int(seconds * 1_000)}"
+
+
+def print_summary(summary):
+    print(
+        f"Swarm ran for {summary['elapsed']:.1f} s, throughput "
+        f"{summary['throughput']:.3f} steps/s"
+    )
+    print(
+        f"{'step':<12} {'count':>6} {'errors':>6} {'err%':>6} "
+        f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for step, s in summary['steps'].items():
+        print(
+            f"{step:<12} {s['count']:>6} {s['errors']:>6} "
+            f"{s['error_rate'] * 100:>6.1f} {_ms(s['p50']):>9} "
+            f"{_ms(s['p90']):>9} {_ms(s['p99']):>9} {_ms(s['max']):>9}"
+        )
+    qw = summary['queue_wait']
+    print(
+        f"Queue wait ('worker is busy'): {qw['count']} samples, "
+        f"p50 {_ms(qw['p50'])} ms, p90 {_ms(qw['p90'])} ms, "
+        f"max {_ms(qw['max'])} ms"
+    )
+    labels = [f"<={b} ms" for b in HISTOGRAM_BUCKETS] + [
+        f">{HISTOGRAM_BUCKETS[-1]} ms"
+    ]
+    for step, s in list(summary['steps'].items()) + [('queue wait', qw)]:
+        buckets = ', '.join(
+            f"{label}: {n}" for label, n in zip(labels, s['histogram']) if n
+        )
+        print(f"Histogram for {step}: {buckets or 'no samples'}")
+
+
+class SwarmClient:
+    """A simulated Bumblebee user.
+
+    This drives the site with plain HTTP requests and examines the pages
+    using the same checks as the BumblebeeDriver.  Blocking requests run
+    in the event loop's executor; polling waits are asyncio sleeps, so
+    idle users don't tie up threads.
+    """
+
+    def __init__(self, site_config, account, stats, show_progress=False):
+        self.site_config = site_config
+        self.account = account
+        self.stats = stats
+        self.show_progress = show_progress
+        self.base_url = site_config['BaseUrl']
+        self.home_url = f"{self.base_url}/home/"
+        self.poll_seconds = int(site_config.get('PollSeconds', '5'))
+        self.poll_retries = int(site_config.get('PollRetries', '50'))
+        self.timeout = float(site_config.get('SwarmHttpTimeout', '60'))
+        self.session = requests.Session()
+        self.url = None
+        self.doc = None
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    def _load(self, response):
+        response.raise_for_status()
+        self.url = response.url
+        self.doc = pages.parse(response.text)
+        return self.doc
+
+    async def get(self, url):
+        response = await self._call(
+            self.session.get, url, timeout=self.timeout
+        )
+        return self._load(response)
+
+    async def submit(self, form, button=None, overrides=None):
+        action = urljoin(self.url, form.get('action') or self.url)
+        data = pages.form_data(form, button, overrides)
+        if form.get('method', 'get').lower() == 'post':
+            # Django's CSRF check wants a same-origin Referer for https
+            response = await self._call(
+                self.session.post,
+                action,
+                data=data,
+                headers={'Referer': self.url},
+                timeout=self.timeout,
+            )
+        else:
+            response = await self._call(
+                self.session.get, action, params=data, timeout=self.timeout
+            )
+        return self._load(response)
+
+    async def click(self, button):
+        "Emulate clicking a button or link that causes a navigation."
+
+        if button.tag == 'a' and button.get('href', '#') != '#':
+            return await self.get(urljoin(self.url, button.get('href')))
+        form = button.ancestor('form')
+        if form is None:
+            raise Exception(f"Don't know how to click '{button.text.strip()}'")
+        return await self.submit(form, button)
+
+    async def state(self, reload=True):
+        if reload or self.url != self.home_url:
+            await self.get(self.home_url)
+        return pages.page_state(self.doc, self.site_config)
+
+    async def login(self):
+        doc = await self.get(self.home_url)
+        if pages.title(doc) == self.site_config['HomeTitle']:
+            return
+        form = doc.find('form', id='kc-form-login') or doc.find(
+            'form', id='login-form'
+        )
+        if form is None:
+            raise Exception(
+                f"No login form found: page title is '{pages.title(doc)}'"
+            )
+        doc = await self.submit(
+            form,
+            overrides={
+                'username': self.account.username,
+                'password': self.account.password,
+            },
+        )
+        if pages.title(doc) == self.site_config['AdminTitle']:
+            doc = await self.get(self.home_url)
+        if pages.title(doc) != self.site_config['HomeTitle']:
+            raise Exception(
+                f"Login failed for {self.account.username}: "
+                f"page title is '{pages.title(doc)}'"
+            )
+
+    async def wait_for_worker(self):
+        "Poll until the 'worker is busy' phase ends, recording how long."
+
+        busy_since = None
+        for _ in range(self.poll_retries):
+            if await self.state() != WORKFLOW_RUNNING:
+                break
+            busy_since = busy_since or time.time()
+            if self.show_progress:
+                message = self.doc.find('div', id='progress-bar-message')
+                if message is not None:
+                    print(
+                        f"{self.account.username}: progress "
+                        f"'{message.text.strip()}'"
+                    )
+            await asyncio.sleep(self.poll_seconds)
+        if busy_since:
+            self.stats.record_queue_wait(time.time() - busy_since)
+
+    async def expect_state(self, expected):
+        state = await self.state()
+        if state not in expected:
+            raise Exception(f"Desktop in unexpected state: '{state}'")
+
+    async def is_boostable(self, desktop_type):
+        doc = await self.get(f"{self.base_url}/desktop/{desktop_type}")
+        info = pages.desktop_type_info(doc, desktop_type)
+        if not info['exists']:
+            raise Exception(
+                "Can't find details for desktop type "
+                f"'{desktop_type}' - does it exist?"
+            )
+        return info['boostable']
+
+    async def launch(self, desktop_type, zone):
+        await self.expect_state([NO_DESKTOP])
+        doc = await self.get(f"{self.base_url}/desktop/{desktop_type}")
+        button = pages.find_button(doc, 'Create')
+        if button is None or button.ancestor('form') is None:
+            raise Exception(
+                f"Cannot find the 'Create' form for {desktop_type}"
+            )
+        overrides = {}
+        if zone:
+            select = doc.find(
+                'select', id=f"researcher_workspace-{desktop_type}-zone"
+            )
+            if select is not None:
+                values = [o.get('value') for o in select.find_all('option')]
+                if zone not in values:
+                    raise Exception(f"Zone {zone} not understood (1)")
+                overrides[select.get('name')] = zone
+            elif doc.find(id=f"researcher_workspace-{desktop_type}-{zone}"):
+                pass
+            else:
+                raise Exception(f"Zone {zone} not understood (2)")
+        await self.submit(button.ancestor('form'), button, overrides)
+        if self.url != self.home_url:
+            raise Exception(f"Didn't redirect to {self.home_url}")
+        await self.wait_for_worker()
+        await self.expect_state([DESKTOP_EXISTS])
+
+    async def command(self, verb, text, before, after):
+        await self.expect_state(before)
+        desktop = pages.current_desktop(self.doc)
+        modal = self.doc.find(
+            'div', id=f'researcher_desktop-{desktop}-{verb}-modal'
+        )
+        button = pages.find_button(modal, text) if modal else None
+        if button is None:
+            raise Exception(f"Cannot find the '{text}' button")
+        await self.click(button)
+        await self.wait_for_worker()
+        await self.expect_state(after)
+
+
+async def _run_sequence(client, scenario, desktop_type, zone, stats):
+    "Run one iteration of a scenario's actions, recording each step"
+
+    exists = [DESKTOP_EXISTS, DESKTOP_SUPERSIZED]
+    steps = []
+    if scenario == 'lifecycle':
+        start = time.time()
+        try:
+            boostable = await client.is_boostable(desktop_type)
+        except Exception as e:
+            stats.record('boostable', time.time() - start, ok=False)
+            LOG.info(f"{client.account.username}: boostable failed: {e}")
+            return False
+        stats.record('boostable', time.time() - start)
+        steps.append(('launch', lambda: client.launch(desktop_type, zone)))
+        if boostable:
+            steps.append(
+                (
+                    'boost',
+                    lambda: client.command(
+                        'supersize',
+                        'Boost',
+                        [DESKTOP_EXISTS],
+                        [DESKTOP_SUPERSIZED],
+                    ),
+                )
+            )
+            steps.append(
+                (
+                    'downsize',
+                    lambda: client.command(
+                        'downsize',
+                        'Downsize',
+                        [DESKTOP_SUPERSIZED],
+                        [DESKTOP_EXISTS],
+                    ),
+                )
+            )
+        steps += [
+            (
+                'shelve',
+                lambda: client.command(
+                    'shelve', 'Shelve', exists, [DESKTOP_SHELVED]
+                ),
+            ),
+            (
+                'unshelve',
+                lambda: client.command(
+                    'unshelve', 'Unshelve', [DESKTOP_SHELVED], [DESKTOP_EXISTS]
+                ),
+            ),
+            (
+                'reboot',
+                lambda: client.command(
+                    'reboot', 'Hard Reboot', exists, exists
+                ),
+            ),
+        ]
+    elif scenario == 'basic':
+        steps.append(('launch', lambda: client.launch(desktop_type, zone)))
+    else:
+        raise Exception(f"Swarm cannot run scenario '{scenario}'")
+    steps.append(
+        (
+            'delete',
+            lambda: client.command(
+                'delete', 'Delete', exists + [DESKTOP_SHELVED], [NO_DESKTOP]
+            ),
+        )
+    )
+
+    for name, step in steps:
+        start = time.time()
+        try:
+            await step()
+        except Exception as e:
+            stats.record(name, time.time() - start, ok=False)
+            LOG.info(f"{client.account.username}: {name} failed: {e}")
+            return False
+        stats.record(name, time.time() - start)
+    return True
+
+
+async def _simulated_user(client, offset, args, stats, deadline):
+    await asyncio.sleep(offset)
+    start = time.time()
+    try:
+        await client.login()
+    except Exception as e:
+        stats.record('login', time.time() - start, ok=False)
+        LOG.info(f"{client.account.username}: login failed: {e}")
+        return
+    stats.record('login', time.time() - start)
+
+    desktop_type = args.desktop or client.site_config['DesktopType']
+    iterations = 0
+    while True:
+        # Reset: get rid of a desktop left over from an earlier failure
+        try:
+            state = await client.state()
+            if state in [
+                DESKTOP_EXISTS,
+                DESKTOP_SHELVED,
+                DESKTOP_SUPERSIZED,
+                DESKTOP_FAILED,
+            ]:
+                await client.command(
+                    'delete',
+                    'Delete',
+                    [state],
+                    [NO_DESKTOP],
+                )
+        except Exception as e:
+            stats.record('reset', 0, ok=False)
+            LOG.info(f"{client.account.username}: reset failed: {e}")
+            return
+        await _run_sequence(client, args.name, desktop_type, args.zone, stats)
+        iterations += 1
+        if deadline:
+            if time.time() >= deadline:
+                return
+        elif iterations >= args.iterations:
+            return
+
+
+async def _swarm(site_config, accounts, args, stats):
+    offsets = start_offsets(
+        args.profile,
+        args.users,
+        ramp_seconds=args.ramp_seconds,
+        spike_at=args.spike_at,
+        baseline=args.baseline_users,
+    )
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.users))
+    stats.start_time = time.time()
+    deadline = stats.start_time + args.duration if args.duration else None
+    tasks = [
+        _simulated_user(
+            SwarmClient(
+                site_config,
+                accounts[i % len(accounts)],
+                stats,
+                show_progress=args.show_progress,
+            ),
+            offset,
+            args,
+            stats,
+            deadline,
+        )
+        for i, offset in enumerate(offsets)
+    ]
+    await asyncio.gather(*tasks)
+    stats.end_time = time.time()
+
+
+def run_swarm(site_config, accounts, args):
+    """Run a swarm, print the results and return the summary.
+
+    Each simulated user needs its own account; if there are fewer
+    accounts than users, they are reused and the users will get in
+    each other's way.
+    """
+
+    if len(accounts) < args.users:
+        LOG.warning(
+            f"Only {len(accounts)} accounts for {args.users} users: "
+            "accounts will be shared"
+        )
+    print(
+        f"Starting swarm of {args.users} users running the "
+        f"'{args.name}' scenario ({args.profile} profile)"
+    )
+    stats = SwarmStats()
+    asyncio.run(_swarm(site_config, accounts, args, stats))
+    summary = stats.summary()
+    print_summary(summary)
+    return summary
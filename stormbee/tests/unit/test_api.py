@@ -0,0 +1,147 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from io import StringIO
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from stormbee import api
+from stormbee import onboard
+from stormbee.constants import DESKTOP_EXISTS, NO_DESKTOP
+
+CONF = {
+    'Username': 'probe',
+    'Password': 'secret',
+    'Preflight': 'False',
+    'CaptureArtifacts': 'False',
+}
+
+
+class FakeDriver:
+    "Just enough of a BumblebeeDriver."
+
+    def __init__(self, *args, **kwargs):
+        self.user_name = 'probe'
+        self.logged_in = False
+        self.logins = 0
+        self.step_timings = []
+        self.states = []
+        self.closed = False
+        self.resources = Mock()
+
+    def login(self, args):
+        self.logins += 1
+        self.logged_in = True
+
+    def run(self, action, args, extra_args):
+        self.states += [NO_DESKTOP, DESKTOP_EXISTS]
+        self.step_timings.append({'step': action, 'ms': 10, 'ok': True})
+        if args.desktop == 'bad':
+            raise Exception("No such desktop type")
+
+    def run_summary(self):
+        return {'steps': self.step_timings, 'resources': {'samples': 0}}
+
+    def close(self):
+        self.closed = True
+
+
+@patch('stormbee.api.BumblebeeDriver', FakeDriver)
+class SessionTests(TestCase):
+    def setUp(self):
+        # Keep the leases and caches out of the developer's home
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.conf = dict(CONF, LeaseDir=tmp.name, CacheDir=tmp.name)
+
+    def test_reused(self):
+        with api.Session(self.conf, 'test', display=False) as session:
+            first = session.run('launch', desktop='ubuntu')
+            second = session.run('scenario', name='basic', desktop='bad')
+        self.assertTrue(session.bd.closed)
+        self.assertEqual(1, session.bd.logins)
+
+        self.assertTrue(first.ok)
+        self.assertEqual('success', first.outcome)
+        self.assertEqual(['launch'], [s['step'] for s in first.steps])
+        self.assertEqual([NO_DESKTOP, DESKTOP_EXISTS], first.states)
+
+        self.assertFalse(second.ok)
+        self.assertEqual('No such desktop type', second.error)
+        self.assertEqual(['scenario'], [s['step'] for s in second.steps])
+        summary = second.to_dict()
+        self.assertEqual('basic', summary['scenario'])
+        self.assertEqual('failure', summary['outcome'])
+        self.assertEqual('probe', summary['account'])
+
+
+class RunnerTests(TestCase):
+    def setUp(self):
+        # Keep the leases and caches out of the developer's home
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.conf = dict(CONF, LeaseDir=tmp.name, CacheDir=tmp.name)
+
+    @patch('stormbee.api.Display')
+    @patch('stormbee.api.BumblebeeDriver', FakeDriver)
+    def test_browser_action(self, display):
+        args = api.make_args('status', username='someone')
+        with patch('sys.stdout', new=StringIO()) as out:
+            result = api.Runner({'test': self.conf}, 'test', args).run()
+        # The output is left to the caller
+        self.assertEqual('', out.getvalue())
+        self.assertTrue(result.ok)
+        self.assertEqual('someone', result.account)
+        self.assertEqual({'samples': 0}, result.summary['resources'])
+        display.return_value.start.return_value.stop.assert_called_once()
+
+    @patch('stormbee.api.swarm.run_swarm')
+    def test_swarm(self, run_swarm):
+        run_swarm.return_value = {'steps': {'login': {'errors': 0}}}
+        args = api.make_args('swarm', accounts=None)
+        result = api.Runner({'test': self.conf}, 'test', args).run()
+        self.assertTrue(result.ok)
+        self.assertEqual(run_swarm.return_value, result.summary['swarm'])
+
+        run_swarm.return_value = {'steps': {'login': {'errors': 2}}}
+        result = api.Runner({'test': self.conf}, 'test', args).run()
+        self.assertEqual('2 swarm steps failed', result.error)
+
+    @patch('stormbee.api.onboard.run_onboard')
+    def test_failure_keeps_summary(self, run_onboard):
+        run_onboard.return_value = [
+            onboard.OnboardResult('alice', onboard.FAILED, [], 1.0, 'oops')
+        ]
+        args = api.make_args('onboard', accounts=None, parallel=1)
+        with patch('sys.stdout', new=StringIO()) as out:
+            result = api.Runner({'test': self.conf}, 'test', args).run()
+        self.assertEqual('', out.getvalue())
+        self.assertEqual('1 accounts could not be onboarded', result.error)
+        self.assertEqual('oops', result.summary['onboard'][0]['error'])
+
+    def test_reset(self):
+        db = Mock()
+        db.DBRepairer.return_value.error_counts.return_value = {}
+        args = api.make_args('reset')
+        runner = api.Runner({'test': self.conf}, 'test', args)
+        with patch.object(runner, '_db', return_value=db):
+            result = runner.run()
+        self.assertEqual({'db_errors': {}, 'db_reset': False}, result.summary)
+        db.DBRepairer.return_value.fix_errors.assert_not_called()
+
+    def test_usage_error(self):
+        args = api.make_args('clear', username='someone')
+        with self.assertRaisesRegex(api.UsageError, 'DbHost'):
+            api.Runner({'test': self.conf}, 'test', args).run()
@@ -0,0 +1,99 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import zipfile
+
+from stormbee.artifacts import ArtifactStore
+
+
+class ArtifactStoreTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.conf = {'ArtifactDir': self.tmpdir.name}
+
+    def test_capture(self):
+        log_path = os.path.join(self.tmpdir.name, 'browser.log')
+        with open(log_path, 'w') as f:
+            f.write('console.log: hello\n')
+        bd = Mock(browser_log=log_path)
+        bd.driver.get_screenshot_as_png.return_value = b'PNG'
+        bd.driver.page_source = '<html></html>'
+        bd.driver.current_url = 'https://example.com/home/'
+        bd.driver.execute_script.return_value = [{'name': 'x'}]
+        try:
+            raise Exception("Boom")
+        except Exception:
+            exc_info = sys.exc_info()
+
+        store = ArtifactStore(self.conf, 'test')
+        path = store.capture(bd, exc_info)
+        store.wait()
+        self.assertTrue(
+            path.startswith(os.path.join(self.tmpdir.name, 'test'))
+        )
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual(b'PNG', zf.read('screenshot.png'))
+            self.assertEqual(b'<html></html>', zf.read('page.html'))
+            self.assertIn(b'hello', zf.read('console.log'))
+            self.assertIn(b'"name": "x"', zf.read('performance.json'))
+            self.assertIn(b'Boom', zf.read('traceback.txt'))
+
+    def test_capture_survives_dead_browser(self):
+        bd = Mock(browser_log=None)
+        bd.driver.current_url = 'https://example.com/home/'
+        bd.driver.get_screenshot_as_png.side_effect = Exception("dead")
+        bd.driver.execute_script.side_effect = Exception("dead")
+        type(bd.driver).page_source = property(Mock(side_effect=Exception))
+        store = ArtifactStore(self.conf, 'test')
+        path = store.capture(bd)
+        store.wait()
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual(['url.txt'], zf.namelist())
+
+    def test_disabled(self):
+        store = ArtifactStore(dict(self.conf, CaptureArtifacts='no'), 'test')
+        self.assertIsNone(store.capture(Mock()))
+
+    def test_rotate(self):
+        store = ArtifactStore(dict(self.conf, ArtifactMaxBytes='250'), 'test')
+        os.makedirs(store.directory)
+        paths = []
+        for i in range(4):
+            path = os.path.join(store.directory, f"failure-{i}.zip")
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (time.time() + i, time.time() + i))
+            paths.append(path)
+        store.rotate(keep=paths[-1])
+        self.assertEqual(
+            ['failure-2.zip', 'failure-3.zip'],
+            sorted(
+                name
+                for name in os.listdir(store.directory)
+                if name.endswith('.zip')
+            ),
+        )
+
+        # Another run got there first
+        with patch('os.remove', side_effect=FileNotFoundError()):
+            store.max_bytes = 0
+            store.rotate(keep=paths[-1])
@@ -0,0 +1,76 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from argparse import Namespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from stormbee import compare
+
+
+class StatisticsTests(TestCase):
+    def test_median_ci(self):
+        values = list(range(1, 21))
+        self.assertEqual((6, 15), compare.median_ci(values))
+        # Too few values to narrow it down
+        self.assertEqual((1, 3), compare.median_ci([3, 1, 2]))
+        self.assertEqual((None, None), compare.median_ci([]))
+
+    def test_mann_whitney(self):
+        u, p = compare.mann_whitney([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        self.assertEqual(0, u)
+        self.assertAlmostEqual(0.0122, p, places=4)
+        u, p = compare.mann_whitney([1, 3, 5, 7], [2, 4, 6, 8])
+        self.assertEqual(6, u)
+        self.assertGreater(p, 0.5)
+        # Ties
+        u, p = compare.mann_whitney([5, 5, 5], [5, 5, 5])
+        self.assertEqual(4.5, u)
+        self.assertEqual(1.0, p)
+
+    def test_compare_steps(self):
+        results = compare.compare_steps(
+            {'Launch Desktop': [100, 110, 120], 'Login': [10]},
+            {'Launch Desktop': [150, 160, 170]},
+        )
+        self.assertEqual(
+            ['Launch Desktop', 'Login'], [r['step'] for r in results]
+        )
+        launch = results[0]
+        self.assertEqual(110, launch['a']['median'])
+        self.assertEqual(160, launch['b']['median'])
+        self.assertEqual(0.455, launch['change'])
+        self.assertIsNone(results[1]['p'])
+        self.assertIsNone(results[1]['change'])
+
+
+class RunCompareTests(TestCase):
+    @patch('stormbee.compare.Display')
+    @patch('stormbee.compare.run_once')
+    def test_interleaved(self, run_once, display):
+        run_once.side_effect = lambda conf, site, args, extra: (
+            [{'step': 'Launch Desktop', 'ms': conf['ms'], 'ok': True}],
+            None,
+        )
+        args = Namespace(
+            site_a='test', site_b='prod', runs=3, confidence=0.95, alpha=0.05
+        )
+        config = {'test': {'ms': 200}, 'prod': {'ms': 100}}
+        summary = compare.run_compare(config, args, [])
+        self.assertEqual(
+            ['test', 'prod', 'prod', 'test', 'test', 'prod'],
+            [c.args[1] for c in run_once.call_args_list],
+        )
+        self.assertEqual({'test': 0, 'prod': 0}, summary['failures'])
+        self.assertEqual(-0.5, summary['steps'][0]['change'])
@@ -0,0 +1,101 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+from unittest.mock import call, Mock, patch
+
+from stormbee import contexts
+from stormbee import driver
+from stormbee.tests.unit.test_driver import CONF
+
+
+class FakeFirefox:
+    "The parts of a Firefox driver that the contexts use."
+
+    def __init__(self, **kwargs):
+        self.session_id = 'session'
+        self.command_executor = Mock()
+        self.command_executor.execute.return_value = {'value': 'Home'}
+        self.error_handler = Mock()
+        self.service = Mock()
+        self.service.process.pid = 42
+        self.current_window_handle = 'home'
+        self.switch_to = Mock()
+        self.browser = Mock()
+        self.browser.create_user_context.side_effect = ['u1', 'u2']
+        self.browsing_context = Mock()
+        self.browsing_context.create.side_effect = ['w1', 'w2']
+        self.quit_calls = 0
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+class ContextTests(TestCase):
+    def setUp(self):
+        for name in ['Firefox', 'Service', 'GeckoDriverManager']:
+            patcher = patch(
+                f'stormbee.contexts.{name}',
+                FakeFirefox if name == 'Firefox' else Mock(),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.browser = contexts.ContextBrowser(CONF)
+        self.addCleanup(self.browser.quit)
+        self.fake = self.browser.driver
+
+    def test_contexts_take_turns(self):
+        a = self.browser.new_context()
+        b = self.browser.new_context()
+        self.fake.browsing_context.create.assert_called_with(
+            type='window', user_context='u2'
+        )
+        self.assertEqual('Home', a.title)
+        self.assertEqual('Home', b.title)
+        self.assertEqual('Home', b.title)
+        # Only switching when a different context sends a command
+        self.assertEqual(
+            [call('w1'), call('w2')],
+            self.fake.switch_to.window.call_args_list,
+        )
+        self.assertEqual(3, self.fake.command_executor.execute.call_count)
+
+        with self.assertRaisesRegex(Exception, 'shared browser context'):
+            a.switch_to.window('w2')
+
+        a.quit()
+        self.fake.browser.remove_user_context.assert_called_once_with('u1')
+        b.quit()
+        self.fake.switch_to.window.assert_called_with('home')
+        self.assertEqual([], self.browser.contexts)
+        self.assertEqual(0, self.fake.quit_calls)
+
+        self.browser.quit()
+        self.assertEqual(1, self.fake.quit_calls)
+
+    def test_driver_in_context(self):
+        browser = Mock(pid=42)
+        with patch('stormbee.driver.set_viewport_size'):
+            bd = driver.BumblebeeDriver(
+                dict(CONF, MonitorResources='True'), 'test', browser=browser
+            )
+        self.assertIs(browser.new_context.return_value, bd.driver)
+        self.assertFalse(bd.monitor_resources)
+        bd.navigations = 1000
+        bd.recycle_navigations = 10
+        self.assertIsNone(bd.recycle_reason())
+        context = bd.driver
+        bd.close()
+        context.quit.assert_called_once()
+        self.assertEqual({}, bd.leaked_processes)
@@ -0,0 +1,171 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import datetime
+from io import StringIO
+import json
+from unittest import skipIf
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+try:
+    from stormbee import db
+except ImportError:
+    # The DB actions need MySQLdb (i.e. mysqlclient)
+    db = None
+
+OLD = datetime.datetime(2024, 1, 2, 3, 4, 5)
+NEW = datetime.datetime(2024, 1, 5, 0, 0, 0)
+
+VMSTATUS_ROWS = [
+    ('vmstatus', 'alice', 'VM_Error', 2, OLD, 3 * 86400 + 3600),
+    ('vmstatus', 'bob', 'VM_Error', 1, NEW, 600),
+]
+RESOURCE_ROWS = [
+    ('cloudresource', 'bob', 'error_flag', 3, NEW, 7200),
+]
+
+
+@skipIf(db is None, "MySQLdb is not installed")
+class DBReporterTests(TestCase):
+    def setUp(self):
+        patcher = patch('stormbee.db.connect')
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cursor = Mock()
+        self.cursor.__iter__ = Mock(
+            side_effect=[iter(VMSTATUS_ROWS), iter(RESOURCE_ROWS)]
+        )
+        self.connect.return_value.cursor.return_value = self.cursor
+
+    def test_rows(self):
+        reporter = db.DBReporter({})
+        rows = list(reporter.rows(statuses=('VM_Error', 'VM_Waiting')))
+        self.assertEqual(VMSTATUS_ROWS + RESOURCE_ROWS, rows)
+        self.connect.return_value.cursor.assert_called_with(
+            db.MySQLdb.cursors.SSCursor
+        )
+        calls = self.cursor.execute.call_args_list
+        query, params = calls[0].args
+        resource_query = calls[1].args[0]
+        # One grouped query per table
+        self.assertIn('group by user.username, vmstatus.status', query)
+        self.assertIn('in (%s, %s)', query)
+        self.assertEqual(('VM_Error', 'VM_Waiting'), params)
+        self.assertIn('group by user.username', resource_query)
+        # By default, the age is from the record's creation
+        self.assertIn('min(vmstatus.created)', query)
+        self.assertNotIn('coalesce', query)
+        self.assertEqual(2, self.cursor.close.call_count)
+
+    def test_status_changed_column(self):
+        reporter = db.DBReporter({'DbStatusChangedColumn': 'modified'})
+        list(reporter.vmstatus_rows(('VM_Error',)))
+        query = self.cursor.execute.call_args.args[0]
+        self.assertIn('coalesce(vmstatus.modified, vmstatus.created)', query)
+        with self.assertRaisesRegex(Exception, 'DbStatusChangedColumn'):
+            db.DBReporter({'DbStatusChangedColumn': 'created); drop'})
+
+
+@skipIf(db is None, "MySQLdb is not installed")
+class DBRepairerTests(TestCase):
+    @patch('stormbee.db.connect')
+    def test_no_bumblebee_username(self, connect):
+        # Rather than changing some other user's records
+        with self.assertRaisesRegex(Exception, 'No BumblebeeUsername'):
+            db.DBRepairer({'Username': 'probe2'})
+        connect.return_value.cursor.assert_not_called()
+
+
+@skipIf(db is None, "MySQLdb is not installed")
+class ReportTests(TestCase):
+    def test_format_age(self):
+        self.assertEqual('-', db.format_age(None))
+        self.assertEqual('0m', db.format_age(59))
+        self.assertEqual('1m', db.format_age(60))
+        self.assertEqual('59m', db.format_age(3599))
+        self.assertEqual('1h 0m', db.format_age(3600))
+        self.assertEqual('23h 59m', db.format_age(86399))
+        self.assertEqual('1d 0h', db.format_age(86400))
+        self.assertEqual('3d 1h', db.format_age(3 * 86400 + 3600))
+
+    def test_totals(self):
+        report = db.make_report(iter(VMSTATUS_ROWS + RESOURCE_ROWS))
+        self.assertEqual(3, len(report['rows']))
+        self.assertEqual(
+            [
+                {
+                    'table': 'vmstatus',
+                    'status': 'VM_Error',
+                    'count': 3,
+                    'users': 2,
+                    'oldest': '2024-01-02 03:04:05',
+                    'stuck_seconds': 3 * 86400 + 3600,
+                },
+                {
+                    'table': 'cloudresource',
+                    'status': 'error_flag',
+                    'count': 3,
+                    'users': 1,
+                    'oldest': '2024-01-05 00:00:00',
+                    'stuck_seconds': 7200,
+                },
+            ],
+            report['totals'],
+        )
+
+    def test_table(self):
+        out = StringIO()
+        db.print_report(db.make_report(iter(VMSTATUS_ROWS)), out=out)
+        lines = out.getvalue().splitlines()
+        self.assertRegex(lines[0], r'^Table +User +Status +Count')
+        self.assertRegex(
+            lines[1],
+            r'^vmstatus +alice +VM_Error +2  2024-01-02 03:04:05  3d 1h$',
+        )
+        self.assertRegex(lines[2], r' 10m$')
+        self.assertEqual(
+            'Total vmstatus VM_Error: 3 records for 2 users, '
+            'oldest stuck for 3d 1h',
+            lines[3],
+        )
+
+    def test_no_records(self):
+        out = StringIO()
+        report = db.make_report(iter([]))
+        self.assertEqual({'rows': [], 'totals': []}, report)
+        db.print_report(report, out=out)
+        self.assertIn('No records in error', out.getvalue())
+
+    def test_json(self):
+        out = StringIO()
+        db.print_report(
+            db.make_report(iter(RESOURCE_ROWS)), format='json', out=out
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            [
+                {
+                    'table': 'cloudresource',
+                    'username': 'bob',
+                    'status': 'error_flag',
+                    'count': 3,
+                    'oldest': '2024-01-05 00:00:00',
+                    'stuck_seconds': 7200,
+                }
+            ],
+            report['rows'],
+        )
+        self.assertEqual(1, report['totals'][0]['users'])
+        self.assertEqual(7200, report['totals'][0]['stuck_seconds'])
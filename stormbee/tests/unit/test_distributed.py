@@ -0,0 +1,256 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import argparse
+from io import StringIO
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+from stormbee import api
+from stormbee import distributed
+
+CELLS = """
+# scenario zone desktop [arguments]
+basic melbourne ubuntu
+basic monash rocky --no-delete
+"""
+
+ARGS = argparse.Namespace(deadline=None, show_progress=False)
+
+
+class CoordinatorTests(TestCase):
+    def setUp(self):
+        self.conf = {
+            'LeaseDir': tempfile.mkdtemp(),
+            'Accounts': 'alice secret1\nbob secret2',
+            'WorkLeaseSeconds': '60',
+            'WorkerPollSeconds': '0.05',
+            'CoordinatorToken': 'magic',
+        }
+        patcher = patch('sys.stdout', new=StringIO())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def coordinator(self, **settings):
+        self.conf.update(settings)
+        return distributed.Coordinator(
+            self.conf, 'test', distributed.parse_cells(CELLS)
+        )
+
+    def test_parse_cells(self):
+        cells = distributed.parse_cells(CELLS)
+        self.assertEqual(
+            [
+                distributed.Cell('basic', 'melbourne', 'ubuntu', []),
+                distributed.Cell('basic', 'monash', 'rocky', ['--no-delete']),
+            ],
+            cells,
+        )
+        with self.assertRaisesRegex(Exception, 'line 1'):
+            distributed.parse_cells('basic melbourne')
+
+    def test_claim_and_complete(self):
+        coordinator = self.coordinator(Accounts='alice secret1')
+        work = coordinator.claim('w1')
+        self.assertEqual(0, work['id'])
+        self.assertEqual('alice', work['username'])
+        # There is another cell, but no free test account
+        self.assertIsNone(coordinator.claim('w2'))
+        self.assertTrue(coordinator.heartbeat('w1', 0))
+        self.assertFalse(coordinator.heartbeat('w2', 0))
+        self.assertFalse(coordinator.complete('w2', 0, {}))
+        self.assertTrue(coordinator.complete('w1', 0, {'outcome': 'success'}))
+        work = coordinator.claim('w2')
+        self.assertEqual(1, work['id'])
+        self.assertEqual('alice', work['username'])
+        self.assertFalse(coordinator.done)
+        coordinator.complete('w2', 1, {'outcome': 'failure', 'error': 'oops'})
+        self.assertTrue(coordinator.done)
+        self.assertIsNone(coordinator.claim('w1'))
+        results = coordinator.results()
+        self.assertEqual(['w1', 'w2'], [r['worker'] for r in results])
+        self.assertEqual('oops', results[1]['error'])
+        self.assertEqual(1, distributed.print_results(results))
+
+    def test_worker_lost(self):
+        coordinator = self.coordinator(WorkLeaseSeconds='0.05')
+        coordinator.items = coordinator.items[:1]
+        self.assertEqual(1, coordinator.claim('dead')['attempt'])
+        time.sleep(0.1)
+        work = coordinator.claim('live')
+        self.assertEqual((0, 2), (work['id'], work['attempt']))
+        # The lost worker's late result is ignored
+        self.assertFalse(coordinator.complete('dead', 0, {}))
+        time.sleep(0.1)
+        coordinator.expire()
+        self.assertTrue(coordinator.done)
+        result = coordinator.results()[0]
+        self.assertEqual(distributed.LOST, result['outcome'])
+        self.assertEqual(2, result['attempts'])
+        # The test account leases were released
+        self.assertIsNotNone(
+            coordinator.lease_manager.try_acquire(coordinator.pool[:1])
+        )
+
+    def test_workers(self):
+        "Several workers on one host share the cells."
+
+        coordinator = self.coordinator()
+        run = []
+
+        def execute(worker, work, lost=None):
+            run.append((worker.name, work['id'], work['username']))
+            time.sleep(0.1)
+            return {'outcome': 'success', 'steps': [{'step': 'launch'}]}
+
+        with patch.object(distributed.Worker, 'execute', execute):
+            with distributed.CoordinatorServer(
+                coordinator, token='magic'
+            ) as server:
+                workers = [
+                    distributed.Worker(
+                        server.url, {'test': self.conf}, 'test', ARGS, name=n
+                    )
+                    for n in ['w1', 'w2', 'w3']
+                ]
+                threads = [
+                    threading.Thread(target=worker.run) for worker in workers
+                ]
+                for thread in threads:
+                    thread.start()
+                coordinator.wait(timeout=10, poll_seconds=0.05)
+                for thread in threads:
+                    thread.join(10)
+                status = requests.get(
+                    f"{server.url}/status",
+                    headers={distributed.TOKEN_HEADER: 'magic'},
+                ).json()
+                self.assertEqual(
+                    403, requests.get(f"{server.url}/status").status_code
+                )
+
+        self.assertEqual(2, len(run))
+        # Each running cell had its own test account
+        self.assertEqual({'alice', 'bob'}, {r[2] for r in run})
+        self.assertEqual(2, status['done'])
+        self.assertEqual({'w1', 'w2', 'w3'}, set(status['workers']))
+        results = coordinator.results()
+        self.assertEqual(['success'] * 2, [r['outcome'] for r in results])
+        self.assertEqual([{'step': 'launch'}], results[0]['steps'])
+
+    def test_execute(self):
+        worker = distributed.Worker(
+            'http://coordinator', {'test': self.conf}, 'test', ARGS
+        )
+        work = {
+            'id': 1,
+            'scenario': 'basic',
+            'zone': 'monash',
+            'desktop': 'rocky',
+            'extra_args': ['--no-delete'],
+            'username': 'bob',
+        }
+        with patch('stormbee.api.Runner') as runner:
+            runner.return_value.run.return_value = api.Result(
+                'test', 'scenario', scenario='basic', account='bob'
+            )
+            result = worker.execute(work)
+        config, site_name, args = runner.call_args.args
+        self.assertEqual('secret2', config['test']['Password'])
+        self.assertEqual(('basic', 'rocky'), (args.name, args.desktop))
+        # The coordinator leased the account, so the run doesn't
+        self.assertEqual('bob', args.username)
+        self.assertEqual(
+            ['--no-delete'], runner.call_args.kwargs['extra_args']
+        )
+        self.assertEqual('success', result['outcome'])
+        self.assertEqual('bob', result['account'])
+
+        result = worker.execute(dict(work, username='mallory'))
+        self.assertEqual('failure', result['outcome'])
+
+    @patch('stormbee.distributed.watchdog.kill_descendants')
+    def test_lost_lease(self, kill_descendants):
+        "A worker that loses its lease abandons the cell."
+
+        worker = distributed.Worker(
+            'http://coordinator', {'test': self.conf}, 'test', ARGS
+        )
+        killed = threading.Event()
+        kill_descendants.side_effect = lambda: killed.set() or 3
+        posts = []
+
+        def post(path, body):
+            posts.append(path)
+            return {'held': False}
+
+        work = {
+            'id': 0,
+            'scenario': 'basic',
+            'zone': 'melbourne',
+            'desktop': 'ubuntu',
+            'extra_args': [],
+            'username': 'alice',
+            'lease_seconds': 0.15,
+        }
+        with (
+            patch('stormbee.api.Runner') as runner,
+            patch.object(worker, 'post', post),
+        ):
+            # The run hangs until its browser is killed
+            runner.return_value.run.side_effect = lambda: killed.wait(10)
+            lost = threading.Event()
+            lost.set()
+            result = worker.execute(work, lost=lost)
+            self.assertEqual(distributed.LOST, result['outcome'])
+            self.assertEqual('alice', result['account'])
+            killed.clear()
+            # The heartbeat finds that the lease was lost
+            worker.run_cell(work)
+        self.assertEqual(2, kill_descendants.call_count)
+        # The result wasn't posted, since the cell was reassigned
+        self.assertEqual(['/heartbeat'], posts)
+
+    def test_listen_needs_token(self):
+        args = argparse.Namespace(
+            cells='/nonexistent', listen='0.0.0.0:8470', timeout=None
+        )
+        with self.assertRaisesRegex(api.UsageError, 'CoordinatorToken'):
+            distributed.run_coordinator({}, 'test', args)
+        self.assertTrue(distributed.is_loopback('127.0.0.1'))
+        self.assertTrue(distributed.is_loopback('::1'))
+        self.assertTrue(distributed.is_loopback('localhost'))
+        self.assertFalse(distributed.is_loopback('coordinator.example.com'))
+
+    @patch('stormbee.distributed.report')
+    def test_report_results(self, mock_report):
+        coordinator = self.coordinator()
+        coordinator.claim('w1')
+        coordinator.complete('w1', 0, {'outcome': 'success'})
+        coordinator.give_up("Not finished")
+        distributed.report_results(self.conf, coordinator.results())
+        calls = mock_report.call_args_list
+        self.assertEqual(
+            'tempest_melbourne_desktop_basic_ubuntu', calls[0].args[1]
+        )
+        self.assertEqual(0, calls[0].kwargs['state'])
+        self.assertEqual(
+            'tempest_monash_desktop_basic_rocky', calls[1].args[1]
+        )
+        self.assertEqual(3, calls[1].kwargs['state'])
@@ -0,0 +1,437 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, PropertyMock, patch
+from urllib.parse import unquote
+
+from stormbee.constants import (
+    DESKTOP_EXISTS,
+    STATE_NOT_LOGGED_IN,
+    STATE_TOS,
+    STATE_UNKNOWN,
+)
+from stormbee import driver
+
+
+CONF = {
+    'Username': 'test-user',
+    'Password': 'secret',
+    'BaseUrl': 'https://vds.example.com',
+    'KeycloakLoginTitle': 'Sign in to Nectar',
+    'ClassicLoginTitle': 'Log in',
+    'PollSeconds': '0',
+    'CollectPageTimings': 'False',
+    'MonitorResources': 'False',
+    'DesktopTypeCacheSeconds': '0',
+}
+HOME_URL = 'https://vds.example.com/home/'
+
+
+def raw_snapshot(url=HOME_URL, title='Home', states=(), desktop=None):
+    return {
+        'origin': 1000.0,
+        'url': url,
+        'title': title,
+        'matches': [state in states for _, state in driver.STATE_XPATHS],
+        'desktop': desktop,
+        'percent': None,
+        'message': None,
+    }
+
+
+def make_driver(conf=CONF):
+    with (
+        patch('stormbee.driver.Firefox'),
+        patch('stormbee.driver.Service'),
+        patch('stormbee.driver.GeckoDriverManager'),
+        patch('stormbee.driver.set_viewport_size'),
+    ):
+        return driver.BumblebeeDriver(conf, 'test')
+
+
+class BrowserOptionsTests(TestCase):
+    def test_defaults(self):
+        options = driver.browser_options({})
+        self.assertEqual('normal', options.page_load_strategy)
+        self.assertNotIn('network.proxy.type', options.preferences)
+        self.assertNotIn('permissions.default.image', options.preferences)
+
+    def test_trimmed_profile(self):
+        options = driver.browser_options(
+            {
+                'PageLoadStrategy': 'Eager',
+                'BlockResourceTypes': 'image, font',
+                'BlockUrlPatterns': '*google-analytics.com*\n*/fonts/*',
+            }
+        )
+        self.assertEqual('eager', options.page_load_strategy)
+        prefs = options.preferences
+        self.assertEqual(2, prefs['permissions.default.image'])
+        self.assertFalse(prefs['gfx.downloadable_fonts.enabled'])
+        self.assertNotIn('permissions.default.stylesheet', prefs)
+        self.assertEqual(2, prefs['network.proxy.type'])
+        pac = unquote(prefs['network.proxy.autoconfig_url'])
+        self.assertIn('shExpMatch(url, "*google-analytics.com*")', pac)
+        self.assertIn('shExpMatch(url, "*/fonts/*")', pac)
+        self.assertIn('return "DIRECT";', pac)
+
+    def test_bad_settings(self):
+        with self.assertRaises(Exception):
+            driver.browser_options({'PageLoadStrategy': 'lazy'})
+        with self.assertRaises(Exception):
+            driver.browser_options({'BlockResourceTypes': 'image, html'})
+
+
+class SnapshotTests(TestCase):
+    def test_state_queries_share_one_snapshot(self):
+        bd = make_driver()
+        bd.driver.execute_script.return_value = raw_snapshot(
+            states=(driver.DESKTOP_EXISTS, driver.WORKFLOW_RUNNING),
+            desktop='ubuntu',
+        )
+        self.assertEqual(DESKTOP_EXISTS, bd.get_desktop_state())
+        self.assertEqual('ubuntu', bd.get_current_desktop())
+        self.assertEqual(DESKTOP_EXISTS, bd.get_desktop_state())
+        self.assertEqual(1, bd.driver.execute_script.call_count)
+        bd.driver.get.assert_not_called()
+
+    def test_click_invalidates(self):
+        bd = make_driver()
+        bd.driver.execute_script.return_value = raw_snapshot()
+        self.assertEqual(STATE_UNKNOWN, bd.get_desktop_state())
+        bd.click(Mock())
+        bd.get_desktop_state()
+        self.assertEqual(2, bd.driver.execute_script.call_count)
+
+    def test_navigates_home_when_elsewhere(self):
+        bd = make_driver()
+        bd.driver.execute_script.side_effect = [
+            raw_snapshot(url='https://vds.example.com/desktop/ubuntu'),
+            raw_snapshot(title='Log in'),
+        ]
+        self.assertEqual(STATE_NOT_LOGGED_IN, bd.get_desktop_state())
+        bd.driver.get.assert_called_once_with(HOME_URL)
+
+    def test_wait_for_worker_refreshes(self):
+        bd = make_driver()
+        busy = raw_snapshot(
+            states=(driver.DESKTOP_EXISTS, driver.WORKFLOW_RUNNING),
+            desktop='ubuntu',
+        )
+        done = raw_snapshot(states=(driver.DESKTOP_EXISTS,), desktop='ubuntu')
+        bd.driver.execute_script.side_effect = [busy, busy, done]
+        bd.wait_for_worker(Mock(show_progress=False))
+        self.assertEqual(3, bd.driver.execute_script.call_count)
+        self.assertEqual(DESKTOP_EXISTS, bd.get_desktop_state())
+        self.assertEqual(3, bd.driver.execute_script.call_count)
+
+
+class PageTimingTests(TestCase):
+    def test_timings_recorded_once_per_page(self):
+        bd = make_driver(dict(CONF, CollectPageTimings='True'))
+        nav = {
+            'name': HOME_URL,
+            'startTime': 0,
+            'requestStart': 10.0,
+            'responseStart': 250.0,
+            'loadEventEnd': 0,
+        }
+        timing = {'origin': 1000.0, 'navigation': nav, 'resources': []}
+        bd.driver.execute_script.side_effect = [
+            raw_snapshot(),
+            timing,
+            raw_snapshot(),
+            timing,
+        ]
+        with bd.timeit_context('Test step'):
+            bd.get_desktop_state()
+            bd.invalidate()
+            bd.get_desktop_state()
+        self.assertEqual(1, len(bd.page_timings))
+        self.assertEqual('Test step', bd.page_timings[0]['label'])
+        self.assertEqual(240.0, bd.page_timings[0]['ttfb'])
+        summary = bd.run_summary()
+        self.assertEqual('Test step', summary['steps'][0]['step'])
+        self.assertTrue(summary['steps'][0]['ok'])
+
+
+class RecycleTests(TestCase):
+    def test_no_policy(self):
+        bd = make_driver()
+        bd.navigations = 1000
+        self.assertIsNone(bd.recycle_reason())
+
+    def test_recycle_restores_session(self):
+        bd = make_driver(dict(CONF, RecycleNavigations='2'))
+        old = bd.driver
+        old.get_cookies.return_value = [{'name': 'sessionid', 'value': 'x'}]
+        bd.logged_in = True
+        bd.navigations = 1
+        bd.recycle_if_needed()
+        self.assertIs(old, bd.driver)
+        bd.navigations = 2
+        with (
+            patch('stormbee.driver.Firefox') as firefox,
+            patch('stormbee.driver.Service'),
+            patch('stormbee.driver.GeckoDriverManager'),
+            patch('stormbee.driver.set_viewport_size'),
+            patch.object(bd, 'login') as login,
+        ):
+            new = firefox.return_value
+            new.execute_script.return_value = raw_snapshot(
+                states=(driver.NO_DESKTOP,)
+            )
+            bd.recycle_if_needed()
+        old.quit.assert_called_once_with()
+        self.assertIs(new, bd.driver)
+        new.add_cookie.assert_called_once_with(
+            {'name': 'sessionid', 'value': 'x'}
+        )
+        login.assert_not_called()
+        self.assertEqual(1, bd.recycles)
+        self.assertEqual(1, bd.navigations)
+
+    def test_recycle_logs_in_again(self):
+        bd = make_driver(dict(CONF, RecycleAgeSeconds='60'))
+        bd.logged_in = True
+        bd.browser_started -= 61
+        with (
+            patch('stormbee.driver.Firefox') as firefox,
+            patch('stormbee.driver.Service'),
+            patch('stormbee.driver.GeckoDriverManager'),
+            patch('stormbee.driver.set_viewport_size'),
+            patch.object(bd, 'login') as login,
+        ):
+            firefox.return_value.execute_script.return_value = raw_snapshot(
+                title='Log in'
+            )
+            bd.recycle_if_needed()
+        login.assert_called_once_with(None)
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.bd = make_driver(dict(CONF, PageWaitSeconds='0.2'))
+        self.bd.driver.title = 'Sign in to Nectar'
+        # A new account is redirected to the Terms of Service page
+        self.bd.driver.execute_script.return_value = raw_snapshot(
+            title='Terms of Service', states=(STATE_TOS,)
+        )
+        for name in ['load_page', 'click']:
+            patcher = patch.object(self.bd, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_terms_of_service(self):
+        with self.assertRaisesRegex(Exception, "Login sequence didn't work"):
+            self.bd.login(None)
+        self.assertFalse(self.bd.logged_in)
+
+    def test_terms_of_service_allowed(self):
+        self.bd.login(None, allow_tos=True)
+        self.assertTrue(self.bd.logged_in)
+
+
+class NewWorkspaceTests(TestCase):
+    def test_waits_for_home_page(self):
+        bd = make_driver(dict(CONF, PageWaitSeconds='0.5'))
+        # The URL catches up with the page a little later
+        type(bd.driver).current_url = PropertyMock(
+            side_effect=['https://vds.example.com/terms/', HOME_URL]
+        )
+        with (
+            patch.object(bd, 'load_page'),
+            patch.object(bd, 'click', side_effect=Exception('clicked')),
+        ):
+            with self.assertRaisesRegex(Exception, 'clicked'):
+                bd.new_workspace(None)
+
+    def test_redirected(self):
+        bd = make_driver(dict(CONF, PageWaitSeconds='0.2'))
+        type(bd.driver).current_url = PropertyMock(
+            return_value='https://vds.example.com/terms/'
+        )
+        with patch.object(bd, 'load_page'):
+            with self.assertRaisesRegex(Exception, 'Redirected unexpectedly'):
+                bd.new_workspace(None)
+
+
+class CloseTests(TestCase):
+    def test_close_quits_browser(self):
+        bd = make_driver()
+        browser = bd.driver
+        bd.browser_pid = 42
+        with patch.object(
+            bd.resources, 'survivors', return_value={}
+        ) as survivors:
+            bd.close()
+        # Closing the window would leave geckodriver running
+        browser.quit.assert_called_once_with()
+        browser.close.assert_not_called()
+        # Only the browser's processes are checked: the display is still up
+        survivors.assert_called_once_with(roots=[42])
+        self.assertEqual({}, bd.leaked_processes)
+
+
+class RecordTests(TestCase):
+    def test_pages_recorded(self):
+        bd = make_driver()
+        bd.recorder = Mock()
+        bd.driver.page_source = '<html>...</html>'
+        bd.driver.execute_script.side_effect = [
+            raw_snapshot(
+                url='https://vds.example.com/desktop/ubuntu', title='Ubuntu'
+            ),
+            {'exists': True, 'boostable': True, 'zones': None},
+        ]
+        bd.load_page('https://vds.example.com/desktop/ubuntu')
+        bd.recorder.record.assert_called_once_with(
+            'https://vds.example.com/desktop/ubuntu',
+            'Ubuntu',
+            '<html>...</html>',
+            {
+                'state': STATE_UNKNOWN,
+                'desktop': None,
+                'desktop_type': {
+                    'exists': True,
+                    'boostable': True,
+                    'zones': None,
+                },
+            },
+        )
+
+
+class DesktopTypeTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.conf = dict(
+            CONF, CacheDir=tmp.name, DesktopTypeCacheSeconds='3600'
+        )
+
+    def test_cached(self):
+        info = {'exists': True, 'boostable': True, 'zones': ['melbourne']}
+        bd = make_driver(self.conf)
+        bd.driver.execute_script.return_value = info
+        args = Mock(desktop='ubuntu', zone='melbourne')
+        self.assertTrue(bd.is_boostable(args))
+        bd.driver.get.assert_called_once_with(
+            'https://vds.example.com/desktop/ubuntu'
+        )
+
+        # A later run doesn't need to load the page
+        bd = make_driver(self.conf)
+        self.assertTrue(bd.is_boostable(args))
+        bd.driver.get.assert_not_called()
+
+    def test_mismatch_rechecked(self):
+        bd = make_driver(self.conf)
+        bd.desktop_types.put(
+            'ubuntu', {'exists': True, 'boostable': False, 'zones': ['qld']}
+        )
+        bd.driver.execute_script.return_value = {
+            'exists': True,
+            'boostable': False,
+            'zones': ['qld', 'tas'],
+        }
+        args = Mock(desktop='ubuntu', zone='tas')
+        bd.check_desktop_type(args)
+        self.assertEqual(
+            ['qld', 'tas'], bd.desktop_types.get('ubuntu')['zones']
+        )
+
+        args.zone = 'nsw'
+        with self.assertRaisesRegex(Exception, 'Zone nsw is not available'):
+            bd.check_desktop_type(args)
+        self.assertEqual(2, bd.driver.get.call_count)
+
+    def test_check_without_loading(self):
+        "launch reads the facts from its own page if they aren't known."
+
+        bd = make_driver(self.conf)
+        args = Mock(desktop='ubuntu', zone=None)
+        self.assertIsNone(bd.check_desktop_type(args, load=False))
+        bd.driver.get.assert_not_called()
+        bd.desktop_types.put(
+            'ubuntu', {'exists': False, 'boostable': False, 'zones': None}
+        )
+        bd.driver.execute_script.return_value = {
+            'exists': False,
+            'boostable': False,
+            'zones': None,
+        }
+        # Known to be bad, so it is re-read before we give up
+        with self.assertRaisesRegex(Exception, 'does it exist'):
+            bd.check_desktop_type(args, load=False)
+        self.assertEqual(1, bd.driver.get.call_count)
+
+
+class EventTests(TestCase):
+    def test_step_and_progress_events(self):
+        bd = make_driver()
+        bd.events = Mock()
+        busy = raw_snapshot(
+            states=(driver.DESKTOP_EXISTS, driver.WORKFLOW_RUNNING),
+            desktop='ubuntu',
+        )
+        busy['percent'] = '50'
+        done = raw_snapshot(states=(driver.DESKTOP_EXISTS,), desktop='ubuntu')
+        bd.driver.execute_script.side_effect = [busy, busy, done]
+        with bd.timeit_context('Launch Desktop'):
+            bd.wait_for_worker(Mock(show_progress=False))
+        self.assertEqual(
+            ['step_start', 'progress', 'progress', 'step_end'],
+            [c.args[0] for c in bd.events.emit.call_args_list],
+        )
+        progress = bd.events.emit.call_args_list[1].kwargs
+        self.assertEqual('50', progress['percent'])
+        step_end = bd.events.emit.call_args_list[3].kwargs
+        self.assertEqual('Launch Desktop', step_end['step'])
+        self.assertTrue(step_end['ok'])
+
+
+class TimeToUsableTests(TestCase):
+    def test_time_to_usable(self):
+        bd = make_driver()
+        bd.driver.current_window_handle = 'home'
+        # No canvas, a blank canvas, and then a drawn one
+        bd.driver.execute_script.side_effect = [None, False, True]
+        bd.time_to_usable(url='http://127.0.0.1:8080/')
+        bd.driver.switch_to.new_window.assert_called_once_with('tab')
+        bd.driver.get.assert_called_once_with('http://127.0.0.1:8080/')
+        bd.driver.close.assert_called_once_with()
+        bd.driver.switch_to.window.assert_called_once_with('home')
+        self.assertEqual(
+            ['remote display canvas', 'first remote display frame'],
+            [w.description for w in bd.waiter.timings],
+        )
+        self.assertEqual('Time to usable desktop', bd.step_timings[0]['step'])
+        self.assertTrue(bd.step_timings[0]['ok'])
+
+    def test_follows_open_desktop_link(self):
+        bd = make_driver(dict(CONF, UsableWaitSeconds='0'))
+        link = Mock(**{'get_attribute.return_value': 'https://rd.example.com'})
+        bd.driver.find_element.return_value = link
+        bd.driver.execute_script.side_effect = [
+            raw_snapshot(states=(driver.DESKTOP_EXISTS,), desktop='ubuntu'),
+            False,
+            False,
+        ]
+        with self.assertRaisesRegex(Exception, "didn't draw anything"):
+            bd.time_to_usable()
+        bd.driver.get.assert_called_once_with('https://rd.example.com')
+        bd.driver.close.assert_called_once_with()
+        self.assertFalse(bd.step_timings[0]['ok'])
@@ -0,0 +1,77 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import io
+import json
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from stormbee import events
+
+
+class BlockedStream(io.StringIO):
+    "A stream whose writes wait until it is unblocked."
+
+    def __init__(self):
+        super().__init__()
+        self.unblocked = threading.Event()
+
+    def write(self, text):
+        self.unblocked.wait(5)
+        return super().write(text)
+
+
+class EventWriterTests(TestCase):
+    def test_json_lines(self):
+        stream = io.StringIO()
+        writer = events.EventWriter(stream, site='test')
+        writer.emit('step_start', step='Launch Desktop')
+        writer.emit('step_end', step='Launch Desktop', ms=1234, ok=True)
+        writer.close()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(
+            ['step_start', 'step_end'], [e['event'] for e in lines]
+        )
+        self.assertEqual('test', lines[1]['site'])
+        self.assertEqual(1234, lines[1]['ms'])
+        self.assertEqual(lines[0]['run'], lines[1]['run'])
+        self.assertIn('ts', lines[0])
+
+    @patch('stormbee.events.MAX_QUEUED', 2)
+    def test_never_blocks(self):
+        stream = BlockedStream()
+        writer = events.EventWriter(stream)
+        for i in range(10):
+            writer.emit('progress', percent=i)
+        self.assertGreater(writer.dropped, 0)
+        stream.unblocked.set()
+        writer.close()
+        self.assertEqual(
+            10 - writer.dropped, len(stream.getvalue().splitlines())
+        )
+
+    @patch('stormbee.events.MAX_QUEUED', 2)
+    def test_close_stuck_writer(self):
+        stream = BlockedStream()
+        self.addCleanup(stream.unblocked.set)
+        writer = events.EventWriter(stream)
+        for i in range(10):
+            writer.emit('progress', percent=i)
+        # The queue is full, and the writer can't empty it
+        start = time.time()
+        writer.close(timeout=0.2)
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(writer._thread.is_alive())
@@ -0,0 +1,138 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import configparser
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from stormbee.accounts import Account
+from stormbee import leases
+
+
+POOL = [
+    Account('probe1', 'secret1', 'probe1@example.com'),
+    Account('probe2', 'secret2', None),
+]
+
+
+class AccountPoolTests(TestCase):
+    def test_pool_setting(self):
+        pool = leases.account_pool(
+            {
+                'Username': 'test-user',
+                'Password': 'secret',
+                'Accounts': '\nprobe1 secret1 probe1@example.com\n'
+                'probe2 secret2',
+            }
+        )
+        self.assertEqual(POOL, pool)
+
+    def test_default_pool(self):
+        pool = leases.account_pool(
+            {
+                'Username': 'test-user',
+                'Password': 'secret',
+                'BumblebeeUsername': 'test.user@example.com',
+            }
+        )
+        self.assertEqual(
+            [Account('test-user', 'secret', 'test.user@example.com')], pool
+        )
+
+    def test_leased_config(self):
+        config = configparser.ConfigParser()
+        config.read_string(
+            "[DEFAULT]\nLeaseDir = /tmp/leases\n"
+            "[test]\nBaseUrl = https://vds.example.com\n"
+            "Username = test-user\nPassword = 100%%\n"
+        )
+        leased = leases.leased_config(config['test'], POOL[0])
+        self.assertEqual('https://vds.example.com', leased['BaseUrl'])
+        self.assertEqual('/tmp/leases', leased.get('LeaseDir'))
+        self.assertEqual('probe1', leased['Username'])
+        self.assertEqual('probe1@example.com', leased['BumblebeeUsername'])
+        # The site's own config is unchanged
+        self.assertEqual('test-user', config['test']['Username'])
+
+        leased = leases.leased_config({'Username': 'x'}, POOL[1])
+        self.assertEqual({'Username': 'probe2', 'Password': 'secret2'}, leased)
+
+    def test_leased_config_without_bumblebee_username(self):
+        # The site's BumblebeeUsername belongs to another account
+        config = configparser.ConfigParser()
+        config.read_string(
+            "[DEFAULT]\nBumblebeeUsername = test.user@example.com\n"
+            "[test]\nUsername = test-user\nPassword = secret\n"
+        )
+        leased = leases.leased_config(config['test'], POOL[1])
+        self.assertEqual('probe2', leased['Username'])
+        self.assertNotIn('BumblebeeUsername', leased)
+        leased = leases.leased_config(dict(config['test']), POOL[1])
+        self.assertNotIn('BumblebeeUsername', leased)
+
+
+class LeaseManagerTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.conf = {'LeaseDir': self.tmp.name, 'LeaseWaitSeconds': '0'}
+
+    def manager(self, **conf):
+        return leases.LeaseManager(dict(self.conf, **conf), 'test')
+
+    def test_exclusive(self):
+        manager = self.manager()
+        first = manager.acquire(POOL)
+        second = manager.acquire(POOL)
+        self.assertEqual('probe1', first.account.username)
+        self.assertEqual('probe2', second.account.username)
+        with self.assertRaisesRegex(Exception, 'No free test account'):
+            manager.acquire(POOL)
+        manager.release(first)
+        self.assertEqual('probe1', manager.acquire(POOL).account.username)
+
+    def test_expired_lease_reclaimed(self):
+        old = self.manager(LeaseSeconds='-1').acquire(POOL[:1])
+        manager = self.manager()
+        new = manager.acquire(POOL[:1])
+        self.assertNotEqual(old.token, new.token)
+        # Releasing the reclaimed lease leaves the new holder's alone
+        manager.release(old)
+        self.assertTrue(os.path.exists(new.path))
+
+    def test_dead_holder_reclaimed(self):
+        manager = self.manager()
+        lease = manager.acquire(POOL[:1])
+        with open(lease.path) as f:
+            holder = json.load(f)
+        # A pid that can't be running
+        holder['pid'] = 2**22 + 1
+        with open(lease.path, 'w') as f:
+            json.dump(holder, f)
+        self.assertIsNotNone(manager.try_acquire(POOL[:1]))
+
+    def test_other_host_not_reclaimed(self):
+        manager = self.manager()
+        holder = {
+            'pid': 2**22 + 1,
+            'host': 'elsewhere',
+            'expires': time.time() + 60,
+        }
+        os.makedirs(manager.directory)
+        with open(os.path.join(manager.directory, 'probe1.lease'), 'w') as f:
+            json.dump(holder, f)
+        self.assertIsNone(manager.try_acquire(POOL[:1]))
@@ -0,0 +1,88 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import argparse
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from stormbee import api
+from stormbee import main
+
+
+class PositiveIntTests(TestCase):
+    def test_positive_int(self):
+        self.assertEqual(3, main.positive_int('3'))
+        for value in ['0', '-2', 'many']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                main.positive_int(value)
+
+
+class PrintResultTests(TestCase):
+    def print_result(self, action, **summary):
+        args = api.make_args(action)
+        result = api.Result('test', action, summary=summary, account='alice')
+        with patch('sys.stdout', new=StringIO()) as out:
+            main.print_result(args, result)
+        return out.getvalue().splitlines()
+
+    def test_browser_action(self):
+        resources = {
+            'samples': 3,
+            'peak_rss_mb': 512,
+            'cpu_seconds': 4.5,
+            'peak_processes': 9,
+        }
+        self.assertEqual(
+            [
+                'Test account: alice',
+                'Probe resource usage: peak RSS 512 MB, CPU 4.5 s, '
+                'peak processes 9',
+            ],
+            self.print_result('launch', resources=resources),
+        )
+
+    def test_reset(self):
+        self.assertEqual(
+            ["DB reset done: cleared {'vmstatus_errors': 1}"],
+            self.print_result(
+                'reset', db_errors={'vmstatus_errors': 1}, db_reset=True
+            )[1:],
+        )
+
+    def test_parallel(self):
+        contexts = [
+            {'account': 'alice', 'outcome': 'success', 'error': None},
+            {'account': 'bob', 'outcome': 'failure', 'error': 'oops'},
+        ]
+        self.assertEqual(
+            ['alice: success', 'bob: failure (oops)'],
+            self.print_result('parallel', contexts=contexts),
+        )
+
+    def test_onboard(self):
+        results = [
+            {
+                'username': 'alice',
+                'outcome': 'onboarded',
+                'steps': ['new_workspace'],
+                'seconds': 12.0,
+                'error': None,
+            }
+        ]
+        lines = self.print_result('onboard', onboard=results)
+        self.assertRegex(lines[1], r'^alice +onboarded +12\.0  new_workspace')
+        self.assertEqual(
+            '1 onboarded, 0 skipped (already onboarded), 0 failed', lines[2]
+        )
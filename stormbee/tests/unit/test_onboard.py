@@ -0,0 +1,102 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from stormbee.accounts import Account
+from stormbee.constants import (
+    NO_DESKTOP,
+    STATE_CREATE_WORKSPACE,
+    STATE_TOS,
+    STATE_UNKNOWN,
+)
+from stormbee import onboard
+
+CONF = {'Username': 'probe', 'Password': 'secret'}
+
+
+class OnboardTests(TestCase):
+    def setUp(self):
+        patcher = patch('stormbee.onboard.BumblebeeDriver')
+        self.driver_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('stormbee.onboard.NewUserScenario')
+        self.scenario_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bd = self.driver_cls.return_value
+
+    def onboard(self, state):
+        self.bd.get_desktop_state.return_value = state
+        return onboard.onboard_account(
+            CONF, 'test', Account('user1', 'pw1', 'bb1'), Mock()
+        )
+
+    def test_new_user(self):
+        result = self.onboard(STATE_TOS)
+        # The login mustn't wait for the home page
+        self.bd.login.assert_called_once()
+        self.assertTrue(self.bd.login.call_args.kwargs['allow_tos'])
+        self.assertEqual(onboard.ONBOARDED, result.outcome)
+        self.assertEqual(['agree', 'new_workspace'], result.steps)
+        config = self.driver_cls.call_args.args[0]
+        self.assertEqual('user1', config['Username'])
+        self.assertEqual('bb1', config['BumblebeeUsername'])
+        self.scenario_cls.assert_called_once()
+        self.assertEqual(
+            ['--as-required'], self.scenario_cls.call_args.args[2]
+        )
+        self.bd.close.assert_called_once()
+
+    def test_workspace_only(self):
+        result = self.onboard(STATE_CREATE_WORKSPACE)
+        self.assertEqual(onboard.ONBOARDED, result.outcome)
+        self.assertEqual(['new_workspace'], result.steps)
+
+    def test_already_onboarded(self):
+        result = self.onboard(NO_DESKTOP)
+        self.assertEqual(onboard.SKIPPED, result.outcome)
+        self.scenario_cls.assert_not_called()
+
+    def test_failed(self):
+        result = self.onboard(STATE_UNKNOWN)
+        self.assertEqual(onboard.FAILED, result.outcome)
+        self.assertIn("state is 'State unknown'", result.error)
+        self.bd.close.assert_called_once()
+
+    def test_run_onboard(self):
+        self.bd.get_desktop_state.return_value = NO_DESKTOP
+        accounts = [Account(f"user{i}", 'pw', None) for i in range(5)]
+        with (
+            patch('stormbee.onboard.Display'),
+            patch('stormbee.onboard.GeckoDriverManager') as manager,
+            patch('sys.stdout', new=StringIO()) as out,
+        ):
+            manager.return_value.install.return_value = '/bin/geckodriver'
+            results = onboard.run_onboard(
+                CONF, 'test', accounts, Mock(), parallel=2
+            )
+        # The results are printed once, by print_results
+        self.assertEqual('', out.getvalue())
+        # geckodriver was installed once, for all of the browsers
+        manager.return_value.install.assert_called_once_with()
+        self.assertEqual(
+            ['/bin/geckodriver'] * 5,
+            [c.kwargs['geckodriver'] for c in self.driver_cls.call_args_list],
+        )
+        self.assertEqual(
+            [a.username for a in accounts], [r.username for r in results]
+        )
+        self.assertEqual(0, onboard.print_results(results))
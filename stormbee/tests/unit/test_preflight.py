@@ -0,0 +1,87 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import requests
+
+from stormbee import preflight
+
+CONF = {
+    'BaseUrl': 'https://vds.example.com',
+    'KeycloakLoginTitle': 'Sign in to Nectar',
+    'ClassicLoginTitle': 'Log in',
+    'NagiosTargetHost': 'vds.example.com',
+    'NagiosURL': 'https://nagios.example.com/nrdp/',
+    'NagiosToken': 'token',
+}
+
+
+def page(title, status=200):
+    return Mock(
+        status_code=status,
+        url='https://auth.example.com/login',
+        text=f"<html><head><title>{title}</title></head></html>",
+    )
+
+
+@patch('stormbee.preflight.requests.get')
+class PreflightTests(TestCase):
+    def test_passed(self, get):
+        get.return_value = page('Sign in to Nectar')
+        results = preflight.run_preflight(CONF, ['site', 'nrdp'])
+        self.assertEqual(['site', 'nrdp'], [r[0] for r in results])
+        self.assertEqual([], preflight.preflight_errors(results))
+        get.assert_any_call('https://vds.example.com/home/', timeout=3.0)
+
+    def test_unreachable(self, get):
+        get.side_effect = requests.ConnectionError('refused')
+        results = preflight.run_preflight(
+            dict(CONF, PreflightTimeoutSeconds='0.5'), ['site']
+        )
+        self.assertEqual(
+            [
+                "site: Site https://vds.example.com/home/ is unreachable: "
+                "refused"
+            ],
+            preflight.preflight_errors(results),
+        )
+        get.assert_called_once_with(
+            'https://vds.example.com/home/', timeout=0.5
+        )
+
+    def test_wrong_login_page(self, get):
+        get.return_value = page('Log in')
+        errors = preflight.preflight_errors(
+            preflight.run_preflight(CONF, ['site'])
+        )
+        self.assertIn("Expected the login page 'Sign in to Nectar'", errors[0])
+
+        get.return_value = page('Bad Gateway', status=502)
+        errors = preflight.preflight_errors(
+            preflight.run_preflight(CONF, ['site'])
+        )
+        self.assertIn("returned HTTP 502", errors[0])
+
+    def test_nrdp_settings(self, get):
+        conf = dict(CONF)
+        del conf['NagiosToken']
+        errors = preflight.preflight_errors(
+            preflight.run_preflight(conf, ['nrdp'])
+        )
+        self.assertEqual(
+            ['nrdp: Missing Nagios settings: NagiosToken'], errors
+        )
+        get.assert_not_called()
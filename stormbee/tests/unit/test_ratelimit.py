@@ -0,0 +1,67 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from stormbee import ratelimit
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.conf = {
+            'CacheDir': tmp.name,
+            'LoginsPerMinute': '6',
+            'RateLimitBurst': '2',
+        }
+
+    def test_unlimited(self):
+        limiter = ratelimit.RateLimiter(self.conf, 'test')
+        self.assertEqual(0, limiter.acquire('navigation'))
+        self.assertFalse(os.path.exists(limiter.path))
+        self.assertEqual({}, limiter.summary())
+
+    @patch('stormbee.ratelimit.time')
+    def test_shared_bucket(self, mock_time):
+        mock_time.time.return_value = 1000.0
+        # Two limiters for the same site, as if in two processes
+        first = ratelimit.RateLimiter(self.conf, 'test')
+        second = ratelimit.RateLimiter(self.conf, 'test')
+        self.assertEqual(0, first.acquire('login'))
+        self.assertEqual(0, second.acquire('login'))
+        # The burst is used up: one token every 10 seconds
+        self.assertEqual(10, first.acquire('login'))
+        self.assertEqual(20, second.acquire('login'))
+        mock_time.sleep.assert_called_with(20)
+        # Later, the bucket has refilled
+        mock_time.time.return_value = 1100.0
+        self.assertEqual(0, first.acquire('login'))
+        self.assertEqual(
+            {'login': {'count': 3, 'waited': 1, 'wait_ms': 10_000}},
+            first.summary(),
+        )
+        self.assertEqual(20, second.total_wait)
+
+    def test_other_site(self):
+        limiter = ratelimit.RateLimiter(self.conf, 'test')
+        other = ratelimit.RateLimiter(self.conf, 'prod')
+        for _ in range(2):
+            limiter.acquire('login')
+        with patch('stormbee.ratelimit.time.sleep') as sleep:
+            other.acquire('login')
+        sleep.assert_not_called()
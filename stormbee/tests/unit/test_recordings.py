@@ -0,0 +1,136 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import tempfile
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from stormbee.constants import DESKTOP_EXISTS, STATE_UNKNOWN
+from stormbee import recordings
+
+
+CONF = {
+    'KeycloakLoginTitle': 'Sign in to Nectar',
+    'ClassicLoginTitle': 'Log in',
+}
+
+HOME_PAGE = """
+<html><head><title>Home</title></head><body>
+<div id="researcher_desktop-ubuntu-card">
+  <h3>Your Virtual Desktop is ready</h3>
+</div>
+</body></html>
+"""
+
+DESKTOP_PAGE = """
+<html><head><title>Ubuntu</title></head><body>
+<h6>DEFAULT SIZE</h6>
+<p id="researcher_workspace-ubuntu-melbourne">Melbourne</p>
+</body></html>
+"""
+
+
+class RecordingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def record_corpus(self):
+        recorder = recordings.Recorder(self.tmp.name)
+        recorder.record(
+            'https://vds.example.com/home/',
+            'Home',
+            HOME_PAGE,
+            {'state': DESKTOP_EXISTS, 'desktop': 'ubuntu'},
+        )
+        recorder.record(
+            'https://vds.example.com/desktop/ubuntu',
+            'Ubuntu',
+            DESKTOP_PAGE,
+            {
+                'desktop_type': {
+                    'exists': True,
+                    'boostable': False,
+                    'zones': ['melbourne'],
+                }
+            },
+        )
+        return recorder
+
+    def test_round_trip(self):
+        recorder = self.record_corpus()
+        self.assertIsNone(
+            recorder.record(
+                'https://vds.example.com/home/', 'Home', HOME_PAGE, {}
+            )
+        )
+        corpus = recordings.load_corpus(self.tmp.name)
+        self.assertEqual(['page-0001', 'page-0002'], [r.name for r in corpus])
+        self.assertEqual(HOME_PAGE, corpus[0].html)
+        # A new recorder carries on where the last one stopped
+        recorder = recordings.Recorder(self.tmp.name)
+        self.assertEqual(
+            'page-0003',
+            recorder.record(
+                'https://vds.example.com/home/', 'Home', '<p>new</p>', {}
+            ),
+        )
+
+    def test_offline_check(self):
+        self.record_corpus()
+        corpus = recordings.load_corpus(self.tmp.name)
+        results = recordings.check_corpus(
+            corpus,
+            lambda r: recordings.classify_offline(r, CONF),
+            repeat=3,
+        )
+        self.assertEqual([True, True], [r['ok'] for r in results])
+
+        # A template change that breaks the check
+        broken = corpus[0]._replace(
+            html=HOME_PAGE.replace('Virtual Desktop', 'Desktop')
+        )
+        results = recordings.check_corpus(
+            [broken], lambda r: recordings.classify_offline(r, CONF)
+        )
+        self.assertFalse(results[0]['ok'])
+        self.assertEqual(
+            {'recorded': DESKTOP_EXISTS, 'classified': STATE_UNKNOWN},
+            results[0]['mismatches']['state'],
+        )
+
+    def test_replay_server(self):
+        self.record_corpus()
+        corpus = recordings.load_corpus(self.tmp.name)
+        with recordings.ReplayServer(corpus) as server:
+            with urlopen(server.url(corpus[1])) as response:
+                self.assertEqual(DESKTOP_PAGE, response.read().decode())
+                self.assertEqual(
+                    recordings.REPLAY_CSP,
+                    response.headers['Content-Security-Policy'],
+                )
+            with self.assertRaises(HTTPError):
+                urlopen(server.url(corpus[1]).replace('0002', '0009'))
+
+    def test_desktop_type_from_url(self):
+        self.assertEqual(
+            'ubuntu',
+            recordings.desktop_type_from_url(
+                'https://vds.example.com/desktop/ubuntu'
+            ),
+        )
+        self.assertIsNone(
+            recordings.desktop_type_from_url('https://vds.example.com/home/')
+        )
@@ -0,0 +1,91 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import os
+import signal
+import subprocess
+import sys
+import time
+from unittest import skipUnless, TestCase
+
+from stormbee import resources
+
+
+@skipUnless(os.path.isdir('/proc'), "needs /proc")
+class ResourceMonitorTests(TestCase):
+    def start_sleeper(self):
+        # A parent with a child, like geckodriver and Firefox
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                '-c',
+                'import subprocess, sys; '
+                'subprocess.run([sys.executable, "-c", '
+                '"import time; time.sleep(30)"])',
+            ]
+        )
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        return proc
+
+    def test_read_stat(self):
+        name, ppid, cpu, start = resources.read_stat(os.getpid())
+        self.assertEqual(os.getppid(), ppid)
+        self.assertGreaterEqual(cpu, 0)
+        self.assertGreater(resources.read_rss(os.getpid()), 0)
+        self.assertIsNone(resources.read_stat(2**22 + 1))
+
+    def test_sample_and_survivors(self):
+        proc = self.start_sleeper()
+        monitor = resources.ResourceMonitor(interval=0.05)
+        monitor.add_root(proc.pid, 'browser')
+        for _ in range(50):
+            monitor.sample()
+            if monitor.peak_processes == 2:
+                break
+        summary = monitor.summary()
+        self.assertEqual(2, summary['peak_processes'])
+        self.assertGreater(summary['peak_rss_mb'], 0)
+
+        survivors = monitor.survivors(grace=0)
+        self.assertIn(proc.pid, survivors)
+        self.assertEqual(2, len(survivors))
+
+    def test_orphaned_survivor(self):
+        proc = self.start_sleeper()
+        monitor = resources.ResourceMonitor()
+        monitor.add_root(proc.pid, 'browser')
+        for _ in range(50):
+            monitor.sample()
+            if monitor.peak_processes == 2:
+                break
+            time.sleep(0.05)
+        (child,) = set(monitor.seen) - {proc.pid}
+        self.addCleanup(os.kill, child, signal.SIGKILL)
+        # The parent goes, and its child is reparented
+        proc.kill()
+        proc.wait()
+        self.assertEqual([child], list(monitor.survivors(grace=0)))
+        # A process with a reused pid isn't a survivor
+        name, start, root = monitor.seen[child]
+        monitor.seen[child] = (name, start - 1, root)
+        self.assertEqual({}, monitor.survivors(grace=0))
+
+    def test_no_survivors(self):
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        monitor = resources.ResourceMonitor()
+        monitor.add_root(proc.pid, 'browser')
+        monitor.sample()
+        proc.wait()
+        self.assertEqual({}, monitor.survivors(grace=0))
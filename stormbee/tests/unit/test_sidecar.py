@@ -0,0 +1,134 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from concurrent.futures import Future
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from stormbee import driver
+from stormbee.tests.unit.test_driver import CONF, make_driver, raw_snapshot
+
+DESKTOP_PAGE = (
+    "<html><head><title>Ubuntu</title></head><body>"
+    "<h6>DEFAULT SIZE</h6><h6>BOOST SIZE</h6>"
+    '<select id="researcher_workspace-ubuntu-zone" name="zone">'
+    '<option value="melbourne">Melbourne</option></select>'
+    "</body></html>"
+)
+LOGIN_PAGE = (
+    "<html><head><title>Sign in to Nectar</title></head><body></body></html>"
+)
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        patcher = patch('stormbee.sidecar.requests.Session')
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.bd = make_driver()
+        self.addCleanup(self.bd.close_side_session)
+        self.bd.driver.get_cookies.return_value = [
+            {'name': 'sessionid', 'value': 'abc', 'domain': 'vds.example.com'}
+        ]
+        self.args = Mock(desktop='ubuntu', zone='melbourne')
+
+    def test_prefetched(self):
+        self.session.get.return_value = Mock(text=DESKTOP_PAGE)
+        self.bd.prefetch_desktop_type(self.args)
+        info = self.bd.check_desktop_type(self.args)
+        self.assertEqual(
+            {'exists': True, 'boostable': True, 'zones': ['melbourne']}, info
+        )
+        self.session.cookies.set.assert_called_once_with(
+            'sessionid', 'abc', domain='vds.example.com', path='/'
+        )
+        self.session.get.assert_called_once_with(
+            'https://vds.example.com/desktop/ubuntu', timeout=10.0
+        )
+        # The browser wasn't needed
+        self.bd.driver.get.assert_not_called()
+
+    def test_not_logged_in(self):
+        # The browser is used if the side session fails
+        self.session.get.return_value = Mock(text=LOGIN_PAGE)
+        self.bd.driver.execute_script.return_value = {
+            'exists': True,
+            'boostable': False,
+            'zones': None,
+        }
+        self.bd.prefetch_desktop_type(self.args)
+        self.assertFalse(self.bd.is_boostable(self.args))
+        self.bd.driver.get.assert_called_once_with(
+            'https://vds.example.com/desktop/ubuntu'
+        )
+
+    def test_disabled(self):
+        bd = make_driver(dict(CONF, PipelineChecks='False'))
+        bd.prefetch_desktop_type(self.args)
+        self.assertIsNone(bd.side)
+        self.session.get.assert_not_called()
+
+    def test_refreshed_during_worker_wait(self):
+        # The facts are cached, but are re-read while the worker is busy
+        self.bd.desktop_types.put(
+            'ubuntu', {'exists': True, 'boostable': False, 'zones': None}
+        )
+        self.session.get.return_value = Mock(text=DESKTOP_PAGE)
+        busy = raw_snapshot(
+            states=(driver.DESKTOP_EXISTS, driver.WORKFLOW_RUNNING),
+            desktop='ubuntu',
+        )
+        done = raw_snapshot(states=(driver.DESKTOP_EXISTS,), desktop='ubuntu')
+        self.bd.driver.execute_script.side_effect = [busy, busy, done]
+        self.args.show_progress = False
+        self.bd.wait_for_worker(self.args)
+        self.session.get.assert_called_once_with(
+            'https://vds.example.com/desktop/ubuntu', timeout=10.0
+        )
+        self.assertTrue(self.bd.is_boostable(self.args))
+        self.bd.driver.get.assert_not_called()
+
+    @patch('stormbee.sidecar.SideSession.submit')
+    def test_refreshed_during_each_worker_wait(self, submit):
+        def run_now(func, *args):
+            future = Future()
+            future.set_result(func(*args))
+            return future
+
+        submit.side_effect = run_now
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.bd.desktop_types.ttl = 600
+        self.bd.desktop_types.path = os.path.join(tmp.name, 'types.json')
+        self.bd.desktop_types.put(
+            'ubuntu', {'exists': True, 'boostable': False, 'zones': None}
+        )
+        self.session.get.return_value = Mock(text=DESKTOP_PAGE)
+        busy = raw_snapshot(
+            states=(driver.DESKTOP_EXISTS, driver.WORKFLOW_RUNNING),
+            desktop='ubuntu',
+        )
+        done = raw_snapshot(states=(driver.DESKTOP_EXISTS,), desktop='ubuntu')
+        self.bd.driver.execute_script.side_effect = [busy, busy, done] * 2
+        self.args.show_progress = False
+        # Nothing checks the desktop type in between
+        self.bd.wait_for_worker(self.args)
+        self.bd.invalidate()
+        self.bd.wait_for_worker(self.args)
+        self.assertEqual(2, self.session.get.call_count)
+        # The refreshed facts were collected into the cache
+        self.assertEqual({}, self.bd._prefetches)
+        self.assertTrue(self.bd.desktop_types.get('ubuntu')['boostable'])
@@ -0,0 +1,105 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from stormbee.constants import DESKTOP_EXISTS
+from stormbee import soak
+
+
+def step(name, ms, ok=True):
+    return {'step': name, 'ms': ms, 'limiter_ms': 0, 'ok': ok}
+
+
+class TrendTests(TestCase):
+    def test_trend(self):
+        self.assertIsNone(soak.trend([1, 2]))
+        self.assertEqual((0.0, 0.0), soak.trend([5, 5, 5]))
+        slope, drift = soak.trend([100, 110, 120, 130, 140])
+        self.assertAlmostEqual(10, slope)
+        self.assertAlmostEqual(0.4, drift)
+
+    def test_flagging(self):
+        recorder = soak.SoakRecorder(drift_threshold=0.2)
+        for i in range(4):
+            recorder.record(
+                [
+                    step('Launch Desktop', 1000 + 200 * i),
+                    step('Delete Desktop', 500 + (i % 2)),
+                    step('Shelve Desktop', 10, ok=False),
+                ],
+                (100 + 10 * i) * 1_048_576,
+                {'resource_errors': i},
+            )
+        trends = {t['series']: t for t in recorder.trends()}
+        self.assertTrue(trends['step: Launch Desktop']['flagged'])
+        self.assertFalse(trends['step: Delete Desktop']['flagged'])
+        self.assertNotIn('step: Shelve Desktop', trends)
+        # The browser's RSS grew by 30%
+        self.assertEqual(130.0, trends['browser RSS (MB)']['last'])
+        self.assertTrue(trends['browser RSS (MB)']['flagged'])
+        self.assertTrue(trends['DB resource_errors']['flagged'])
+        self.assertFalse(trends['DB vmstatus_errors']['flagged'])
+        self.assertEqual(3, soak.print_trends(recorder.trends()))
+
+        # The RSS can have its own threshold
+        recorder.rss_threshold = 0.5
+        trends = {t['series']: t for t in recorder.trends()}
+        self.assertFalse(trends['browser RSS (MB)']['flagged'])
+        self.assertTrue(trends['step: Launch Desktop']['flagged'])
+
+
+@patch('stormbee.soak.tree_rss', return_value=200 * 1_048_576)
+class RunSoakTests(TestCase):
+    def test_run_soak(self, tree_rss):
+        bd = Mock(
+            step_timings=[],
+            recycle_navigations=100,
+            recycle_age=0,
+            recycle_rss=500 * 1_048_576,
+        )
+        bd.get_desktop_state.return_value = DESKTOP_EXISTS
+        runs = []
+
+        def run(action, args, extra_args):
+            # The browser isn't recycled during a soak
+            self.assertEqual(
+                (0, 0, 0),
+                (bd.recycle_navigations, bd.recycle_age, bd.recycle_rss),
+            )
+            runs.append(action)
+            bd.step_timings.append(step('Launch Desktop', 1000))
+            if len(runs) == 2:
+                raise Exception('boom')
+
+        bd.run.side_effect = run
+        args = Mock(
+            iterations=3,
+            duration=None,
+            pause=0,
+            drift_threshold=0.2,
+            rss_threshold=None,
+        )
+        summary = soak.run_soak(bd, {}, args, [])
+        self.assertEqual(['scenario'] * 3, runs)
+        self.assertEqual(1, summary['failures'])
+        self.assertEqual('boom', summary['iterations'][1]['error'])
+        self.assertEqual(0, summary['flagged'])
+        # The failed iteration was cleaned up
+        bd.delete.assert_called_once_with(args)
+        self.assertEqual(3, bd.events.emit.call_count)
+        # The recycling policy was put back
+        self.assertEqual(100, bd.recycle_navigations)
+        self.assertEqual(500 * 1_048_576, bd.recycle_rss)
@@ -0,0 +1,36 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+from urllib.request import urlopen
+
+from stormbee import standin
+
+
+class StandinTests(TestCase):
+    def test_delays(self):
+        with standin.StandinServer() as server:
+            with urlopen(f"{server.url}?connect=0.5&frame=2") as response:
+                page = response.read().decode()
+        self.assertIn('}, 2000);', page)
+        self.assertIn('}, 500);', page)
+        self.assertIn("createElement('canvas')", page)
+        self.assertIn("fillStyle = false ?", page)
+
+    def test_blank_frame(self):
+        with standin.StandinServer() as server:
+            with urlopen(f"{server.url}?blank=1") as response:
+                page = response.read().decode()
+        self.assertIn("fillStyle = true ? '#000000'", page)
+        self.assertIn("if (!true)", page)
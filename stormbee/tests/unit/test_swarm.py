@@ -0,0 +1,139 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+
+from stormbee.accounts import Account, parse_accounts
+from stormbee.constants import (
+    DESKTOP_EXISTS,
+    NO_DESKTOP,
+    STATE_NOT_LOGGED_IN,
+    WORKFLOW_RUNNING,
+)
+from stormbee import pages
+from stormbee import swarm
+
+
+CONF = {
+    'KeycloakLoginTitle': 'Sign in to Nectar',
+    'ClassicLoginTitle': 'Log in',
+}
+
+HOME_PAGE = """
+<html><head><title>Home</title></head><body>
+<div id="researcher_desktop-ubuntu-card">
+  <h3>Your Virtual Desktop is ready</h3>
+  <div id="researcher_desktop-ubuntu-delete-modal">
+    <form action="/rdesk/delete_vm/ubuntu" method="post">
+      <input type="hidden" name="csrfmiddlewaretoken" value="xyz">
+      <button type="submit" name="go" value="1">Delete</button>
+    </form>
+  </div>
+</div>
+</body></html>
+"""
+
+
+class PagesTests(TestCase):
+    def test_page_state(self):
+        doc = pages.parse(HOME_PAGE)
+        self.assertEqual(DESKTOP_EXISTS, pages.page_state(doc, CONF))
+        doc = pages.parse(
+            "<h4>You haven't created a Desktop yet</h4>"
+            "<p>The worker is busy ...</p>"
+        )
+        self.assertEqual(WORKFLOW_RUNNING, pages.page_state(doc, CONF))
+        doc = pages.parse("<h4>You haven't created a Desktop yet</h4>")
+        self.assertEqual(NO_DESKTOP, pages.page_state(doc, CONF))
+        doc = pages.parse("<title>Log in</title>")
+        self.assertEqual(STATE_NOT_LOGGED_IN, pages.page_state(doc, CONF))
+
+    def test_current_desktop(self):
+        self.assertEqual(
+            'ubuntu', pages.current_desktop(pages.parse(HOME_PAGE))
+        )
+        with self.assertRaises(Exception):
+            pages.current_desktop(pages.parse("<p>nothing</p>"))
+
+    def test_form_data(self):
+        doc = pages.parse(HOME_PAGE)
+        button = pages.find_button(doc, 'Delete')
+        form = button.ancestor('form')
+        self.assertEqual('/rdesk/delete_vm/ubuntu', form.get('action'))
+        self.assertEqual(
+            {'csrfmiddlewaretoken': 'xyz', 'go': '1', 'extra': 'x'},
+            pages.form_data(form, button, {'extra': 'x'}),
+        )
+
+    def test_desktop_type_info(self):
+        doc = pages.parse(
+            "<h6>DEFAULT SIZE</h6><h6>BOOST SIZE</h6>"
+            '<select id="researcher_workspace-ubuntu-zone" name="zone">'
+            '<option value="melbourne">M</option>'
+            '<option value="monash">N</option></select>'
+        )
+        self.assertEqual(
+            {
+                'exists': True,
+                'boostable': True,
+                'zones': ['melbourne', 'monash'],
+            },
+            pages.desktop_type_info(doc, 'ubuntu'),
+        )
+
+
+class SwarmTests(TestCase):
+    def test_start_offsets(self):
+        self.assertEqual([0.0] * 3, swarm.start_offsets('steady', 3))
+        self.assertEqual(
+            [0.0, 2.0, 4.0], swarm.start_offsets('ramp', 3, ramp_seconds=6)
+        )
+        self.assertEqual(
+            [0.0, 10.0, 10.0],
+            swarm.start_offsets('spike', 3, spike_at=10, baseline=1),
+        )
+        with self.assertRaises(Exception):
+            swarm.start_offsets('wobbly', 3)
+
+    def test_stats_summary(self):
+        stats = swarm.SwarmStats()
+        stats.start_time = 100
+        stats.end_time = 110
+        for seconds in [0.05, 0.2, 0.3, 2.0]:
+            stats.record('launch', seconds)
+        stats.record('launch', 1.0, ok=False)
+        stats.record_queue_wait(700)
+        summary = stats.summary()
+        launch = summary['steps']['launch']
+        self.assertEqual(4, launch['count'])
+        self.assertEqual(1, launch['errors'])
+        self.assertAlmostEqual(0.2, launch['error_rate'])
+        self.assertEqual(0.2, launch['p50'])
+        self.assertEqual(2.0, launch['max'])
+        self.assertEqual([1, 1, 1, 0, 1], launch['histogram'][:5])
+        self.assertAlmostEqual(0.4, summary['throughput'])
+        self.assertEqual(1, summary['queue_wait']['histogram'][-1])
+
+
+class AccountsTests(TestCase):
+    def test_parse_accounts(self):
+        self.assertEqual(
+            [
+                Account('a', 'pw1', None),
+                Account('b', 'pw2', 'b@example.com'),
+            ],
+            parse_accounts("# comment\na pw1\n\n b pw2 b@example.com\n"),
+        )
+        with self.assertRaises(Exception):
+            parse_accounts("lonely")
@@ -0,0 +1,92 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+
+from stormbee.timings import summarise_page
+
+
+NAVIGATION = {
+    'name': 'https://vds.example.com/home/',
+    'startTime': 0,
+    'redirectStart': 0,
+    'redirectEnd': 0,
+    'domainLookupStart': 5.0,
+    'domainLookupEnd': 25.0,
+    'connectStart': 25.0,
+    'connectEnd': 60.5,
+    'requestStart': 61.0,
+    'responseStart': 461.0,
+    'responseEnd': 480.0,
+    'domContentLoadedEventEnd': 700.0,
+    'loadEventEnd': 0,
+}
+
+RESOURCES = [
+    {
+        'name': 'https://cdn.example.com/app.css',
+        'type': 'link',
+        'start': 490.0,
+        'duration': 300.0,
+        'size': 1000,
+    },
+    {
+        'name': 'https://cdn.example.com/logo.png',
+        'type': 'img',
+        'start': 495.0,
+        'duration': 50.0,
+        'size': 200,
+    },
+    {
+        'name': 'https://vds.example.com/static/app.js',
+        'type': 'script',
+        'start': 491.0,
+        'duration': 120.0,
+        'size': 0,
+    },
+]
+
+
+class SummarisePageTests(TestCase):
+    def test_summarise(self):
+        summary = summarise_page(
+            {'navigation': NAVIGATION, 'resources': RESOURCES},
+            label='Launch Desktop',
+            slowest=2,
+        )
+        self.assertEqual('Launch Desktop', summary['label'])
+        self.assertEqual(NAVIGATION['name'], summary['url'])
+        self.assertIsNone(summary['redirect'])
+        self.assertEqual(20.0, summary['dns'])
+        self.assertEqual(35.5, summary['connect'])
+        self.assertEqual(400.0, summary['ttfb'])
+        self.assertEqual(19.0, summary['download'])
+        self.assertEqual(700.0, summary['dom_ready'])
+        self.assertIsNone(summary['load'])
+        self.assertEqual(3, summary['resource_count'])
+        self.assertEqual(1200, summary['resource_bytes'])
+        self.assertEqual(
+            ['https://cdn.example.com/app.css', RESOURCES[2]['name']],
+            [r['url'] for r in summary['slowest_resources']],
+        )
+        self.assertEqual(
+            {'count': 2, 'bytes': 1200, 'duration': 350.0},
+            summary['hosts']['cdn.example.com'],
+        )
+
+    def test_no_navigation_entry(self):
+        summary = summarise_page({'navigation': None, 'resources': []})
+        self.assertIsNone(summary['url'])
+        self.assertIsNone(summary['ttfb'])
+        self.assertEqual([], summary['slowest_resources'])
@@ -0,0 +1,122 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+from unittest import TestCase
+from unittest.mock import Mock
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+from stormbee import waits
+
+
+class WaiterTests(TestCase):
+    def test_element_appears(self):
+        element = Mock()
+        bd = Mock()
+        bd.driver.find_element.side_effect = [
+            NoSuchElementException(),
+            NoSuchElementException(),
+            element,
+        ]
+        waiter = waits.Waiter(bd, timeout=5, poll=0)
+        self.assertIs(
+            element, waiter.until(waits.ElementPresent(By.ID, 'modal'))
+        )
+        self.assertEqual(3, bd.driver.find_element.call_count)
+        self.assertEqual(1, len(waiter.timings))
+        self.assertEqual('element modal', waiter.timings[0].description)
+        self.assertTrue(waiter.timings[0].ok)
+
+    def test_clickable(self):
+        hidden = Mock(**{'is_displayed.return_value': False})
+        shown = Mock(
+            **{
+                'is_displayed.return_value': True,
+                'is_enabled.return_value': True,
+            }
+        )
+        bd = Mock()
+        bd.driver.find_element.side_effect = [hidden, shown]
+        waiter = waits.Waiter(bd, timeout=5, poll=0)
+        self.assertIs(
+            shown, waiter.until(waits.ElementClickable(By.ID, 'button'))
+        )
+
+    def test_within(self):
+        form = Mock()
+        bd = Mock()
+        waiter = waits.Waiter(bd, timeout=5, poll=0)
+        waiter.until(waits.ElementPresent(By.ID, 'username', within=form))
+        form.find_element.assert_called_once_with(By.ID, 'username')
+        bd.driver.find_element.assert_not_called()
+
+    def test_timeout(self):
+        bd = Mock()
+        bd.driver.current_url = 'https://example.com/login'
+        waiter = waits.Waiter(bd, timeout=0.05, poll=0.01)
+        with self.assertRaisesRegex(waits.WaitTimeout, 'Nope'):
+            waiter.until(
+                waits.UrlMatches('https://example.com/home/'), message='Nope'
+            )
+        self.assertFalse(waiter.timings[0].ok)
+        self.assertGreaterEqual(waiter.timings[0].seconds, 0.05)
+
+    def test_state_equals(self):
+        bd = Mock(home_url='https://example.com/home/')
+        bd.snapshot.side_effect = [
+            Mock(url='https://example.com/oidc/callback'),
+            Mock(url='https://example.com/home/'),
+            Mock(url='https://example.com/home/'),
+        ]
+        bd.page_state.side_effect = ['busy', 'ready']
+        waiter = waits.Waiter(bd, timeout=5, poll=0)
+        self.assertEqual('ready', waiter.until(waits.StateEquals('ready')))
+        bd.snapshot.assert_called_with(refresh=True)
+
+    def test_present(self):
+        bd = Mock()
+        bd.driver.find_element.side_effect = NoSuchElementException()
+        waiter = waits.Waiter(bd)
+        self.assertIsNone(waiter.present(By.ID, 'missing'))
+        self.assertEqual(1, bd.driver.find_element.call_count)
+        self.assertEqual(
+            [('element missing', False)],
+            [(t.description, t.ok) for t in waiter.timings],
+        )
+
+    def test_any_of(self):
+        disabled = Mock()
+        bd = Mock()
+        bd.driver.find_element.side_effect = [
+            NoSuchElementException(),
+            disabled,
+        ]
+        waiter = waits.Waiter(bd, timeout=5, poll=0)
+        popover = waits.ElementPresent(By.ID, 'popover')
+        condition, value = waiter.until(
+            waits.AnyOf(waits.ElementClickable(By.ID, 'button'), popover)
+        )
+        self.assertIs(popover, condition)
+        self.assertIs(disabled, value)
+        self.assertEqual(
+            'clickable element button or element popover',
+            waiter.timings[0].description,
+        )
+
+    def test_timings_capped(self):
+        waiter = waits.Waiter(Mock())
+        for _ in range(waits.MAX_WAIT_TIMINGS + 5):
+            waiter.present(By.ID, 'thing')
+        self.assertEqual(waits.MAX_WAIT_TIMINGS, len(waiter.timings))
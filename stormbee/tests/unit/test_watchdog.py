@@ -0,0 +1,66 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+
+import subprocess
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from stormbee import resources
+from stormbee import watchdog
+
+
+class WatchdogTests(TestCase):
+    @patch('stormbee.watchdog.os._exit')
+    def test_expiry(self, exit):
+        expired = threading.Event()
+        expire = Mock(side_effect=expired.set)
+        dog = watchdog.Watchdog(0.01, expire).start()
+        self.assertTrue(expired.wait(5))
+        dog._thread.join(5)
+        exit.assert_called_once_with(watchdog.DEADLINE_EXIT_CODE)
+        self.assertIn('test_expiry', dog.main_stack())
+
+    @patch('stormbee.watchdog.os._exit')
+    def test_cancel(self, exit):
+        expire = Mock()
+        dog = watchdog.Watchdog(0.5, expire).start()
+        dog.cancel()
+        dog._thread.join(5)
+        expire.assert_not_called()
+        exit.assert_not_called()
+
+    def test_run_with_timeout(self):
+        self.assertEqual(42, watchdog.run_with_timeout(lambda: 42, 5))
+        start = time.time()
+        self.assertIsNone(
+            watchdog.run_with_timeout(lambda: time.sleep(5), 0.05)
+        )
+        self.assertLess(time.time() - start, 1)
+
+
+class KillTests(TestCase):
+    def test_kill_descendants(self):
+        if not resources.ResourceMonitor().enabled:
+            self.skipTest("needs /proc")
+        parent = subprocess.Popen(['sh', '-c', 'sleep 30 & sleep 30 & wait'])
+        self.addCleanup(parent.kill)
+        deadline = time.time() + 5
+        while len(resources.process_tree([parent.pid])) < 3:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(2, watchdog.kill_descendants(parent.pid))
+        # The 'wait' returns once the children have gone
+        self.assertIsNotNone(parent.wait(5))
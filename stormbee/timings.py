@@ -0,0 +1,94 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Browser-side page timings.  Timings measured around Selenium calls
+# can't tell server time-to-first-byte from rendering or slow static
+# assets.  The browser's Navigation Timing and Resource Timing entries
+# can, so we collect and summarise them for each page that is loaded.
+
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+# The number of slowest resources to report for each page
+SLOWEST_RESOURCES = 5
+
+TIMING_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+return {
+  origin: performance.timeOrigin,
+  navigation: nav ? nav.toJSON() : null,
+  resources: performance.getEntriesByType('resource').map((r) => ({
+    name: r.name,
+    type: r.initiatorType,
+    start: r.startTime,
+    duration: r.duration,
+    size: r.transferSize,
+  })),
+};
+"""
+
+
+def _span(nav, start, end):
+    "The time between two navigation timing marks, or None if not reached."
+
+    if not nav.get(end) or nav.get(start) is None:
+        return None
+    return round(nav[end] - nav[start], 1)
+
+
+def summarise_page(raw, label=None, slowest=SLOWEST_RESOURCES):
+    """Summarise the TIMING_SCRIPT result for a page.
+
+    Times are in milliseconds.  The 'ttfb' is measured from the start of
+    the request, so it is the server's (e.g. Django's or Keycloak's)
+    response time.  The 'dom_ready' and 'load' times are measured from
+    the start of the navigation; 'load' is None if the page hadn't
+    finished loading when it was sampled (e.g. with an "eager" page load
+    strategy).
+    """
+
+    nav = raw.get('navigation') or {}
+    resources = raw.get('resources') or []
+    by_host = defaultdict(lambda: {'count': 0, 'bytes': 0, 'duration': 0.0})
+    for r in resources:
+        host = by_host[urlsplit(r['name']).netloc]
+        host['count'] += 1
+        host['bytes'] += r.get('size') or 0
+        host['duration'] += r.get('duration') or 0
+    return {
+        'label': label,
+        'url': nav.get('name'),
+        'redirect': _span(nav, 'redirectStart', 'redirectEnd'),
+        'dns': _span(nav, 'domainLookupStart', 'domainLookupEnd'),
+        'connect': _span(nav, 'connectStart', 'connectEnd'),
+        'ttfb': _span(nav, 'requestStart', 'responseStart'),
+        'download': _span(nav, 'responseStart', 'responseEnd'),
+        'dom_ready': _span(nav, 'startTime', 'domContentLoadedEventEnd'),
+        'load': _span(nav, 'startTime', 'loadEventEnd'),
+        'resource_count': len(resources),
+        'resource_bytes': sum(r.get('size') or 0 for r in resources),
+        'slowest_resources': [
+            {
+                'url': r['name'],
+                'type': r['type'],
+                'duration': round(r['duration'], 1),
+            }
+            for r in sorted(
+                resources, key=lambda r: r['duration'] or 0, reverse=True
+            )[:slowest]
+        ],
+        'hosts': {
+            host: dict(info, duration=round(info['duration'], 1))
+            for host, info in sorted(by_host.items())
+        },
+    }
@@ -0,0 +1,262 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# Explicit waits.  Rather than looking for an element once (and failing
+# if a modal is still animating in, or a page is slow to render), the
+# driver waits for a condition to become true, polling it at a short
+# interval up to a timeout.  Each wait records how long it took, which
+# shows how long the UI transitions really take.
+
+from collections import deque, namedtuple
+import logging
+import re
+import time
+
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+)
+
+LOG = logging.getLogger(__name__)
+
+# How long a wait took.  The 'ok' flag is False if it timed out.
+WaitTiming = namedtuple('WaitTiming', ['description', 'seconds', 'ok'])
+
+# The most wait timings kept.  A long session (e.g. a soak) keeps the
+# most recent ones.
+MAX_WAIT_TIMINGS = 1000
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+class Condition:
+    """Something to wait for.
+
+    The 'check' method returns a true value (which 'Waiter.until' returns)
+    when the condition is met, and a false value when it is not met yet.
+    """
+
+    def check(self, bd):
+        raise NotImplementedError("'check' must be implemented")
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class ElementPresent(Condition):
+    "The element is in the DOM.  The value is the element."
+
+    def __init__(self, by, value, within=None):
+        self.by = by
+        self.value = value
+        self.within = within
+
+    def find(self, bd):
+        return (self.within or bd.driver).find_element(self.by, self.value)
+
+    def check(self, bd):
+        return self.find(bd)
+
+    def __str__(self):
+        return f"element {self.value}"
+
+
+class ElementClickable(ElementPresent):
+    "The element is displayed and enabled.  The value is the element."
+
+    def check(self, bd):
+        element = self.find(bd)
+        if element.is_displayed() and element.is_enabled():
+            return element
+        return None
+
+    def __str__(self):
+        return f"clickable element {self.value}"
+
+
+class UrlMatches(Condition):
+    "The browser's URL matches a regex.  The value is the URL."
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def check(self, bd):
+        url = bd.driver.current_url
+        return url if re.fullmatch(self.pattern, url) else None
+
+    def __str__(self):
+        return f"URL matching {self.pattern}"
+
+
+class StateEquals(Condition):
+    """The home page shows one of the given states.  The value is the state.
+
+    This doesn't navigate to the home page; it waits for the browser to
+    get there (e.g. via redirects) and re-reads the page on each poll.
+    """
+
+    def __init__(self, *states):
+        self.states = states
+
+    def check(self, bd):
+        snapshot = bd.snapshot(refresh=True)
+        if snapshot.url != bd.home_url:
+            return None
+        state = bd.page_state(snapshot)
+        return state if state in self.states else None
+
+    def __str__(self):
+        return f"state in {list(self.states)}"
+
+
+# Is a (non-empty) canvas present, and has anything been drawn on it?
+# Returns null if there is no canvas, false if nothing has been drawn and
+# true if something has.  Each canvas is scaled down to a small probe
+# canvas.  "Drawn" means that some pixel isn't fully transparent, and the
+# pixels aren't all the same: a uniform (e.g. black) frame is a
+# placeholder, not a desktop.
+CANVAS_SCRIPT = """
+const canvases = Array.from(document.getElementsByTagName('canvas')).filter(
+  (c) => c.width > 0 && c.height > 0
+);
+if (!canvases.length) {
+  return null;
+}
+const probe = document.createElement('canvas');
+probe.width = 32;
+probe.height = 32;
+const ctx = probe.getContext('2d');
+for (const canvas of canvases) {
+  ctx.clearRect(0, 0, 32, 32);
+  try {
+    ctx.drawImage(canvas, 0, 0, 32, 32);
+  } catch (e) {
+    continue;
+  }
+  const data = ctx.getImageData(0, 0, 32, 32).data;
+  let opaque = false;
+  let varied = false;
+  for (let i = 0; i < data.length; i += 4) {
+    opaque = opaque || data[i + 3] !== 0;
+    varied = varied || data[i] !== data[0] || data[i + 1] !== data[1]
+      || data[i + 2] !== data[2] || data[i + 3] !== data[3];
+    if (opaque && varied) {
+      return true;
+    }
+  }
+}
+return false;
+"""
+
+
+class AnyOf(Condition):
+    """Any of the conditions is met.
+
+    The value is (the condition that was met, its value).  The conditions
+    are checked in order.
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def check(self, bd):
+        for condition in self.conditions:
+            try:
+                value = condition.check(bd)
+            except (NoSuchElementException, StaleElementReferenceException):
+                value = None
+            if value:
+                return condition, value
+        return None
+
+    def __str__(self):
+        return ' or '.join(str(c) for c in self.conditions)
+
+
+class CanvasPresent(Condition):
+    "A remote display canvas has been created (i.e. it has connected)."
+
+    def check(self, bd):
+        return bd.driver.execute_script(CANVAS_SCRIPT) is not None
+
+    def __str__(self):
+        return "remote display canvas"
+
+
+class CanvasDrawn(Condition):
+    "Something has been drawn on a remote display canvas."
+
+    def check(self, bd):
+        return bd.driver.execute_script(CANVAS_SCRIPT) is True
+
+    def __str__(self):
+        return "first remote display frame"
+
+
+class Waiter:
+    def __init__(self, bd, timeout=10, poll=0.1):
+        self.bd = bd
+        self.timeout = timeout
+        self.poll = poll
+        self.timings = deque(maxlen=MAX_WAIT_TIMINGS)
+
+    def until(self, condition, timeout=None, poll=None, message=None):
+        """Wait until the condition is met, and return its value.
+
+        Raises WaitTimeout (with the given message, if any) if the
+        condition isn't met within the timeout.  A zero timeout
+        checks the condition once.
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        poll = self.poll if poll is None else poll
+        start = time.time()
+        while True:
+            try:
+                value = condition.check(self.bd)
+            except (NoSuchElementException, StaleElementReferenceException):
+                value = None
+            elapsed = time.time() - start
+            if value:
+                self._record(condition, elapsed, True)
+                return value
+            if elapsed >= timeout:
+                self._record(condition, elapsed, False)
+                raise WaitTimeout(
+                    message
+                    or f"Timed out after {timeout}s waiting "
+                    f"for {condition}"
+                )
+            time.sleep(min(poll, timeout - elapsed))
+
+    def present(self, by, value):
+        "Check (without waiting) whether an element is present."
+
+        start = time.time()
+        try:
+            element = self.bd.driver.find_element(by, value)
+        except NoSuchElementException:
+            element = None
+        self._record(
+            ElementPresent(by, value), time.time() - start, bool(element)
+        )
+        return element
+
+    def _record(self, condition, seconds, ok):
+        self.timings.append(WaitTiming(str(condition), seconds, ok))
+        LOG.debug(
+            f"Wait for {condition} {'took' if ok else 'timed out after'} "
+            f"{int(seconds * 1_000)} ms"
+        )
@@ -0,0 +1,130 @@
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+# A hard deadline for a run.  If Firefox or geckodriver hangs, a Selenium
+# call can block indefinitely, and the run never gets as far as reporting
+# its result.  The watchdog is a thread that waits for the deadline.  If
+# the run hasn't finished by then, it calls a function that captures what
+# it can, kills the processes we started and reports the failure, and then
+# it ends the process.
+
+import logging
+import os
+import signal
+import sys
+import threading
+import traceback
+
+from stormbee.resources import process_tree
+
+LOG = logging.getLogger(__name__)
+
+# The exit status of a run that was ended by the watchdog
+DEADLINE_EXIT_CODE = 1
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Watchdog:
+    """Calls 'expire' if not cancelled within 'seconds', then exits.
+
+    The 'expire' function runs in the watchdog thread.  The process
+    exits when it returns (or raises), whatever the other threads are
+    doing.
+    """
+
+    def __init__(self, seconds, expire):
+        self.seconds = seconds
+        self.expire = expire
+        self.main_thread = threading.current_thread()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _run(self):
+        if self._cancelled.wait(self.seconds):
+            return
+        try:
+            self.expire()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(DEADLINE_EXIT_CODE)
+
+    def main_stack(self):
+        "Where the main thread is (i.e. what it is stuck on)."
+
+        frame = sys._current_frames().get(self.main_thread.ident)
+        if frame is None:
+            return ''
+        return ''.join(traceback.format_stack(frame))
+
+
+def run_with_timeout(func, timeout):
+    """Call 'func' in a thread, giving up on it after 'timeout' seconds.
+
+    Returns the result, or None if it failed or didn't finish in time.
+    This is for things that may hang, like talking to a hung browser.
+    """
+
+    result = []
+
+    def target():
+        try:
+            result.append(func())
+        except Exception as e:
+            LOG.debug(f"{func} failed: {e}")
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def kill_descendants(pid=None):
+    """Kill (SIGKILL) all of the descendants of a process (default: us).
+
+    That is, the browser, geckodriver and Xvfb.  Returns the number of
+    processes killed.  Parents are killed before their children, so that
+    they can't start replacements.
+    """
+
+    pid = pid or os.getpid()
+    tree = process_tree([pid])
+    tree.pop(pid, None)
+
+    def depth(p):
+        d = 0
+        while tree[p][1] in tree:
+            p = tree[p][1]
+            d += 1
+        return d
+
+    killed = 0
+    for p in sorted(tree, key=depth):
+        try:
+            os.kill(p, signal.SIGKILL)
+            killed += 1
+        except ProcessLookupError:
+            pass
+    return killed